@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import threading
+import time
+
+from dod.LatencyHistogram import LatencyHistogram
+from dod.ServerResponse import ServerResponse
+from dod.SessionManager import lost_control
+
+logger = logging.getLogger(__name__)
+
+'''
+asyncio client for the DoD robot HTTP API
+Mirrors the endpoint methods of myClient, but several requests can be in
+flight at the same time over a small pool of keep-alive connections.
+BlockingDropsClient wraps it for synchronous code such as the DoD class.
+'''
+
+# name : (endpoint template, argument names)
+ENDPOINTS = {
+  'connect': ("/DoD/Connect?ClientName={user}", ('user',)),
+  'disconnect': ("/DoD/Disconnect", ()),
+  'get_status': ("/DoD/get/Status", ()),
+  'get_position_names': ("/DoD/get/PositionNames", ()),
+  'get_task_names': ("/DoD/get/TaskNames", ()),
+  'get_current_positions': ("/DoD/get/CurrentPosition", ()),
+  'get_pulse_names': ("/DoD/get/PulseNames", ()),
+  'get_nozzle_status': ("/DoD/get/NozzleStatus", ()),
+  'get_task_details': ("/DoD/get/TaskDetails?TaskName={task_name}", ('task_name',)),
+  'get_drive_range': ("/DoD/get/DriveRange", ()),
+  'move': ("/DoD/do/Move?PositionName={position}", ('position',)),
+  'execute_task': ("/DoD/do/ExecuteTask?TaskName={value}", ('value',)),
+  'auto_drop': ("/DoD/do/AutoDrop", ()),
+  'move_to_interaction_point': ("/DoD/do/InteractionPoint", ()),
+  'move_x': ("/DoD/do/MoveX?X={value}", ('value',)),
+  'move_y': ("/DoD/do/MoveY?Y={value}", ('value',)),
+  'move_z': ("/DoD/do/MoveZ?Z={value}", ('value',)),
+  'select_nozzle': ("/DoD/do/SelectNozzle?Channel={channel}", ('channel',)),
+  'dispensing': ("/DoD/do/Dispensing?State={state}", ('state',)),
+  'setLED': ("/DoD/do/SetLED?Duration={duration}&Delay={delay}", ('duration', 'delay')),
+  'take_probe': ("/DoD/do/TakeProbe?Channel={channel}&ProbeWell={probe_well}&Volume={volume}",
+                 ('channel', 'probe_well', 'volume')),
+  'set_nozzle_parameters': ("/DoD/do/SetNozzleParameters?Active={active_nozzles}&Selected={selected_nozzles}"
+                            "&Volt={volts}&Pulse={pulse}&Freq={frequency}",
+                            ('active_nozzles', 'selected_nozzles', 'volts', 'pulse', 'frequency')),
+  'stop_task': ("/DoD/do/StopTask", ()),
+  'set_ip_offest': ("/DoD/do/InteractionPoint", ()),
+  'set_humidity': ("/DoD/do/SetHumidity?rH={value}", ('value',)),
+  'set_cooling_temp': ("/DoD/do/SetCoolingTemp?Temp={temp}", ('temp',)),
+  'close_dialog': ("/DoD/do/CloseDialog?Reference={reference}&Selection={selection}",
+                   ('reference', 'selection')),
+  'reset_error': ("/DoD/do/ResetError", ()),
+}
+
+# Read-only requests gathered by AsyncDropsClient.get_state
+STATE_ENDPOINTS = ('get_status', 'get_current_positions', 'get_nozzle_status')
+
+
+def _endpoint_method(name, template, args):
+  async def method(self, *values):
+    if len(values) != len(args):
+      raise TypeError(f"{name}() takes {len(args)} arguments ({', '.join(args)})")
+    return await self.request(template.format(**dict(zip(args, values))))
+  method.__name__ = name
+  method.__doc__ = f"Send {template}"
+  return method
+
+
+class _Connection:
+  """
+    One keep-alive HTTP/1.1 connection of the pool
+  """
+  def __init__(self, reader, writer):
+    self.reader = reader
+    self.writer = writer
+
+  def close(self):
+    self.writer.close()
+
+  async def get(self, host, endpoint):
+    self.writer.write(f"GET {endpoint} HTTP/1.1\r\nHost: {host}\r\n"
+                      f"Connection: keep-alive\r\n\r\n".encode('ascii'))
+    await self.writer.drain()
+    status = await self.reader.readline()
+    if not status:
+      raise ConnectionResetError("Robot closed the connection")
+    headers = {}
+    while True:
+      line = await self.reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      key, _, value = line.decode('latin-1').partition(':')
+      headers[key.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+      body = await self.reader.readexactly(int(headers['content-length']))
+      reusable = headers.get('connection', '').lower() != 'close'
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+      body = b''
+      while True:
+        size = int((await self.reader.readline()).split(b';')[0], 16)
+        if size == 0:
+          await self.reader.readline()
+          break
+        body += await self.reader.readexactly(size)
+        await self.reader.readline()
+      reusable = headers.get('connection', '').lower() != 'close'
+    else:
+      body = await self.reader.read()
+      reusable = False
+    return body, reusable
+
+
+class AsyncDropsClient:
+  """
+    asyncio client for the DoD robot
+
+    Parameters
+    ----------
+    ip : str
+    port : int
+    pool_size : int
+        Maximum number of connections, and so of requests in flight
+    user : str
+        ClientName used to take API control for 'Do' requests
+    lease : float
+        Seconds API control is kept after the last request, as in
+        SessionManager
+    timeout : float
+        Seconds to wait for a reply, asyncio.TimeoutError is raised after
+    enumerations : dict, optional
+        'do' endpoint template : allowed values, used to tell a lost API
+        control from a bad argument, see SessionManager.lost_control
+  """
+  def __init__(self, ip, port, pool_size=4, user="Test", lease=30.0, timeout=10.0, enumerations=None):
+    self.ip = ip
+    self.port = port
+    self.pool_size = pool_size
+    self.user = user
+    self.lease = lease
+    self.timeout = timeout
+    self.enumerations = enumerations
+    self._idle = []
+    self._slots = None
+    self._control = None
+    self.connected = False
+    self.expires = 0.0
+    self._expiry = None
+    # request latencies per endpoint, see latency.show()
+    self.latency = LatencyHistogram()
+
+  async def _open(self):
+    reader, writer = await asyncio.open_connection(self.ip, self.port)
+    return _Connection(reader, writer)
+
+  async def request(self, endpoint):
+    """
+      GET an endpoint and parse the reply
+
+      'Do' requests take API control first. A 'Do' rejected because
+      control was lost on the robot side (see SessionManager.lost_control)
+      is repeated once after reconnecting. A 'get' on an idle connection
+      that turns out to be closed is repeated once on a new one, other
+      failures, including asyncio.TimeoutError, are raised.
+    """
+    if self._slots is None:
+      # created lazily to bind to the running loop
+      self._slots = asyncio.Semaphore(self.pool_size)
+      self._control = asyncio.Lock()
+    if not endpoint.startswith("/DoD/do/"):
+      return await self._send(endpoint)
+    await self.acquire()
+    reply = await self._send(endpoint)
+    if lost_control(reply, endpoint, self.enumerations):
+      logger.warning("%s rejected without API control, reconnecting", endpoint)
+      self.connected = False
+      await self.acquire()
+      reply = await self._send(endpoint)
+    return reply
+
+  async def _send(self, endpoint):
+    async with self._slots:
+      logger.debug("sending %s", endpoint)
+      start = time.perf_counter()
+      reused = bool(self._idle)
+      conn = self._idle.pop() if reused else await self._open()
+      try:
+        body, reusable = await asyncio.wait_for(
+            conn.get(f"{self.ip}:{self.port}", endpoint), self.timeout)
+      except (ConnectionError, asyncio.IncompleteReadError):
+        conn.close()
+        # a 'Do' may have reached the robot, never repeat it
+        if not reused or endpoint.startswith("/DoD/do/"):
+          raise
+        # the robot dropped the idle connection before reading the request
+        logger.debug("Stale connection, resending %s", endpoint)
+        conn = await self._open()
+        try:
+          body, reusable = await asyncio.wait_for(
+              conn.get(f"{self.ip}:{self.port}", endpoint), self.timeout)
+        except BaseException:
+          conn.close()
+          raise
+      except BaseException:
+        conn.close()
+        raise
+      if reusable:
+        self._idle.append(conn)
+      else:
+        conn.close()
+    self.latency.record(endpoint, time.perf_counter() - start)
+    if self.connected:
+      self._touch()
+    return ServerResponse.from_bytes(body)
+
+  async def get_many(self, *names):
+    """
+      Run several argument-less read-only requests concurrently
+
+      Returns
+      -------
+      dict
+          name : ServerResponse
+    """
+    replies = await asyncio.gather(*(getattr(self, name)() for name in names))
+    return dict(zip(names, replies))
+
+  async def get_state(self):
+    """
+      Status (including humidity and temperatures), current position and
+      nozzle status, requested concurrently
+    """
+    return await self.get_many(*STATE_ENDPOINTS)
+
+  async def acquire(self):
+    """
+      Make sure API control is held and renew the lease
+    """
+    async with self._control:
+      if not self.connected or time.monotonic() > self.expires:
+        r = await self.connect(self.user)
+        if r.RESULTS != "Accepted":
+          logger.warning(f"Connect returned {r.RESULTS}, not holding API control")
+          return
+        self.connected = True
+      self._touch()
+
+  def _touch(self):
+    self.expires = time.monotonic() + self.lease
+    if self._expiry is None:
+      self._expiry = asyncio.get_running_loop().call_later(self.lease, self._expire)
+
+  def _expire(self):
+    self._expiry = None
+    if not self.connected:
+      return
+    remaining = self.expires - time.monotonic()
+    if remaining > 0:
+      self._expiry = asyncio.get_running_loop().call_later(remaining, self._expire)
+      return
+    logger.info("API control lease expired, disconnecting")
+    asyncio.ensure_future(self.release())
+
+  async def release(self):
+    """
+      Give API control back now
+    """
+    if self._expiry is not None:
+      self._expiry.cancel()
+      self._expiry = None
+    if self.connected:
+      self.connected = False
+      await self.disconnect()
+
+  async def close(self):
+    """
+      Release API control and close all connections
+    """
+    await self.release()
+    while self._idle:
+      self._idle.pop().close()
+
+
+for _name, (_template, _args) in ENDPOINTS.items():
+  setattr(AsyncDropsClient, _name, _endpoint_method(_name, _template, _args))
+
+
+class BlockingDropsClient:
+  """
+    Synchronous facade of AsyncDropsClient, usable in place of myClient
+
+    The asyncio loop runs in a daemon thread. Every endpoint method of
+    AsyncDropsClient is available as a blocking method returning the
+    ServerResponse, get_many and get_state still run their requests
+    concurrently. As with myClient, an endpoint method returns None if the
+    robot does not reply in time.
+  """
+  def __init__(self, ip, port, **kwargs):
+    self.client = AsyncDropsClient(ip, port, **kwargs)
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                    name=f"AsyncDropsClient {ip}:{port}")
+    self._thread.start()
+
+  def _run(self, coro):
+    return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+  def _reply(self, coro, name):
+    try:
+      return self._run(coro)
+    except asyncio.TimeoutError:
+      logger.warning("No reply to %s within %s s", name, self.client.timeout)
+      return None
+
+  def __getattr__(self, name):
+    if name in ENDPOINTS:
+      method = getattr(self.client, name)
+      return lambda *args: self._reply(method(*args), name)
+    raise AttributeError(name)
+
+  def send(self, endpoint):
+    return self._reply(self.client.request(endpoint), endpoint)
+
+  def get_many(self, *names):
+    return self._run(self.client.get_many(*names))
+
+  def get_state(self):
+    return self._run(self.client.get_state())
+
+  @property
+  def latency(self):
+    return self.client.latency
+
+  def release_control(self):
+    self._run(self.client.release())
+
+  def close(self):
+    self._run(self.client.close())
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
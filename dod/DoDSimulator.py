@@ -0,0 +1,419 @@
+import argparse
+import json
+import logging
+import random
+import socket
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from dod.LatencyHistogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+'''
+Local simulator of the DoD robot HTTP API for offline load and latency tests
+
+The endpoint spec (supported.json) is read once. Replies come from a model
+of the robot: moves and tasks keep it "Busy" for a while, the position,
+selected nozzles and dispensing state follow the 'Do' requests, and API
+control is needed for them. Latency, HTTP errors and dropped connections can
+be injected. load_test drives a simulator (or a real robot) with several
+clients and reports throughput and latency percentiles.
+
+    python -m dod.DoDSimulator --port 8081
+    python -m dod.DoDSimulator --load --threads 4 --duration 10
+'''
+
+
+class RobotState:
+    """
+        Modelled state of the robot, shared by all request threads
+
+        Parameters
+        ----------
+        positions : dict
+            Position name : (X, Y, Z)
+        move_speed : float
+            Drive speed for MoveX/Y/Z in µm/s
+        move_time : float
+            Duration of a Move to a named position [s]
+        task_time : float
+            Duration of tasks not in task_times [s]
+        task_times : dict, optional
+            Task name : duration [s]
+    """
+    def __init__(self, positions, move_speed=20000.0, move_time=2.0, task_time=5.0, task_times=None):
+        self.lock = threading.Lock()
+        self.positions = positions
+        self.move_speed = move_speed
+        self.move_time = move_time
+        self.task_time = task_time
+        self.task_times = task_times or {}
+        self.xyz = [0.0, 0.0, 500.0]
+        self.position_name = "Home"
+        self.busy_until = 0.0
+        self.running_task = ""
+        self.controller = None
+        self.activated_nozzles = "1,2"
+        self.selected_nozzles = "1"
+        self.dispensing = "Off"
+        self.nozzle_parameters = ["1,80,1,500,0", "2,80,1,500,0"]
+        self.humidity = 45.0
+        self.temperature = 22.0
+
+    def busy(self, now=None):
+        return (now or time.monotonic()) < self.busy_until
+
+    def _start(self, duration, task=""):
+        self.busy_until = time.monotonic() + duration
+        self.running_task = task
+
+    def status(self):
+        with self.lock:
+            busy = self.busy()
+            return {
+                "Position": dict(zip("XYZ", self.xyz)),
+                "RunningTask": self.running_task if busy else "",
+                "Dialog": {},
+                "LastProbe": "",
+                "Humidity": self.humidity,
+                "Temperature": self.temperature,
+                "BathTemp": self.temperature,
+            }, ("Busy" if busy else "Idle")
+
+    def current_position(self):
+        with self.lock:
+            return {"CurrentPosition": self.position_name,
+                    "Position": list(self.positions.get(self.position_name, self.xyz)),
+                    "PositionReal": list(self.xyz)}
+
+    def nozzle_status(self):
+        with self.lock:
+            return {"Activated Nozzles": self.activated_nozzles,
+                    "Selected Nozzles": self.selected_nozzles,
+                    "ID,Volt,Pulse,Freq,Volume": list(self.nozzle_parameters),
+                    "Dispensing": self.dispensing,
+                    "Trigger": self.dispensing == "Trigger"}
+
+    def move(self, name):
+        with self.lock:
+            if self.busy() or name not in self.positions:
+                return "Rejected"
+            self.xyz = list(self.positions[name])
+            self.position_name = name
+            self._start(self.move_time)
+            return "Accepted"
+
+    def move_axis(self, axis, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return "Rejected"
+        with self.lock:
+            if self.busy():
+                return "Rejected"
+            index = "XYZ".index(axis)
+            distance = abs(value - self.xyz[index])
+            self.xyz[index] = value
+            self.position_name = ""
+            self._start(distance/self.move_speed)
+            return "Accepted"
+
+    def execute_task(self, name):
+        with self.lock:
+            if self.busy():
+                return "Rejected"
+            self._start(self.task_times.get(name, self.task_time), name)
+            return "Accepted"
+
+    def stop_task(self):
+        with self.lock:
+            self.busy_until = 0.0
+            self.running_task = ""
+            return "Accepted"
+
+
+class DoDSimulator:
+    """
+        Threaded HTTP server answering like the DoD robot
+
+        Parameters
+        ----------
+        host : str
+        port : int
+            0 picks a free port, see `port` after construction
+        spec : str
+            supported.json with the endpoints, reply header and enumerations
+        latency : float
+            Mean extra delay of every reply [s]
+        jitter : float
+            Standard deviation of the extra delay [s]
+        error_rate : float
+            Fraction of requests answered with HTTP 500 and a non-JSON body
+        drop_rate : float
+            Fraction of requests whose connection is closed without a reply
+        seed : int, optional
+            Seed of the latency and error draws
+        kwargs
+            Passed to RobotState
+    """
+    def __init__(self, host="127.0.0.1", port=0, spec="supported.json", latency=0.0, jitter=0.0,
+                 error_rate=0.0, drop_rate=0.0, seed=None, **kwargs):
+        with open(spec) as f:
+            data = json.load(f)
+        self.header = data["header"]
+        self.payloads = {endpoint["API"].split('?')[0]: endpoint["payload"] for endpoint in data["endpoints"]}
+        names = self.payloads.get("/DoD/get/PositionNames") or ["Home"]
+        positions = {name: (1000.0*i, 0.0, 500.0) for i, name in enumerate(names)}
+        self.state = RobotState(positions, **kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._handlers = {
+            "/DoD/Connect": self._connect,
+            "/DoD/Disconnect": self._disconnect,
+            "/DoD/get/Status": lambda args: self.state.status(),
+            "/DoD/get/CurrentPosition": lambda args: self.state.current_position(),
+            "/DoD/get/NozzleStatus": lambda args: self.state.nozzle_status(),
+            "/DoD/get/PositionNames": lambda args: list(self.state.positions),
+            "/DoD/do/Move": lambda args: self.state.move(args.get("PositionName")),
+            "/DoD/do/MoveX": lambda args: self.state.move_axis("X", args.get("X")),
+            "/DoD/do/MoveY": lambda args: self.state.move_axis("Y", args.get("Y")),
+            "/DoD/do/MoveZ": lambda args: self.state.move_axis("Z", args.get("Z")),
+            "/DoD/do/ExecuteTask": lambda args: self.state.execute_task(args.get("TaskName")),
+            "/DoD/do/StopTask": lambda args: self.state.stop_task(),
+            "/DoD/do/Dispensing": self._dispensing,
+            "/DoD/do/SelectNozzle": self._select_nozzle,
+        }
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # buffer the reply so it leaves in one segment
+            wbufsize = -1
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+            def do_GET(self):
+                simulator._handle(self)
+
+        return Handler
+
+    def _draw(self):
+        with self._random_lock:
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter)) if self.latency or self.jitter else 0.0
+            return delay, self._random.random(), self._random.random()
+
+    def _handle(self, request):
+        self.requests += 1
+        delay, error, drop = self._draw()
+        if delay:
+            time.sleep(delay)
+        if drop < self.drop_rate:
+            request.close_connection = True
+            request.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if error < self.error_rate:
+            self._reply(request, 500, b"Internal Server Error", "text/plain")
+            return
+        url = urlsplit(request.path)
+        args = dict(parse_qsl(url.query))
+        handler = self._handlers.get(url.path)
+        if handler is None and url.path not in self.payloads:
+            self._reply(request, 404, b"", "text/plain")
+            return
+        status = "Busy" if self.state.busy() else "Idle"
+        if url.path.startswith("/DoD/do/") and self.state.controller is None:
+            result = "Rejected"
+        elif handler is None:
+            result = self.payloads[url.path]
+        else:
+            result = handler(args)
+            if isinstance(result, tuple):
+                result, status = result
+        if url.path.startswith("/DoD/do/") and result == "Accepted":
+            status = "Busy" if self.state.busy() else status
+        header = dict(self.header)
+        header["Time"] = time.strftime("%m/%d/%Y %I:%M:%S %p")
+        header["Status"] = {"Status": status, "StatusCode": 200}
+        header["LastID"] = self.requests
+        header["Result"] = result
+        self._reply(request, 200, json.dumps(header, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    @staticmethod
+    def _reply(request, code, body, content_type):
+        request.send_response(code)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _connect(self, args):
+        self.state.controller = args.get("ClientName", "")
+        return "Accepted"
+
+    def _disconnect(self, args):
+        self.state.controller = None
+        return "Accepted"
+
+    def _dispensing(self, args):
+        if args.get("State") not in ("Trigger", "Triggered", "Free", "Off"):
+            return "Rejected"
+        self.state.dispensing = args["State"]
+        return "Accepted"
+
+    def _select_nozzle(self, args):
+        channel = args.get("Channel", "")
+        if channel not in self.state.activated_nozzles.split(","):
+            return "Rejected"
+        self.state.selected_nozzles = channel
+        return "Accepted"
+
+    def start(self):
+        """
+            Serve from a background thread
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True,
+                                        name=f"DoDSimulator {self.host}:{self.port}")
+        self._thread.start()
+        logger.info("DoD simulator at http://%s:%s", self.host, self.port)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_test(make_client, threads=4, duration=5.0, mix=None, seed=0):
+    """
+        Drive clients from several threads and measure latency
+
+        Parameters
+        ----------
+        make_client : callable
+            Returns a new client (myClient, BlockingDropsClient, ...), one is
+            made per thread
+        threads : int
+        duration : float
+            Seconds to run
+        mix : dict, optional
+            Client method name : relative weight, argument-less methods
+            only. By default mostly status reads
+        seed : int
+
+        Returns
+        -------
+        dict
+            'requests', 'errors', 'throughput' (requests/s) and 'latency',
+            the LatencyHistogram summary per method
+    """
+    mix = mix or {'get_status': 6, 'get_current_positions': 2, 'get_nozzle_status': 2}
+    names, weights = list(mix), list(mix.values())
+    histogram = LatencyHistogram()
+    counts = {'requests': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def worker(index):
+        client = make_client()
+        rng = random.Random(seed + index)
+        done = errors = 0
+        while time.monotonic() < stop:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                r = getattr(client, name)()
+                if r is None:
+                    errors += 1
+                else:
+                    r.RESULTS
+            except Exception:
+                errors += 1
+            histogram.record(name, time.perf_counter() - start)
+            done += 1
+        with counts_lock:
+            counts['requests'] += done
+            counts['errors'] += errors
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.monotonic()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.monotonic() - start
+    return {'requests': counts['requests'], 'errors': counts['errors'],
+            'throughput': counts['requests']/elapsed,
+            'latency': histogram.summary()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='DoDSimulator',
+                                     description='simulated droplet on demand robot http api')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--spec", default="supported.json")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean added reply delay [s]")
+    parser.add_argument("--jitter", type=float, default=0.0, help="reply delay standard deviation [s]")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--load", action='store_true', help="run a load test against the simulator and exit")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--asynchronous", action='store_true', help="load test BlockingDropsClient instead of myClient")
+    args = parser.parse_args(argv)
+
+    sim = DoDSimulator(args.host, 0 if args.load else args.port, spec=args.spec, latency=args.latency,
+                       jitter=args.jitter, error_rate=args.error_rate, drop_rate=args.drop_rate)
+    if not args.load:
+        print(f"Simulator started http://{sim.host}:{sim.port}")
+        try:
+            sim.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        sim.server.server_close()
+        return
+
+    with sim:
+        if args.asynchronous:
+            from dod.AsyncDropsClient import BlockingDropsClient
+            make_client = lambda: BlockingDropsClient(sim.host, sim.port)
+        else:
+            from dod.DropsDriver import myClient
+            make_client = lambda: myClient(sim.host, sim.port, supported_json=args.spec, reload=False)
+        result = load_test(make_client, threads=args.threads, duration=args.duration)
+    print(f"{result['requests']} requests, {result['errors']} errors, {result['throughput']:.1f} requests/s")
+    for name, s in result['latency'].items():
+        print(f"{name:25s} mean {s['mean']*1e3:7.2f} ms  p50 {s['p50']*1e3:7.2f}  "
+              f"p90 {s['p90']*1e3:7.2f}  p99 {s['p99']*1e3:7.2f}  max {s['max']*1e3:7.2f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
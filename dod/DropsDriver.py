@@ -1,12 +1,16 @@
 import logging
 import pprint
 import argparse
+import threading
 
-from http.client import HTTPConnection
-from multiprocessing import Queue, Semaphore
+from http.client import HTTPConnection, HTTPException
+from queue import Queue
+from threading import Semaphore
 from dod.ServerResponse import ServerResponse
 from dod.SupporEndsHandler import SupportedEndsHandler
 from dod.HTTPTransceiver import HTTPTransceiver
+from dod.LatencyHistogram import LatencyHistogram
+from dod.SessionManager import SessionManager, lost_control
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +40,20 @@ Can be invoked via command line args or as orchestrated by higher level software
 
 
 class myClient:
-  def __init__(self, ip, port, supported_json="supported.json", reload=True, queue=None, **kwargs):
+  def __init__(self, ip, port, supported_json="supported.json", reload=True, queue=None, user="Test", lease=30.0, cache_file=None, max_age=3600.0, **kwargs):
+    """
+    reload : bool or 'background', optional
+        Fetch the robot's position and task names that are missing from the
+        endpoint cache or older than max_age seconds, otherwise only the
+        cache is read. 'background' reads the cache and fetches from a
+        daemon thread without waiting. See SupportedEndsHandler
+    lease : float, optional
+        Seconds the API control connection is held after the last request,
+        see SessionManager. None disables the session, 'Do' requests then
+        need an explicit connect
+    """
+    # one request/response exchange at a time, the session timer shares it
+    self.lock = threading.RLock()
     # dto pipelines
     self.__queue__ = Queue()
     self.__queue_ready__ = Semaphore(value=0)
@@ -44,20 +61,31 @@ class myClient:
     self.__IP__ = ip
     self.__PORT__ = port
     self.conn = HTTPConnection(host=self.__IP__, port=self.__PORT__)
-    self.transceiver = HTTPTransceiver(self.conn, self.__queue__, self.__queue_ready__)
+    # request latencies per endpoint, see latency.show()
+    self.latency = LatencyHistogram()
+    self.transceiver = HTTPTransceiver(self.conn, self.__queue__, self.__queue_ready__, latency=self.latency)
     logger.info(f"Connected to ip: {ip} port: {port}")
+    self.session = None if lease is None else SessionManager(self, user=user, lease=lease)
 
     # configuration persitence, updating
-    self.supported_ends_handler = SupportedEndsHandler(supported_json,self.conn)
-    if (reload):
+    self.supported_ends_handler = SupportedEndsHandler(supported_json, self.conn, cache_file=cache_file, max_age=max_age)
+    if reload == 'background':
+      self.supported_ends_handler.reload_all(background=True)
+    elif (reload):
       self.supported_ends_handler.reload_all()
+    else:
+      self.supported_ends_handler.load()
 
     # convinient member lambda for grabbing supported endpoitns
     self.supported_ends = lambda : self.supported_ends_handler.get_endpoints()
-    pprint.pprint(self.supported_ends())
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("Supported endpoints:\n%s", pprint.pformat(self.supported_ends()))
 
   def __del__(self):
       # close network connection
+      session = getattr(self, "session", None)
+      if session is not None:
+        session._cancel_timer()
       self.conn.close()
 
   '''
@@ -72,9 +100,10 @@ class myClient:
     Logs what functions is being called and returns the response. 
     '''
     def inner(self, *args):
-      logger.info(f"Invoking {func.__name__}")
-      func(self, *args)
-      resp = self.get_response()
+      logger.info("Invoking %s", func.__name__)
+      with self.lock:
+        func(self, *args)
+        resp = self.get_response()
       # TODO: Do something with None response globally
       # Check if we have a GUI (get_status) that needs to be cleared, May need
       # to happen per function basis
@@ -94,6 +123,8 @@ class myClient:
         The client can end the connection with access to ‘Do’ requests.
         Clicking the button ‘Disable API Control’ on the UI has the same effect.
       """
+      if self.session is not None:
+        self.session.invalidate()
       self.send("/DoD/Disconnect")
 
   @middle_invocation_wrapper
@@ -362,13 +393,45 @@ class myClient:
     '''
     self.send(f"/DoD/do/ResetError")
 
+  def release_control(self):
+    """
+      Disconnect now instead of when the session lease expires
+    """
+    if self.session is not None:
+      self.session.release()
+
   '''
   send transmits a formatted HTTP GET request
   it will not check the validity of request
   it will persist result in a place that can be read... TODO: actually do this
   '''
   def send(self, endpoint):
-    self.transceiver.send(endpoint)
+    with self.lock:
+      control = self.session is not None and endpoint.startswith("/DoD/do/")
+      if control:
+        self.session.acquire()
+      try:
+        reply = self.transceiver.send(endpoint)
+      except (HTTPException, OSError) as e:
+        # HTTPConnection reconnects on the next request once closed
+        self.conn.close()
+        if self.session is not None:
+          self.session.invalidate()
+        if control:
+          # the request may have reached the robot, never repeat a 'Do'
+          logger.error("Connection lost during %s: %s", endpoint, e)
+          raise
+        logger.warning("Connection lost (%s), reconnecting for %s", e, endpoint)
+        self.transceiver.send(endpoint)
+      else:
+        if control and lost_control(reply, endpoint, self.supported_ends()['do']):
+          logger.warning("%s rejected without API control, reconnecting", endpoint)
+          self.get_response()
+          self.session.invalidate()
+          self.session.acquire()
+          self.transceiver.send(endpoint)
+      if self.session is not None:
+        self.session.touch()
     return
 
   '''
@@ -1,7 +1,8 @@
-import json
 import logging
-from http.client import HTTPConnection
-from multiprocessing import Queue, Semaphore
+import time
+from http.client import HTTPConnection, HTTPException
+from queue import Queue
+from threading import Semaphore
 from dod.ServerResponse import ServerResponse
 
 logger = logging.getLogger(__name__)
@@ -14,30 +15,39 @@ it will persist result in a place that can be read.
 
 
 class HTTPTransceiver():
-    def __init__(self, conn : HTTPConnection, queue : Queue, q_ready : Semaphore):
+    def __init__(self, conn : HTTPConnection, queue : Queue, q_ready : Semaphore, latency=None):
         self.__conn__ = conn
         self.__queue__ = queue
         self.__queue_ready__ = q_ready
+        # optional LatencyHistogram, times from request to parsed reply
+        self.latency = latency
 
     def send(self, endpoint : str):
-        logger.info(f"attempting to send: {endpoint}...")
-        print(endpoint)
-        self.__conn__.request("GET", endpoint)
-        logger.info("issued request")
+        logger.debug("attempting to send: %s", endpoint)
+        start = time.perf_counter()
+        try:
+          self.__conn__.request("GET", endpoint)
+        except (HTTPException, OSError) as e:
+          # Nothing reached the robot, repeat once on a fresh connection
+          logger.warning("Could not send %s (%s), reconnecting", endpoint, e)
+          self.__conn__.close()
+          self.__conn__.request("GET", endpoint)
         reply = self.__conn__.getresponse()
-        logger.info(f"got response {reply}")
         reply_obj = ServerResponse(reply)
+        if self.latency is not None:
+          self.latency.record(endpoint, time.perf_counter() - start)
+        logger.debug("got response %s to %s", reply.status, endpoint)
 
         if (self.__queue__ is not None):
           self.__queue__.put(reply_obj)
           self.__queue_ready__.release()  # signal to other 'threads' that there is work to do
-        return
+        return reply_obj
 
     '''
     Pops most recent response from response queue
     '''
     def get_response(self):
-      if not self.__queue_ready__.acquire(block=True, timeout=10):
+      if not self.__queue_ready__.acquire(blocking=True, timeout=10):
         return None
       else:
         return self.__queue__.get()
@@ -0,0 +1,112 @@
+import math
+import threading
+
+'''
+Per-endpoint request latency histograms
+Latencies are counted in logarithmic bins, so recording is cheap and the
+memory use is fixed no matter how many requests a DoD run makes.
+'''
+
+
+class LatencyHistogram:
+    """
+        Request latencies per endpoint
+
+        Parameters
+        ----------
+        low : float
+            Upper edge of the first bin [s]
+        high : float
+            Lower edge of the overflow bin [s]
+        bins_per_decade : int
+            Resolution of the histogram
+    """
+    def __init__(self, low=1e-4, high=100.0, bins_per_decade=10):
+        self.low = low
+        self.bins_per_decade = bins_per_decade
+        self.nbins = int(round(math.log10(high/low)*bins_per_decade)) + 2
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @staticmethod
+    def endpoint_name(endpoint: str):
+        """
+            Endpoint without its query, '/DoD/do/Move?PositionName=A' is
+            counted as '/DoD/do/Move'
+        """
+        return endpoint.split('?', 1)[0]
+
+    def _bin(self, seconds):
+        if seconds < self.low:
+            return 0
+        return min(self.nbins - 1,
+                   1 + int(math.log10(seconds/self.low)*self.bins_per_decade))
+
+    def _edge(self, index):
+        # upper edge of a bin
+        return self.low*10**(index/self.bins_per_decade)
+
+    def record(self, endpoint: str, seconds: float):
+        name = self.endpoint_name(endpoint)
+        with self._lock:
+            entry = self._endpoints.get(name)
+            if entry is None:
+                entry = self._endpoints[name] = {
+                    'counts': [0]*self.nbins, 'total': 0.0,
+                    'min': math.inf, 'max': 0.0}
+            entry['counts'][self._bin(seconds)] += 1
+            entry['total'] += seconds
+            entry['min'] = min(entry['min'], seconds)
+            entry['max'] = max(entry['max'], seconds)
+
+    def quantile(self, endpoint: str, q: float):
+        """
+            Upper bin edge below which a fraction q of the requests finished
+        """
+        entry = self._endpoints[self.endpoint_name(endpoint)]
+        counts = entry['counts']
+        target = q*sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target and count:
+                return min(self._edge(index), entry['max'])
+        return entry['max']
+
+    def summary(self):
+        """
+            Returns
+            -------
+            dict
+                endpoint : dict of count, total, mean, min, p50, p90, p99 and
+                max, times in seconds
+        """
+        with self._lock:
+            names = list(self._endpoints)
+        result = {}
+        for name in names:
+            entry = self._endpoints[name]
+            count = sum(entry['counts'])
+            result[name] = {'count': count, 'total': entry['total'],
+                            'mean': entry['total']/count,
+                            'min': entry['min'],
+                            'p50': self.quantile(name, 0.5),
+                            'p90': self.quantile(name, 0.9),
+                            'p99': self.quantile(name, 0.99),
+                            'max': entry['max']}
+        return result
+
+    def show(self):
+        """
+            Print a table of the latencies in ms, slowest total first
+        """
+        summary = self.summary()
+        print(f"{'endpoint':35s} {'count':>6s} {'total':>9s} {'mean':>8s} "
+              f"{'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}")
+        for name, s in sorted(summary.items(), key=lambda x: -x[1]['total']):
+            print(f"{name:35s} {s['count']:6d} {s['total']*1e3:9.1f} "
+                  + ' '.join(f"{s[k]*1e3:8.2f}" for k in ('mean', 'p50', 'p90', 'p99', 'max')))
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
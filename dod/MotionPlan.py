@@ -0,0 +1,135 @@
+from collections import namedtuple
+
+import numpy as np
+
+'''
+Path checking of robot moves against the forbidden regions
+The robot drives one axis at a time, so a move from (x0, y0) to (x1, y1)
+with the default axis order is the path (x0, y0) -> (x1, y0) -> (x1, y1).
+Every such segment is tested against all regions at once; a segment is
+unsafe if any part of it is inside a region, the region borders are allowed.
+'''
+
+MotionStep = namedtuple('MotionStep', ['axis', 'value', 'start', 'end'])
+MotionStep.__doc__ = """
+    Single axis move of a motion plan, start and end are the (x, y) of the
+    segment it drives along
+"""
+
+
+class ForbiddenRegionIndex:
+    """
+        Forbidden regions of one rotation state, as arrays for vectorized tests
+
+        The rectangles are sorted by their x start, so only the regions that
+        start left of a segment's right end are tested. Duplicates, e.g. the
+        regions set for both rotation states, are kept once.
+
+        Parameters
+        ----------
+        regions : list of tuple
+            (x_start, x_stop, y_start, y_stop) with x_start < x_stop and
+            y_start < y_stop, as kept by DoD.set_forbidden_region
+    """
+    def __init__(self, regions):
+        self.regions = sorted({tuple(region) for region in regions})
+        bounds = np.array(self.regions, dtype=float).reshape(-1, 4)
+        self.x_start, self.x_stop, self.y_start, self.y_stop = bounds.T
+
+    def __len__(self):
+        return len(self.regions)
+
+    @staticmethod
+    def _slab(p0, delta, low, high):
+        # parameter interval (t_low, t_high) of p0 + t*delta inside (low, high)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ta = (low - p0)/delta
+            tb = (high - p0)/delta
+        moving = delta != 0
+        inside = (low < p0) & (p0 < high)
+        t_low = np.where(moving, np.minimum(ta, tb), np.where(inside, -np.inf, np.inf))
+        t_high = np.where(moving, np.maximum(ta, tb), np.where(inside, np.inf, -np.inf))
+        return t_low, t_high
+
+    def hits(self, x0, y0, x1, y1):
+        """
+            Which regions each segment passes through
+
+            Parameters
+            ----------
+            x0, y0, x1, y1 : array-like
+                Segment start and end points, a zero length segment tests
+                a single point
+
+            Returns
+            -------
+            numpy.ndarray
+                Boolean (segments, regions)
+        """
+        x0, y0, x1, y1 = (np.asarray(v, dtype=float).reshape(-1, 1) for v in (x0, y0, x1, y1))
+        n = np.searchsorted(self.x_start, np.maximum(x0, x1).max(), side='left')
+        result = np.zeros((x0.shape[0], len(self)), dtype=bool)
+        if n == 0:
+            return result
+        tx_low, tx_high = self._slab(x0, x1 - x0, self.x_start[:n], self.x_stop[:n])
+        ty_low, ty_high = self._slab(y0, y1 - y0, self.y_start[:n], self.y_stop[:n])
+        t_low = np.maximum(tx_low, ty_low)
+        t_high = np.minimum(tx_high, ty_high)
+        result[:, :n] = (t_low < t_high) & (t_low < 1) & (t_high > 0)
+        return result
+
+    def contains(self, x, y):
+        """
+            Whether each point is inside any region
+        """
+        return self.hits(x, y, x, y).any(axis=1)
+
+
+class MotionPlan:
+    """
+        Single axis moves through a list of waypoints and their safety
+
+        Parameters
+        ----------
+        start : tuple
+            (x, y, z) the robot starts from
+        waypoints : list of tuple
+            (x, y, z) to pass through, None keeps an axis where it is
+        index : ForbiddenRegionIndex
+            Regions of the rotation state the plan is made for
+        order : str
+            Order in which the axes are driven at each waypoint
+    """
+    def __init__(self, start, waypoints, index, order='xyz'):
+        self.start = tuple(float(v) for v in start)
+        self.waypoints = [tuple(waypoint) for waypoint in waypoints]
+        self.order = order
+        self.steps = []
+        position = list(self.start)
+        for waypoint in self.waypoints:
+            for axis in order:
+                i = 'xyz'.index(axis)
+                value = waypoint[i]
+                if value is None or float(value) == position[i]:
+                    continue
+                begin = (position[0], position[1])
+                position[i] = float(value)
+                self.steps.append(MotionStep(axis, float(value), begin, (position[0], position[1])))
+        self.end = tuple(position)
+        self.violations = []
+        if self.steps:
+            segments = np.array([step.start + step.end for step in self.steps])
+            hits = index.hits(*segments.T)
+            for step, region in zip(*np.nonzero(hits)):
+                self.violations.append((int(step), index.regions[region]))
+
+    @property
+    def safe(self):
+        return not self.violations
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return (f"MotionPlan({len(self.steps)} moves, {self.start} -> {self.end}, "
+                f"{'safe' if self.safe else f'{len(self.violations)} violations'})")
@@ -4,21 +4,55 @@ import json
 class ServerResponse:
     """
         Object for parsing incomming HTTPResponse from Robot
+
+        Only the raw body is kept on construction, it is parsed by
+        json.loads straight from bytes the first time a field is accessed.
     """
+    __slots__ = ('_raw', '_response')
+
     def __init__(self, httObj: HTTPResponse):
-        try:
-            dat = httObj.read().decode('utf-8')
-            response = json.loads(dat)
-        except ValueError:
-            raise Exception(f"Server did not respond in JSON; Something is wrong\n, {dat}")
-
-        self.TIME = response["Time"]
-        self.STATUS = response["Status"]
-        self.LAST_ID = response["LastID"]
-        self.ERROR_CODE = response["ErrorCode"]
-        self.ERROR_MESSAGE = response["ErrorMessage"]
-        self.RESULTS = response["Result"]
+        self._raw = httObj.read()
+        self._response = None
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        obj = cls.__new__(cls)
+        obj._raw = raw
+        obj._response = None
+        return obj
+
+    @property
+    def response(self):
+        if self._response is None:
+            try:
+                self._response = json.loads(self._raw)
+            except ValueError:
+                raise Exception(f"Server did not respond in JSON; Something is wrong\n, {self._raw!r}")
+        return self._response
+
+    @property
+    def TIME(self):
+        return self.response["Time"]
+
+    @property
+    def STATUS(self):
+        return self.response["Status"]
+
+    @property
+    def LAST_ID(self):
+        return self.response["LastID"]
+
+    @property
+    def ERROR_CODE(self):
+        return self.response["ErrorCode"]
+
+    @property
+    def ERROR_MESSAGE(self):
+        return self.response["ErrorMessage"]
+
+    @property
+    def RESULTS(self):
+        return self.response["Result"]
 
     def __str__(self):
         return f" TIME: {self.TIME}\n STATUS: {self.STATUS}\n LAST_ID: {self.LAST_ID}\n ERROR_CODE: {self.ERROR_CODE}\n ERROR_MESSAGE: {self.ERROR_MESSAGE}\n RESULTS: {self.RESULTS}\n"
-
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__)
+
+
+def lost_control(reply, endpoint : str = None, enumerations : dict = None):
+    """
+        Whether the reply to a 'Do' request means API control was lost on
+        the robot side, e.g. by 'Disable API Control' on the UI or another
+        client's Disconnect
+
+        Only a "Rejected" while the robot is not Busy can be one. It is if
+        the ErrorMessage names the API control or connection, or if the
+        argument of the request is one of the values the robot enumerates
+        for it, so the reject cannot be a bad parameter. Any other reject,
+        e.g. an unknown position name, is left to the caller.
+
+        Parameters
+        ----------
+        reply : ServerResponse
+        endpoint : str, optional
+            The request, e.g. /DoD/do/Move?PositionName=Home
+        enumerations : dict, optional
+            'do' endpoint template : allowed values, as in
+            SupportedEndsHandler.get_endpoints()['do']
+    """
+    try:
+        if reply.RESULTS != "Rejected" or reply.STATUS.get("Status") == "Busy":
+            return False
+        message = str(reply.response.get("ErrorMessage") or "").lower()
+    except Exception:
+        return False
+    if "control" in message or "connect" in message:
+        return True
+    if endpoint is None or not enumerations or '?' not in endpoint:
+        return False
+    path, query = endpoint.split('?', 1)
+    name, _, value = query.partition('=')
+    values = enumerations.get(f"{path}?{name}={{value}}")
+    return bool(values) and unquote(value) in values
+
+
+class SessionManager:
+    """
+        Keeps the API control connection of the robot open between calls
+
+        'Do' requests need a /DoD/Connect first. Instead of connecting and
+        disconnecting around every call, the session connects on the first
+        'Do' request and stays connected until no request was sent for
+        `lease` seconds, then disconnects from a background timer so the
+        robot UI gets control back.
+
+        Parameters
+        ----------
+        client : myClient
+            Client the Connect and Disconnect requests are sent with
+        user : str
+            ClientName reported to the robot
+        lease : float
+            Seconds of inactivity after which the session disconnects
+    """
+    def __init__(self, client, user : str = "Test", lease : float = 30.0):
+        self.client = client
+        self.user = user
+        self.lease = lease
+        self.connected = False
+        self.expires = 0.0
+        self.connects = 0
+        self._timer = None
+
+    def acquire(self):
+        """
+            Make sure API control is held, connecting if needed,
+            and renew the lease
+        """
+        with self.client.lock:
+            if not self.connected or time.monotonic() > self.expires:
+                self._connect()
+            self.touch()
+
+    def touch(self):
+        """
+            Renew the lease of a held session
+        """
+        with self.client.lock:
+            if not self.connected:
+                return
+            self.expires = time.monotonic() + self.lease
+            if self._timer is None:
+                self._start_timer(self.lease)
+
+    def invalidate(self):
+        """
+            Forget the session without disconnecting, e.g. after the
+            connection to the robot dropped
+        """
+        with self.client.lock:
+            self.connected = False
+            self._cancel_timer()
+
+    def release(self):
+        """
+            Disconnect now if the session is held
+        """
+        with self.client.lock:
+            if self.connected:
+                # disconnect invalidates the session
+                self.client.disconnect()
+            self._cancel_timer()
+
+    def _connect(self):
+        r = self.client.connect(self.user)
+        if r is None:
+            logger.warning("No reply to Connect, not holding API control")
+            return
+        if r.RESULTS != "Accepted":
+            logger.warning(f"Connect returned {r.RESULTS}, not holding API control")
+            return
+        self.connected = True
+        self.connects += 1
+        logger.debug("Holding API control as %s for %s s", self.user, self.lease)
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _expire(self):
+        with self.client.lock:
+            self._timer = None
+            if not self.connected:
+                return
+            remaining = self.expires - time.monotonic()
+            if remaining > 0:
+                # renewed since the timer was started
+                self._start_timer(remaining)
+                return
+            logger.info("API control lease expired, disconnecting")
+            try:
+                self.client.disconnect()
+            except Exception:
+                logger.exception("Disconnect after lease expiry failed")
+                self.invalidate()
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+
+class TaskAborted(Exception):
+    """
+        Raised into a waiter's Status when its abort check returned True
+    """
+
+
+class _Waiter:
+    def __init__(self, status, expected, abort, started):
+        self.status = status
+        self.expected = expected
+        self.abort = abort
+        self.started = started
+        # interval of the geometric backoff
+        self.backoff = None
+        self.overdue = False
+
+
+class StatusWatcher:
+    """
+        Single poll stream of the robot status shared by any number of waiters
+
+        Each call of wait_idle returns an ophyd Status that finishes once the
+        robot reports a status other than "Busy". All waiters are served from
+        the same get_status requests, made by one background thread at the
+        shortest interval any of them asks for.
+
+        The interval between polls grows geometrically from `min_interval`
+        to `max_interval`, so a task that is rejected or finishes at once is
+        noticed quickly without flooding the robot during long ones. With an
+        expected duration, polling speeds up again over the last `edge`
+        fraction of it, and the backoff restarts once it has passed.
+
+        Parameters
+        ----------
+        client : myClient or BlockingDropsClient
+        min_interval : float
+            Shortest time between two polls [s]
+        max_interval : float
+            Longest time between two polls [s]
+        edge : float
+            Fraction of the expected duration polled quickly before its end
+    """
+    def __init__(self, client, min_interval=0.05, max_interval=0.5, edge=0.2):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.edge = edge
+        self.last = None
+        self.polls = 0
+        self._waiters = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def wait_idle(self, expected=None, timeout=None, abort=None):
+        """
+            Status finishing when the robot is no longer "Busy"
+
+            Parameters
+            ----------
+            expected : float, optional
+                Expected duration of the running task or move [s]
+            timeout : float, optional
+                Fail the Status with a timeout after this many seconds
+            abort : callable, optional
+                Checked after every poll, a True return fails the Status with
+                TaskAborted
+
+            Returns
+            -------
+            Status
+                The last ServerResponse is available as its `response`
+                attribute once finished
+        """
+        status = Status(obj=self.client, timeout=timeout)
+        status.response = None
+        with self._cond:
+            self._waiters.append(_Waiter(status, expected, abort, time.monotonic()))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name="DoD StatusWatcher")
+                self._thread.start()
+            self._cond.notify_all()
+        return status
+
+    def _interval(self, waiter, now):
+        elapsed = now - waiter.started
+        if waiter.expected is not None and not waiter.overdue:
+            end_edge = (1 - self.edge)*waiter.expected
+            if elapsed < end_edge:
+                # backing off from the start, but awake when the end edge starts
+                return max(self.min_interval,
+                           min(self._backoff(waiter), end_edge - elapsed))
+            if elapsed < waiter.expected:
+                return max(self.min_interval,
+                           min(self.max_interval, (waiter.expected - elapsed)/4))
+            # restart the backoff once the expected end has passed
+            waiter.overdue = True
+            waiter.backoff = None
+        return self._backoff(waiter)
+
+    def _backoff(self, waiter):
+        if waiter.backoff is None:
+            waiter.backoff = self.min_interval
+        else:
+            waiter.backoff = min(self.max_interval, 1.5*waiter.backoff)
+        return waiter.backoff
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._waiters = [w for w in self._waiters if not w.status.done]
+                if not self._waiters:
+                    self._thread = None
+                    return
+            try:
+                r = self.client.get_status()
+            except Exception as e:
+                logger.exception("Status poll failed")
+                self._finish_all(exc=e)
+                continue
+            self.polls += 1
+            self.last = r
+            busy = r is None or r.STATUS['Status'] == "Busy"
+            now = time.monotonic()
+            with self._cond:
+                waiters = list(self._waiters)
+            for waiter in waiters:
+                if waiter.status.done:
+                    continue
+                waiter.status.response = r
+                if not busy:
+                    waiter.status.set_finished()
+                elif waiter.abort is not None and waiter.abort():
+                    waiter.status.set_exception(TaskAborted("Aborted by user"))
+            with self._cond:
+                pending = [w for w in self._waiters if not w.status.done]
+                if not pending:
+                    continue
+                delay = min(self._interval(w, now) for w in pending)
+                # new waiters wake the thread up early
+                self._cond.wait(max(delay - (time.monotonic() - now), 0))
+
+    def _finish_all(self, exc):
+        with self._cond:
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.status.done:
+                waiter.status.set_exception(exc)
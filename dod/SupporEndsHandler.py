@@ -1,15 +1,21 @@
+import hashlib
 import logging
 import json
+import os
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPConnection, HTTPResponse
-from multiprocessing import Queue, Semaphore
-from dod.HTTPTransceiver import HTTPTransceiver 
+from queue import Queue
+from threading import Semaphore
+from dod.HTTPTransceiver import HTTPTransceiver
 from dod.ServerResponse import ServerResponse
 
 logger = logging.getLogger(__name__)
 
 
-# TODO: all file io should go through JsonFileHandler, this class should only concern itself with 
+# TODO: all file io should go through JsonFileHandler, this class should only concern itself with
 # the logic of interacting with the actual to update our notion of what endpoints the machine supports and the arguments those take
 # because the machine is the source of truth for what API is provided
 class SupportedEndsHandler:
@@ -17,10 +23,22 @@ class SupportedEndsHandler:
         Class meant to handle supported endpoints Json file.
             Reloads endpoints, keeps track of API args, and possible 'do' actions
 
+            The values the robot enumerates for 'do' arguments (position
+            names, task names, ...) are cached in `cache_file` with the time
+            they were fetched and a version that changes with their content.
+            Only entries older than `max_age` seconds are fetched again, all
+            of them concurrently. The cache lives in the user's cache
+            directory by default, not next to the (shared) supported file.
+
             TODO: Write updates to JSON file?
     """
-    def __init__(self, file : str, conn : HTTPConnection):
+    # Maximum number of enumerations fetched at the same time
+    max_workers = 8
+
+    def __init__(self, file : str, conn : HTTPConnection, cache_file : str = None, max_age : float = 3600.0):
         self.file = file
+        self.cache_file = cache_file or self.default_cache_file(file)
+        self.max_age = max_age
         self.__queue__ = Queue()
         self.__queue_ready__ = Semaphore(value=0)
         self.__conn__ = conn
@@ -29,39 +47,148 @@ class SupportedEndsHandler:
           'do' : {},
           'conn' : []
         }
+        # endpoint : {'time': ..., 'version': ..., 'hash': ...}
+        self.enumerations = {}
+        self._spec_mtime = None
         self.transceiver = HTTPTransceiver(self.__conn__, self.__queue__, self.__queue_ready__)
 
     def get_endpoints(self):
         return self.supported_ends
 
+    @staticmethod
+    def default_cache_file(file : str):
+        """
+            Per-user cache of the enumerations of a supported file
+        """
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'mfx-dod')
+        name = os.path.splitext(os.path.basename(file))[0] + "_cache.json"
+        return os.path.join(cache_dir, name)
+
+    @staticmethod
+    def enumeration_endpoint(endpoint : str):
+        """
+            The get endpoint listing the allowed values of a 'do' endpoint
+            argument, None for endpoints taking any value
+        """
+        if '?' not in endpoint:
+          return None
+        # Any float is acceptable for pure moves
+        if 'MoveX' in endpoint or 'MoveY' in endpoint or "MoveZ" in endpoint:
+          return None
+        return f"/DoD/get/{endpoint.split('?')[1].split('=')[0]}s"
+
     def reload_endpoint(self, endpoint : str):
         """
             Reloads endpoints by asking server
         """
         if endpoint in self.supported_ends['do'].keys():
-          # check this do endpoint takes an argument
-          if '?' in endpoint:
-            # Any float is acceptable for pure moves
-            if 'MoveX' in endpoint or 'MoveY' in endpoint or "MoveZ" in endpoint:
-              return
-            cursed = f"/DoD/get/{endpoint.split('?')[1].split('=')[0]}s"
-            self.transceiver.send(cursed)
-            self.supported_ends['do'][endpoint] = self.transceiver.get_response().RESULTS
-
-    def reload_all(self):
+          cursed = self.enumeration_endpoint(endpoint)
+          if cursed is None:
+            return
+          self.transceiver.send(cursed)
+          self._store(endpoint, self.transceiver.get_response().RESULTS)
+
+    def load(self):
         """
-            Reloads ALL endpoints by asking server
+            Read the endpoint list from the supported file and the cached
+            enumerations, without asking the server
         """
         try:
-          f = open(self.file)
-        except FileNotFoundError:
-          logger.error("File supported.json not found")
-
-        with f:
-          json_data = json.load(f)["endpoints"]
+          mtime = os.path.getmtime(self.file)
+        except OSError:
+          logger.error("File %s not found", self.file)
+          return
+        if mtime != self._spec_mtime:
+          with open(self.file) as f:
+            json_data = json.load(f)["endpoints"]
           self.supported_ends['get'] = [x['API'] for x in json_data if x['API'][5:8] == 'get']
           self.supported_ends['do'] = {x['API'] : None for x in json_data if x['API'][5:7] == 'do'}
           self.supported_ends['conn'] = [x['API'] for x in json_data if 'connect' in x['API'][5:].lower()]
+          self._spec_mtime = mtime
+        try:
+          with open(self.cache_file) as f:
+            cache = json.load(f)
+        except (OSError, ValueError):
+          return
+        for endpoint, entry in cache.get('enumerations', {}).items():
+          if endpoint in self.supported_ends['do']:
+            self.supported_ends['do'][endpoint] = entry['values']
+            self.enumerations[endpoint] = {k: entry[k] for k in ('time', 'version', 'hash')}
+
+    def stale(self, max_age : float = None):
+        """
+            'do' endpoints whose enumeration is missing or older than max_age
+        """
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        return [endpoint for endpoint in self.supported_ends['do']
+                if self.enumeration_endpoint(endpoint) is not None
+                and (endpoint not in self.enumerations
+                     or now - self.enumerations[endpoint]['time'] > max_age)]
+
+    def refresh(self, endpoints):
+        """
+            Fetch the enumerations of several 'do' endpoints concurrently,
+            each on its own connection, and save the cache
+        """
+        endpoints = list(endpoints)
+        if not endpoints:
+          return
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(endpoints))) as pool:
+          results = list(pool.map(self._fetch, [self.enumeration_endpoint(e) for e in endpoints]))
+        for endpoint, values in zip(endpoints, results):
+          if values is not None:
+            self._store(endpoint, values)
+        logger.debug("Refreshed %s enumerations in %.3f s", len(endpoints), time.time() - start)
+        self.save()
+
+    def reload_all(self, force : bool = False, background : bool = False):
+        """
+            Reloads endpoints, asking the server only for stale enumerations
+
+            With background the cached enumerations are available right
+            away and the stale ones are fetched from a daemon thread, which
+            is returned, so an offline robot never blocks the caller.
+        """
+        self.load()
+        stale = self.stale(0 if force else None)
+        if not background:
+          self.refresh(stale)
+          return None
+        thread = threading.Thread(target=self.refresh, args=(stale,), daemon=True,
+                                  name="DoD endpoint refresh")
+        thread.start()
+        return thread
+
+    def save(self):
+        cache = {'enumerations': {endpoint: dict(entry, values=self.supported_ends['do'][endpoint])
+                                  for endpoint, entry in self.enumerations.items()}}
+        tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+          os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+          with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=2)
+          os.replace(tmp, self.cache_file)
+        except OSError as e:
+          logger.warning("Could not write endpoint cache %s: %s", self.cache_file, e)
+
+    def _fetch(self, endpoint : str):
+        conn = HTTPConnection(self.__conn__.host, self.__conn__.port, timeout=10)
+        try:
+          conn.request("GET", endpoint)
+          return ServerResponse(conn.getresponse()).RESULTS
+        except Exception as e:
+          logger.warning("Could not fetch %s: %s", endpoint, e)
+          return None
+        finally:
+          conn.close()
 
-        for ent in self.supported_ends['do'].keys():
-          self.reload_endpoint(ent)
+    def _store(self, endpoint : str, values):
+        digest = hashlib.sha1(json.dumps(values, sort_keys=True).encode()).hexdigest()
+        entry = self.enumerations.get(endpoint)
+        if entry is None or entry['hash'] != digest:
+          version = 1 if entry is None else entry['version'] + 1
+          entry = self.enumerations[endpoint] = {'version': version, 'hash': digest}
+        entry['time'] = time.time()
+        self.supported_ends['do'][endpoint] = values
@@ -0,0 +1,328 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+Background recording of the DoD robot state during runs
+A sampler thread reads status, position and nozzle state at a fixed rate
+into a preallocated chunk. Full chunks go through a bounded queue to a
+writer thread that appends them to an HDF5 file, so memory stays bounded
+and a slow disk never delays the sampling. Requests go through a client of
+their own, not the one used for control.
+'''
+
+telemetry_dtype = np.dtype([
+    ('time', 'f8'),             # unix time of the sample
+    ('latency', 'f4'),          # seconds the state requests took
+    ('run', 'i4'),              # DAQ run number, -1 if unknown
+    ('status', 'S8'),           # Idle / Busy
+    ('error_code', 'i4'),
+    ('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+    ('position_name', 'S64'),
+    ('running_task', 'S64'),
+    ('humidity', 'f4'),
+    ('temperature', 'f4'),
+    ('bath_temp', 'f4'),
+    ('selected_nozzles', 'S16'),
+    ('dispensing', 'S16'),
+])
+
+event_dtype = np.dtype([('time', 'f8'), ('run', 'i4'), ('label', 'S128')])
+
+
+def _text(value):
+    return str('' if value is None else value).encode('utf-8', 'replace')
+
+
+def state_row(state, start, latency, run):
+    """
+        Telemetry row from the responses of get_state
+
+        Parameters
+        ----------
+        state : dict
+            'get_status', 'get_current_positions', 'get_nozzle_status' :
+            ServerResponse, a missing or None entry leaves its columns empty
+        start : float
+            unix time the requests were sent
+        latency : float
+        run : int
+    """
+    row = np.zeros((), dtype=telemetry_dtype)
+    row['time'], row['latency'], row['run'] = start, latency, run
+    for name in ('x', 'y', 'z', 'humidity', 'temperature', 'bath_temp'):
+        row[name] = np.nan
+    r = state.get('get_status')
+    if r is not None:
+        row['status'] = _text(r.STATUS.get('Status'))
+        row['error_code'] = r.response.get('ErrorCode', 0) or 0
+        results = r.RESULTS or {}
+        position = results.get('Position') or {}
+        row['x'], row['y'], row['z'] = (float(position.get(axis, np.nan)) for axis in 'XYZ')
+        row['running_task'] = _text(results.get('RunningTask'))
+        row['humidity'] = results.get('Humidity', np.nan)
+        row['temperature'] = results.get('Temperature', np.nan)
+        row['bath_temp'] = results.get('BathTemp', np.nan)
+    r = state.get('get_current_positions')
+    if r is not None and isinstance(r.RESULTS, dict):
+        row['position_name'] = _text(r.RESULTS.get('CurrentPosition'))
+    r = state.get('get_nozzle_status')
+    if r is not None and isinstance(r.RESULTS, dict):
+        row['selected_nozzles'] = _text(r.RESULTS.get('Selected Nozzles'))
+        row['dispensing'] = _text(r.RESULTS.get('Dispensing'))
+    return row
+
+
+class _HDF5Writer:
+    """
+        Appends structured chunks to resizable datasets of an HDF5 file
+    """
+    def __init__(self, path):
+        import h5py
+        self.file = h5py.File(path, 'a')
+        for name, dtype in (('telemetry', telemetry_dtype), ('events', event_dtype)):
+            if name not in self.file:
+                self.file.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                                         chunks=True, compression='gzip')
+
+    def append(self, name, rows):
+        dataset = self.file[name]
+        n = dataset.shape[0]
+        dataset.resize((n + len(rows),))
+        dataset[n:] = rows
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _NpzWriter:
+    """
+        Writes every chunk to its own numbered .npz file next to `path`,
+        used when h5py is not installed. Numbering continues after the
+        chunks already there, so an existing recording is appended to
+    """
+    def __init__(self, path):
+        import glob
+        self.base = os.path.splitext(path)[0]
+        existing = [os.path.splitext(file)[0].rsplit('_', 1)[-1]
+                    for file in glob.glob(f"{glob.escape(self.base)}_*_[0-9][0-9][0-9][0-9][0-9]*.npz")]
+        self.count = max((int(n) + 1 for n in existing if n.isdigit()), default=0)
+
+    def append(self, name, rows):
+        np.savez(f"{self.base}_{name}_{self.count:05d}.npz", rows=rows)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+def load_telemetry(path):
+    """
+        Read back a recording
+
+        Returns
+        -------
+        telemetry, events : numpy.ndarray
+            Structured arrays with telemetry_dtype and event_dtype
+    """
+    try:
+        import h5py
+    except ImportError:
+        h5py = None
+    if h5py is not None and os.path.exists(path):
+        with h5py.File(path, 'r') as f:
+            return f['telemetry'][:], f['events'][:]
+    import glob
+    base = os.path.splitext(path)[0]
+    result = []
+    for name, dtype in (('telemetry', telemetry_dtype), ('events', event_dtype)):
+        parts = [np.load(file)['rows'] for file in sorted(glob.glob(f"{base}_{name}_*.npz"))]
+        result.append(np.concatenate(parts) if parts else np.zeros(0, dtype=dtype))
+    return tuple(result)
+
+
+class TelemetryRecorder:
+    """
+        Samples the robot state in the background and appends it to a file
+
+        Parameters
+        ----------
+        client : BlockingDropsClient or myClient
+            Client used only for sampling. get_state is used if it has one,
+            otherwise the three state requests are sent one after another
+        path : str
+            HDF5 file, appended to if it exists
+        interval : float
+            Seconds between samples
+        chunk : int
+            Samples written together
+        max_chunks : int
+            Full chunks held while the writer is busy, older ones are
+            dropped beyond that and counted in `dropped`
+        run_number : callable or int, optional
+            DAQ run number, e.g. daq.run_number. A callable is asked at
+            most every `run_interval` seconds
+        run_interval : float
+    """
+    def __init__(self, client, path, interval=0.5, chunk=256, max_chunks=8, run_number=None,
+                 run_interval=5.0):
+        self.client = client
+        self.path = path
+        self.interval = interval
+        self.chunk = chunk
+        self.run_number = run_number
+        self.run_interval = run_interval
+        self.samples = 0
+        self.errors = 0
+        self.dropped = 0
+        self._run = -1
+        self._run_checked = -np.inf
+        self._buffer = np.zeros(chunk, dtype=telemetry_dtype)
+        self._fill = 0
+        self._events = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._stop = threading.Event()
+        self._sampler = None
+        self._writer = None
+        try:
+            self._file = _HDF5Writer(path)
+        except ImportError:
+            logger.warning("h5py not available, writing telemetry chunks as .npz files")
+            self._file = _NpzWriter(path)
+
+    def start(self):
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="DoD telemetry writer")
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True, name="DoD telemetry sampler")
+        self._writer.start()
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """
+            Stop sampling, write what is buffered and close the file
+        """
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._flush()
+        self._queue.put(None)
+        if self._writer is not None:
+            self._writer.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def mark(self, label):
+        """
+            Record an event, e.g. the start and end of a task
+        """
+        row = np.array((time.time(), self._run, _text(label)[:128]), dtype=event_dtype)
+        with self._lock:
+            self._events.append(row)
+
+    def set_run(self, run):
+        """
+            Set the DAQ run number of the following samples
+        """
+        self._run = -1 if run is None else int(run)
+        self._run_checked = time.monotonic()
+
+    def _update_run(self):
+        if not callable(self.run_number):
+            if self.run_number is not None:
+                self._run = int(self.run_number)
+            return
+        now = time.monotonic()
+        if now - self._run_checked < self.run_interval:
+            return
+        self._run_checked = now
+        try:
+            self._run = int(self.run_number())
+        except Exception:
+            self._run = -1
+
+    def _read_state(self):
+        if hasattr(self.client, 'get_state'):
+            return self.client.get_state()
+        return {name: getattr(self.client, name)() for name in
+                ('get_status', 'get_current_positions', 'get_nozzle_status')}
+
+    def sample(self):
+        """
+            Read the robot state once and buffer it
+        """
+        self._update_run()
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            state = self._read_state()
+        except Exception as e:
+            logger.debug("Telemetry sample failed: %s", e)
+            self.errors += 1
+            state = {}
+        row = state_row(state, start, time.perf_counter() - t0, self._run)
+        with self._lock:
+            self._buffer[self._fill] = row
+            self._fill += 1
+            self.samples += 1
+            full = self._fill == self.chunk
+        if full:
+            self._flush()
+
+    def _sample_loop(self):
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                # fell behind, do not try to catch up with a burst
+                deadline = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def _flush(self):
+        with self._lock:
+            rows = self._buffer[:self._fill].copy()
+            self._fill = 0
+            events = np.array(self._events, dtype=event_dtype)
+            self._events = []
+        if not len(rows) and not len(events):
+            return
+        try:
+            self._queue.put_nowait((rows, events))
+        except queue.Full:
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+                logger.warning("Telemetry writer behind, dropped a chunk")
+            except queue.Empty:
+                pass
+            self._queue.put_nowait((rows, events))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            rows, events = item
+            try:
+                if len(rows):
+                    self._file.append('telemetry', rows)
+                if len(events):
+                    self._file.append('events', events)
+            except Exception:
+                logger.exception("Could not write telemetry to %s", self.path)
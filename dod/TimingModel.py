@@ -0,0 +1,149 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+Trigger delays of the DoD nozzles and LED relative to the X-rays
+All times are in ns. The EVR triggers repeat every 120 Hz bucket, so a
+delay outside of one bucket is wrapped into [0, bucket_ns).
+'''
+
+bucket_ns = 1e9/120
+
+
+class TimingModel:
+    """
+        Computes the nozzle and LED trigger delays from the X-ray timing
+
+        nozzle trigger = X-ray - nozzle offset - sci pulse delay - reaction delay
+        LED trigger    = X-ray + LED delay
+
+        Parameters
+        ----------
+        xray : float
+            X-ray trigger delay
+        nozzle_offsets : dict
+            Nozzle number : time zero offset of the nozzle from the robot
+            LED alignment
+        sci_pulse : float
+            Delay between the nozzle trigger and the drop ejection
+        led : float
+            Delay of the LED relative to the X-rays
+        reaction : float
+            Reaction delay between drop collision and X-rays
+    """
+    def __init__(self, xray, nozzle_offsets, sci_pulse=60600, led=1000, reaction=0):
+        self.xray = xray
+        self.nozzle_offsets = dict(nozzle_offsets)
+        self.sci_pulse = sci_pulse
+        self.led = led
+        self.reaction = reaction
+
+    @staticmethod
+    def wrap(delays):
+        """
+            Delays wrapped into one bucket and the number of buckets they
+            were shifted by
+        """
+        delays = np.asarray(delays, dtype=float)
+        if not np.all(np.isfinite(delays)):
+            raise ValueError(f"Trigger delays must be finite, got {delays}")
+        shift = np.floor(delays/bucket_ns)
+        return delays - shift*bucket_ns, shift.astype(int)
+
+    def nozzle_delays(self, reaction=None, offsets=None):
+        """
+            Nozzle trigger delays for arrays of reaction delays and offsets
+
+            Parameters
+            ----------
+            reaction : float or array-like, optional
+                Reaction delays, by default the current one
+            offsets : dict, optional
+                Nozzle number : offset or array of offsets, by default the
+                current ones. Arrays are broadcast against reaction
+
+            Returns
+            -------
+            dict
+                Nozzle number : wrapped trigger delays
+        """
+        reaction = self.reaction if reaction is None else np.asarray(reaction, dtype=float)
+        offsets = self.nozzle_offsets if offsets is None else offsets
+        return {nozzle: self.wrap(self.xray - np.asarray(offset, dtype=float) - self.sci_pulse - reaction)[0]
+                for nozzle, offset in offsets.items()}
+
+    def led_delay(self, led=None):
+        return self.wrap(self.xray + (self.led if led is None else np.asarray(led, dtype=float)))[0]
+
+    def trigger_delays(self, reaction=None):
+        """
+            All trigger delays, keyed 'nozzle_<n>' and 'LED', for one
+            reaction delay or an array of them
+        """
+        delays = {f'nozzle_{n}': d for n, d in self.nozzle_delays(reaction).items()}
+        delays['LED'] = np.broadcast_to(self.led_delay(), np.shape(next(iter(delays.values()), 0))).copy()
+        return delays
+
+    def scan(self, reactions):
+        """
+            Trigger settings for each step of a reaction delay scan
+
+            Returns
+            -------
+            list of dict
+                Trigger name : delay, one per reaction delay
+        """
+        delays = self.trigger_delays(np.atleast_1d(reactions))
+        return [{name: float(values[i]) for name, values in delays.items()}
+                for i in range(len(np.atleast_1d(reactions)))]
+
+
+def apply_trigger_delays(triggers, delays, timeout=5.0):
+    """
+        Set several EVR trigger delays at once and verify the readbacks
+
+        All puts are started before waiting, so the batch takes about as
+        long as the slowest trigger. A trigger already within its tolerance
+        is not written.
+
+        Parameters
+        ----------
+        triggers : dict
+            Name : pcdsdevices.evr.Trigger
+        delays : dict
+            Name : ns delay, names missing in triggers are an error
+        timeout : float
+            Seconds to wait for the readbacks
+
+        Returns
+        -------
+        dict
+            Name : readback of the triggers that were set
+    """
+    from ophyd.status import wait as status_wait
+
+    missing = set(delays) - set(triggers)
+    if missing:
+        raise KeyError(f"No trigger for {sorted(missing)}")
+    status = None
+    changed = {}
+    for name, delay in delays.items():
+        signal = triggers[name].ns_delay
+        delay = float(delay)
+        if abs(signal.get() - delay) <= (signal.tolerance or 0):
+            continue
+        st = signal.set(delay, timeout=timeout)
+        status = st if status is None else status & st
+        changed[name] = delay
+    if status is not None:
+        status_wait(status, timeout=timeout)
+    readback = {name: triggers[name].ns_delay.get() for name in changed}
+    wrong = {name: (changed[name], value) for name, value in readback.items()
+             if abs(value - changed[name]) > (triggers[name].ns_delay.tolerance or 0)}
+    if wrong:
+        raise RuntimeError(f"Trigger readbacks differ from the set delays (set, readback): {wrong}")
+    logger.debug("Set trigger delays %s", changed)
+    return readback
@@ -10,13 +10,21 @@ class CoDI:
         
         from pcdsdevices.device import ObjectComponent as OCpt
         from pcdsdevices.epics_motor import SmarAct, Motor
-        import time
+        from collections import deque
+        import threading
 
         # CoDI motor PVs loading 
         self.CoDI_rot_left = SmarAct('MFX:MCS2:01:m3', name='CoDI_rot_left')
         self.CoDI_rot_right = SmarAct('MFX:MCS2:01:m1', name='CoDI_rot_right')
         self.CoDI_rot_base = SmarAct('MFX:MCS2:01:m2', name='CoDI_rot_base')
         self.CoDI_trans_z = SmarAct('MFX:MCS2:01:m4', name='CoDI_trans_z')
+        # motors in the order of the preset tuples
+        self.CoDI_motors = (self.CoDI_rot_base, self.CoDI_rot_left, self.CoDI_rot_right, self.CoDI_trans_z)
+
+        # queued preset sequences, see queue_CoDI_sequence
+        self._sequence_lock = threading.Lock()
+        self._sequence_queue = deque()
+        self._sequence_running = None
 
         #Predefined positions CoDI
         self.CoDI_pos_predefined = dict()
@@ -30,26 +38,8 @@ class CoDI:
             self.set_CoDI_predefined('angled_vert',0.0,45.0,45.0,0.0)
             self.set_CoDI_predefined('angled_hor',90.0,45.0,45.0,0.0)
         else: 
-            all_presets = vars(self.CoDI_rot_left.presets.positions) #Needs to be fixed
-            for preset, preset_value in all_presets.items(): 
-                try: 
-                    # get preset position
-                    exec_base = "preset_rot_base = self.CoDI_rot_base.presets.positions." + preset + '.pos'
-                    exec_rot_left = "preset_rot_left = self.CoDI_rot_left.presets.positions." + preset + '.pos'
-                    exec_rot_right = "preset_rot_right = self.CoDI_rot_right.presets.positions." + preset + '.pos'
-                    exec_trans_z = "preset_trans_z = self.CoDI_trans_z.presets.positions." + preset + '.pos'
-                    exec(exec_base)
-                    exec(exec_rot_left)
-                    exec(exec_rot_right)
-                    exec(exec_trans_z)
-
-                    # Save to local database
-                    print(preset)
-                    self.set_CoDI_predefined(preset, preset_rot_base, preset_rot_left, preset_rot_right, preset_trans_z)
-                except: 
-                    print('skipping preset '+ preset + ', as it is not defined in all motors')    
+            self.update_CoDI_predefined()
 
-                
         # # create config parser handler
         # json_handler = JsonFileHandler(supported_json)
         # # load configs and launch web server
@@ -66,37 +56,24 @@ class CoDI:
     
 
     def update_CoDI_predefined(self): 
-        'reloads all the hutch python presets for motors and overwrites local position preset dict'
+        """
+        reloads all the hutch python presets for motors and overwrites local position preset dict. 
+        The presets of each motor are read in one pass, only presets defined for all four motors are kept
         
-        #Predefined positions CoDI
-        self.CoDI_pos_predefined = dict()
-
-        all_presets = vars(self.CoDI_rot_left.presets.positions) #Needs to be fixed
-        for preset in all_presets.keys(): 
-            # try: 
-            # get preset position
-            self.exec_base = "preset_rot_base = self.CoDI_rot_base.presets.positions." + preset + '.pos'
-            self.exec_rot_left = "preset_rot_left = self.CoDI_rot_left.presets.positions." + preset + '.pos'
-            self.exec_rot_right = "preset_rot_right = self.CoDI_rot_right.presets.positions." + preset + '.pos'
-            self.exec_trans_z = "preset_trans_z = self.CoDI_trans_z.presets.positions." + preset + '.pos'
-            print(self.exec_base)
-            exec(self.exec_base)
-
-            exec(self.exec_rot_left)
-            print(self.exec_rot_left)
-
-            exec(self.exec_rot_right)
-            print(self.exec_rot_left)
-            
-            exec(self.exec_trans_z)
-            print(self.exec_trans_z)
-            print(preset_trans_z)
+        ----------
+        Return : list
+            names of the presets that are not defined for all motors
+        """
+        motor_presets = [{name: preset.pos for name, preset in vars(motor.presets.positions).items()}
+                         for motor in self.CoDI_motors]
+        names = set.intersection(*(set(presets) for presets in motor_presets))
+        skipped = sorted(set.union(*(set(presets) for presets in motor_presets)) - names)
+        for name in skipped: 
+            print('skipping preset '+ name + ', as it is not defined in all motors')
 
-            # Save to local database
-            print(preset)
-            self.set_CoDI_predefined(preset, preset_rot_base, preset_rot_left, preset_rot_right, preset_trans_z)
-            # except: 
-            #     print('skipping preset '+ preset + ', as it is not defined in all motors')    
+        #Predefined positions CoDI
+        self.CoDI_pos_predefined = {name: tuple(presets[name] for presets in motor_presets) for name in sorted(names)}
+        return skipped
 
     def set_CoDI_predefined(self, name, base, left, right, z):
         """
@@ -163,58 +140,138 @@ class CoDI:
         return pos_name, pos_rot_base, pos_rot_left, pos_rot_right, pos_trans_z
     
         
-    def set_CoDI_pos(self, pos_name, wait = True): 
+    def move_CoDI(self, base, left, right, z): 
+        """
+        Moves the four CoDI motors at the same time. 
+        
+        Parameters
+        base, left, right, z : float
+            target positions, None leaves a motor where it is
+        
+        ----------
+        Return : ophyd status
+            finishes when all motors are done
+        """
+        status = None
+        for motor, target in zip(self.CoDI_motors, (base, left, right, z)): 
+            if target is None: 
+                continue
+            st = motor.set(target)
+            status = st if status is None else status & st
+        if status is None: 
+            from ophyd.status import Status
+            status = Status()
+            status.set_finished()
+        return status
+
+    def set_CoDI_pos(self, pos_name, wait = True, timeout = None): 
         """
         Moves the colliding droplet injector into a pre-defined position. 
+        The four motors move concurrently.
         
         Parameters
         pos_name : string
             name of the pre-defined position
         wait : boolean
             if the robot waits before continuing further steps
+        timeout : float
+            sec to wait at most if wait is True
         
         ----------
-        Return : 
-    
+        Return : ophyd status
+            finishes when all motors reached the preset
         """
-        # pos_rot_base  = CoDI_base.wm()
-        # pos_rot_left  = CoDI_left.wm()
-        # pos_rot_right = CoDI_right.wm()
-        # pos_trans_z   = CoDI_z.wm()
-        import time
-
         # get target positions
         pos_rot_base, pos_rot_left, pos_rot_right, pos_trans_z = self.CoDI_pos_predefined[pos_name]
         
         # Move motors
-        
-        # Old wayy 
-        # self.CoDI_rot_base.mv(pos_rot_base, wait=False)
-        # self.CoDI_rot_left.mv(pos_rot_left,  wait=False)
-        # self.CoDI_rot_right.mv(pos_rot_right, wait=False)
-        # self.CoDI_trans_z.mv(pos_trans_z, wait=False)
-
-        # Move using hutch python presets
-        exec_base = "self.CoDI_rot_base.mv_" + pos_name + '()'
-        exec(exec_base)
-        exec_left = "self.CoDI_rot_left.mv_" + pos_name + '()'
-        exec(exec_left)
-        exec_right = "self.CoDI_rot_right.mv_" + pos_name + '()'
-        exec(exec_right)
-        exec_z = "self.CoDI_trans_z.mv_" + pos_name + '()'
-        exec(exec_z)
+        status = self.move_CoDI(pos_rot_base, pos_rot_left, pos_rot_right, pos_trans_z)
 
         if wait == True: 
-            test_name, test_pos_rot_base, test_pos_rot_left, test_pos_rot_right, test_pos_trans_z = self.get_CoDI_pos()
-            i = 0
-            while pos_name != test_name: 
-                time.sleep(1)
-                print('\r waiting for motion to end: %i s' %i, end="\r")
-                i = i+1
-                test_name, test_pos_rot_base, test_pos_rot_left, test_pos_rot_right, test_pos_trans_z = self.get_CoDI_pos()
+            status.wait(timeout)
             print('Motion ended')
+        return status
+
+    def queue_CoDI_sequence(self, pos_names, dwell = 0): 
+        """
+        Queues a sequence of pre-defined positions. Each preset is started when the previous 
+        one is reached, a queued sequence starts when the sequences before it are done.
         
-    
+        Parameters
+        pos_names : list of string
+            names of the pre-defined positions
+        dwell : float
+            sec to stay at each position before moving on
+        
+        ----------
+        Return : ophyd status
+            finishes when the last position of the sequence is reached
+        """
+        from ophyd.status import Status
+
+        missing = [name for name in pos_names if name not in self.CoDI_pos_predefined]
+        if missing: 
+            raise KeyError(f'Unknown CoDI positions {missing}')
+        status = Status()
+        with self._sequence_lock: 
+            self._sequence_queue.append((list(pos_names), dwell, status))
+            start = self._sequence_running is None
+        if start: 
+            self._next_sequence()
+        return status
+
+    def stop_CoDI(self): 
+        """
+        Stops the CoDI motors and drops all queued sequences
+        """
+        with self._sequence_lock: 
+            pending = list(self._sequence_queue)
+            self._sequence_queue.clear()
+            running = self._sequence_running
+            self._sequence_running = None
+        for motor in self.CoDI_motors: 
+            motor.stop()
+        for names, dwell, status in pending + ([running] if running else []): 
+            if not status.done: 
+                status.set_exception(RuntimeError('CoDI sequence stopped'))
+
+    def _next_sequence(self, finished = None): 
+        with self._sequence_lock: 
+            if finished is not None and (self._sequence_running is None or self._sequence_running[2] is not finished): 
+                # the sequence was stopped, a newer one may be running
+                return
+            if not self._sequence_queue: 
+                self._sequence_running = None
+                return
+            self._sequence_running = self._sequence_queue.popleft()
+            names, dwell, status = self._sequence_running
+        self._sequence_step(names, 0, dwell, status)
+
+    def _sequence_step(self, names, index, dwell, status): 
+        import threading
+
+        if status.done: 
+            return
+        if index == len(names): 
+            status.set_finished()
+            self._next_sequence(status)
+            return
+
+        def reached(st): 
+            if not st.success: 
+                if not status.done: 
+                    status.set_exception(st.exception() or RuntimeError(f'CoDI move to {names[index]} failed'))
+                self._next_sequence(status)
+            elif dwell and index + 1 < len(names): 
+                timer = threading.Timer(dwell, self._sequence_step, (names, index + 1, dwell, status))
+                timer.daemon = True
+                timer.start()
+            else: 
+                self._sequence_step(names, index + 1, dwell, status)
+
+        self.set_CoDI_pos(names[index], wait = False).add_callback(reached)
+
+
     def set_CoDI_current_pos(self, name):
         """
         defines or updates the current motor combination for CoDI
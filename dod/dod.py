@@ -1,5 +1,5 @@
 class DoD: 
-    def __init__(self, modules = 'None', ip = "172.21.72.187", port = 9999, supported_json = '/cds/group/pcds/pyps/apps/hutch-python/mfx/dod/supported.json'
+    def __init__(self, modules = 'None', ip = "172.21.72.187", port = 9999, supported_json = '/cds/group/pcds/pyps/apps/hutch-python/mfx/dod/supported.json', lease = 30.0, asynchronous = False
 ):
         """
         Class definition of the DoD robot
@@ -9,9 +9,14 @@ class DoD:
             Defines the optional modules of the robot. 
             Options: 'None', 'codi', , 
         ip = "172.21.72.187" , port = 9999, supported_json = "supported.json"            
+        lease : float
+            Seconds API control is kept after the last request. 'Do' requests
+            connect on demand and 'get' requests need no connection at all
+        asynchronous : boolean
+            Use the asyncio client with a connection pool, so that the
+            requests of get_state run concurrently
         """
         from dod.DropsDriver import myClient
-        from dod.JsonFileHandler import JsonFileHandler
         from dod.ServerResponse import ServerResponse
 
         import time
@@ -40,19 +45,40 @@ class DoD:
         #region where horizontal rotation is forbidden: 
         self.set_forbidden_region(0, 300000,  self.y_safety, self.y_max,rotation_state='horizontal')
         
+        from dod.StatusWatcher import StatusWatcher
+
         # Initializing the robot client that is used for communication
-        self.client = myClient(ip=ip, port=port, supported_json=supported_json, reload=False)
+        if asynchronous:
+            from dod.AsyncDropsClient import BlockingDropsClient
+            from dod.SupporEndsHandler import SupportedEndsHandler
+            # cached position and task names tell a lost API control from a bad name
+            endpoints = SupportedEndsHandler(supported_json, None)
+            endpoints.load()
+            self.client = BlockingDropsClient(ip, port, lease=lease,
+                                              enumerations=endpoints.get_endpoints()['do'])
+        else:
+            # position and task names come from the endpoint cache, stale ones are
+            # fetched in the background so an offline robot does not block startup
+            self.client = myClient(ip=ip, port=port, supported_json=supported_json, reload='background', lease=lease)
         
-        # create config parser handler
-        json_handler = JsonFileHandler(supported_json)
-        # load configs and launch web server
-        json_handler.reload_endpoints()
+        # one status poll stream for all waits on the robot
+        self.status_watcher = StatusWatcher(self.client)
+
+        # telemetry recording, see record_telemetry
+        self.ip = ip
+        self.port = port
+        self.recorder = None
 
         # Flag that can be used later on for safety aborts during task execution
         self.safety_abort = False
         if modules == 'codi': 
             from dod.codi import CoDI
             self.codi = CoDI()
+
+        # CoDI base rotation kept up to date by the motor readback, no PV read per safety test
+        self._rotation_base = None
+        if hasattr(self, 'codi'):
+            self.codi.CoDI_rot_base.subscribe(self._rotation_changed, event_type='readback', run=True)
         
         # Timing section
         from pcdsdevices.evr import Trigger
@@ -89,14 +115,20 @@ class DoD:
         r : 
             status readback when aborted
         """
-        r = self.client.connect("Test")
         self.safety_abort = False
         r = self.client.stop_task()
-        r = self.client.disconnect()
         if verbose == True: 
             return r
 
 
+    def release_control(self):
+        """
+        Give API control back to the robot UI now instead of when the
+        session lease expires
+        """
+        self.client.release_control()
+
+
     def clear_abort(self, verbose = True):
         """
         clear abort flag
@@ -109,10 +141,8 @@ class DoD:
             status readback after error cleared
         '''
         """
-        r = self.client.connect("Test")
         r = self.client.get_status()
         self.safety_abort = False
-        rr = self.client.disconnect()
         
         if verbose == True: 
             return r
@@ -151,7 +181,6 @@ class DoD:
         r : dict
             different states of the robot
         """
-        rr = self.client.connect("Test")
         r = self.client.get_status()
         # expected_keys = [
         #     'Position',
@@ -162,31 +191,67 @@ class DoD:
         #     'Temperature',
         #     'BathTemp',
         #     ]
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
             return r.RESULTS
     
 
-    def busy_wait(self, timeout):
+    def get_state(self, verbose = False):
+        """
+        returns robot status, current position and nozzle status at once.
+        With the asynchronous client the three requests run concurrently
+
+        Parameters
+        verbose : boolean
+           Defines whether the function returns the full output, or only the results
+        ----------
+        Returns:
+        r : dict
+            keys 'get_status', 'get_current_positions', 'get_nozzle_status'
+        """
+        if hasattr(self.client, 'get_state'):
+            r = self.client.get_state()
+        else:
+            r = {name: getattr(self.client, name)() for name in
+                 ('get_status', 'get_current_positions', 'get_nozzle_status')}
+        if verbose == True:
+            return r
+        else:
+            return {name: rr.RESULTS for name, rr in r.items()}
+
+
+    def wait_idle(self, expected = None, timeout = None):
         '''
-            Busy wait untill timeout value is reached,
+            Status object that finishes when the robot is no longer busy
+            Parameters
+            expected : float
+                expected duration in sec, polled quickly at start and end
+            timeout : float
+                sec after which the status fails
+            ----------
+            Returns:
+            status : ophyd Status
+                supports wait() and add_callback(), the last robot
+                response is status.response
+        '''
+        return self.status_watcher.wait_idle(expected=expected, timeout=timeout)
+
+
+    def busy_wait(self, timeout, expected = None):
+        '''
+            Wait until the robot is not busy anymore or timeout value is reached,
             timeout : sec
+            expected : sec, optional expected duration of the move
             returns true if timeout occured
         '''
-        import time
-        start = time.time()
-        r = self.client.get_status()
-        delta = 0
-        
-        while(r.STATUS['Status'] == "Busy"):
-            if delta > timeout:
-                return True
-        
-            time.sleep(0.1) #Wait a ms to stop spamming robot
-            r = self.client.get_status()
-            delta = time.time() - start    
+        from ophyd.utils import StatusTimeoutError
+
+        status = self.wait_idle(expected=expected, timeout=timeout)
+        try:
+            status.wait()
+        except StatusTimeoutError:
+            return True
         return False
     
 
@@ -195,6 +260,42 @@ class DoD:
     #     self.client.conn.close()
 
 
+    def record_telemetry(self, path, interval = 0.5, run_number = None): 
+        """
+            Start recording the robot state to an HDF5 file in the background. 
+            The samples are read through a separate connection pool, task starts 
+            and ends are recorded as events
+            Parameters
+            path : string
+                file to append to
+            interval : float
+                sec between samples
+            run_number : callable or int
+                DAQ run number, e.g. daq.run_number
+            ----------
+            Returns:
+            recorder : TelemetryRecorder
+        """
+        from dod.AsyncDropsClient import BlockingDropsClient
+        from dod.TelemetryRecorder import TelemetryRecorder
+
+        self.stop_telemetry()
+        self.recorder = TelemetryRecorder(BlockingDropsClient(self.ip, self.port, pool_size = 3), path, 
+                                          interval = interval, run_number = run_number)
+        return self.recorder.start()
+
+
+    def stop_telemetry(self): 
+        """
+            Stop the telemetry recording and close the file
+        """
+        if self.recorder is None: 
+            return
+        recorder, self.recorder = self.recorder, None
+        recorder.stop()
+        recorder.client.close()
+
+
     def get_task_details(self, task_name, verbose = False):
         """
             This gets the details of a task from the robot to see the scripted routines
@@ -208,9 +309,7 @@ class DoD:
             r : 
                 returns the robot tasks
         """
-        rr = self.client.connect("Test")
         r = self.client.get_task_details(task_name)
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -231,9 +330,7 @@ class DoD:
                 returns the robot tasks
         """
         # Check if reponse is not an empty array or any errors occured
-        rr = self.client.connect("Test")
         r = self.client.get_task_names()
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -258,9 +355,7 @@ class DoD:
         #         'PositionReal',
         #         ]
         '''
-        rr = self.client.connect("Test")
         r = self.client.get_current_positions()
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -285,9 +380,7 @@ class DoD:
                 "Dispensing",
                 ]
         '''
-        rr = self.client.connect("Test")
         r = self.client.get_nozzle_status()
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -306,7 +399,6 @@ class DoD:
         Returns: 
         r : 
         '''
-        rr = self.client.connect("Test")
         if mode == 'Free': 
             r = self.client.dispensing('Free')
         elif mode == 'Triggered':
@@ -318,7 +410,6 @@ class DoD:
                 r = self.client.select_nozzle(i)
                 r = self.client.dispensing('Off')
 
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -343,7 +434,6 @@ class DoD:
         r : current position
         '''
 
-        r = self.client.connect("Test")
         r = self.client.get_current_positions()
         current_real_position = r.RESULTS['PositionReal']
 
@@ -358,7 +448,6 @@ class DoD:
         r = self.client.get_current_positions()
         new_real_position = r.RESULTS['PositionReal']
         
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -369,7 +458,7 @@ class DoD:
         '''
             Robot coordinate system!!!: 
             Moves robot to new absolute x position. 
-            No safety test. 
+            With safety_test the path is tested for forbidden regions. 
             
         Parameters
         position : int
@@ -385,7 +474,6 @@ class DoD:
         r : current position
         '''
 
-        r = self.client.connect("Test")
         r = self.client.get_current_positions()
         current_real_position = r.RESULTS['PositionReal']
         x_current, y_current, z_current = current_real_position
@@ -393,9 +481,10 @@ class DoD:
         if safety_test == False:  
             r = self.client.move_x(position_x)
         else: 
-            print('safety test of move has yet to be implemented')
-            if self.test_forbidden_region(position_x, y_current): 
+            if self.plan_motion([(position_x, None, None)], start = current_real_position).safe: 
                 r = self.client.move_x(position_x)
+            else: 
+                print('move passes a forbidden region, not executed')
                 
             
         # WAIT FOR MOVEMENT TO BE DONE
@@ -404,7 +493,6 @@ class DoD:
         # r = self.client.get_current_positions()
         # new_real_position = r.RESULTS['PositionReal']
         
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -415,7 +503,7 @@ class DoD:
         '''
             Robot coordinate system!!!: 
             Moves robot to new absolute x position. 
-            No safety test. 
+            With safety_test the path is tested for forbidden regions. 
             
         Parameters
         position : int
@@ -431,7 +519,6 @@ class DoD:
         r : current position
         '''
 
-        r = self.client.connect("Test")
         r = self.client.get_current_positions()
         current_real_position = r.RESULTS['PositionReal']
         x_current, y_current, z_current = current_real_position
@@ -439,9 +526,10 @@ class DoD:
         if safety_test == False:  
             r = self.client.move_y(position_y)
         else: 
-            print('safety test of move has yet to be implemented')
-            if self.test_forbidden_region(x_current, position_y): 
+            if self.plan_motion([(None, position_y, None)], start = current_real_position).safe: 
                 r = self.client.move_y(position_y)
+            else: 
+                print('move passes a forbidden region, not executed')
                 
             
         # WAIT FOR MOVEMENT TO BE DONE
@@ -450,7 +538,6 @@ class DoD:
         # r = self.client.get_current_positions()
         # new_real_position = r.RESULTS['PositionReal']
         
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
@@ -461,7 +548,7 @@ class DoD:
         '''
             Robot coordinate system!!!: 
             Moves robot to new absolute Z position. 
-            No safety test. 
+            With safety_test the current x-y position is tested for forbidden regions. 
             
         Parameters
         position : int
@@ -477,7 +564,6 @@ class DoD:
         r : current position
         '''
 
-        r = self.client.connect("Test")
         r = self.client.get_current_positions()
         current_real_position = r.RESULTS['PositionReal']
         x_current, y_current, z_current = current_real_position
@@ -485,9 +571,10 @@ class DoD:
         if safety_test == False:  
             r = self.client.move_z(position_z)
         else: 
-            print('safety test of move has yet to be implemented')
-            if self.test_forbidden_region(x_current, y_current): 
+            if self.plan_motion([(None, None, position_z)], start = current_real_position).safe: 
                 r = self.client.move_z(position_z)
+            else: 
+                print('move passes a forbidden region, not executed')
                 
             
         # WAIT FOR MOVEMENT TO BE DONE
@@ -496,14 +583,13 @@ class DoD:
         # r = self.client.get_current_positions()
         # new_real_position = r.RESULTS['PositionReal']
         
-        rr = self.client.disconnect()
         if verbose == True: 
             return r
         else: 
             return r.RESULTS
 
 
-    def do_task(self, task_name, safety_check = False, verbose = False):
+    def do_task(self, task_name, safety_check = False, verbose = False, expected = None):
         '''
         Executes a task of the robot
             
@@ -516,29 +602,36 @@ class DoD:
             False: Not performed
         verbose : boolean
                 Defines whether the function returns the full output, or only the results
+        expected : float
+            expected duration of the task in sec, used to pace the status polling
             ----------
         Returns: 
         r : 
         '''
-        import time
+        from dod.StatusWatcher import TaskAborted
+
+        if self.recorder is not None: 
+            self.recorder.mark(f'task {task_name} start')
 
-        rr = self.client.connect("Test")
         if safety_check == False: 
             r = self.client.execute_task(task_name)
         else: 
             print('safety check needs to be implemented')
 
         ## Wait for task to be done
-        while(r.STATUS['Status'] == "Busy"):
-            #Possible if loop is not enterd?
-            time.sleep(0.5)
-            r = self.client.get_status()
-            if self.safety_abort == True: 
+        if r.STATUS['Status'] == "Busy":
+            status = self.status_watcher.wait_idle(
+                expected=expected, abort=lambda: self.safety_abort)
+            try:
+                status.wait()
+            except TaskAborted:
                 r = self.client.stop_task()
                 print('User aborted task execution')
                 return r
 
         r = self.client.get_status()
+        if self.recorder is not None: 
+            self.recorder.mark(f'task {task_name} end')
 
         #Check if any error occured
         if r.ERROR_CODE == 0:
@@ -597,6 +690,7 @@ class DoD:
     
         """
         region_tuple = (min(x_start,x_stop), max(x_start,x_stop), min(y_start,y_stop), max(y_start,y_stop))
+        self._region_index = {}
         if rotation_state == "horizontal": 
             self.forbidden_regions_horizontal.append(region_tuple)
         elif rotation_state == "vertical": 
@@ -608,10 +702,54 @@ class DoD:
             print('invalid input of rotation state')
             
             
+    def _rotation_changed(self, value = None, **kwargs):
+        self._rotation_base = value
+
+    def rotation_state(self, refresh = False):
+        """
+        rotation state the forbidden regions are selected by, from the cached CoDI base rotation
+        
+        Parameters
+        refresh : bool
+            read the base rotation from the motor instead of using the cached readback
+        ----------
+        Returns: 
+        rotation_state : string
+            "vertical" (base at 90 degree), "horizontal" (base at 0 degree), "both" otherwise or without CoDI
+        """
+        if refresh and hasattr(self, 'codi'):
+            self._rotation_base = self.codi.CoDI_rot_base.wm()
+        if self._rotation_base is None:
+            return 'both'
+        pos_rot_base = round(self._rotation_base, 0)
+        if pos_rot_base == 90: 
+            return 'vertical'
+        elif pos_rot_base == 0:
+            return 'horizontal'
+        return 'both'
+
+    def forbidden_region_index(self, rotation_state = None):
+        """
+        forbidden regions of a rotation state prepared for vectorized testing, 
+        rebuilt only after set_forbidden_region
+        
+        Parameters
+        rotation_state: string
+            "horizontal", "vertical" or "both", by default the current rotation state
+        ----------
+        """
+        from dod.MotionPlan import ForbiddenRegionIndex
+
+        rotation_state = rotation_state or self.rotation_state()
+        index = self._region_index.get(rotation_state)
+        if index is None:
+            index = self._region_index[rotation_state] = ForbiddenRegionIndex(self.get_forbidden_region(rotation_state))
+        return index
+
     def test_forbidden_region(self, x_test, y_test): 
         """
         tests if the end point of a motion is inside a forbidden region
-        No testing of the path of a motion included!
+        Use plan_motion to test the path of a motion
         
         Parameters
         x_test : float
@@ -624,31 +762,137 @@ class DoD:
         safe_motion : bool
             boolean flag if endpoint of motion is safe or not
         """
-        from dod.codi import CoDI_base
-        # Get current rotation state
-        pos_rot_base  = round(CoDI_base.wm(),0)
+        return not self.forbidden_region_index().contains(x_test, y_test)[0]
+
+    def plan_motion(self, waypoints, start = None, order = 'xyz', rotation_state = None): 
+        """
+        splits a path through waypoints into the single axis moves of the robot and
+        tests every segment they drive along against the forbidden regions
         
-        #Initialize safe flag (True = safe)
-        flag_safe_endpoint = True
+        Parameters
+        waypoints : list of tuple
+            (x, y, z) robot coordinates, None keeps an axis at its position
+        start : tuple
+            (x, y, z) start of the path, by default the current real position
+        order : string
+            order in which the axes are moved at each waypoint
+        rotation_state: string
+            rotation state to test for, by default the current one
+        ----------
+        Returns: 
+        plan : MotionPlan
+            moves of the path, plan.safe tells if all of them are outside the forbidden regions
+        """
+        from dod.MotionPlan import MotionPlan
+
+        if start is None: 
+            start = self.client.get_current_positions().RESULTS['PositionReal']
+        return MotionPlan(start, waypoints, self.forbidden_region_index(rotation_state), order = order)
+
+    def execute_motion(self, waypoints, order = 'xyz', timeout = 25, verbose = False): 
+        """
+        moves the robot through waypoints after testing the whole path for forbidden regions. 
+        The moves are sent back to back within the API control session, 
+        each one as soon as the previous one is done
         
-        #combine the lists depending on the rotation 
-        if pos_rot_base == 90: 
-            test_list_safety = self.forbidden_regions_vertical
-        elif pos_rot_base == 0:
-            test_list_safety = self.forbidden_regions_horizontal
-        else:
-            test_list_safety = self.forbidden_regions_horizontal + self.forbidden_regions_vertical
+        Parameters
+        waypoints : list of tuple or MotionPlan
+            (x, y, z) robot coordinates, None keeps an axis at its position
+        order : string
+            order in which the axes are moved at each waypoint
+        timeout : float
+            maximum time per move in sec
+        verbose : boolean
+                Defines whether the function returns the full output, or only the results
+        ----------
+        Returns: 
+        r : current position
+        """
+        from dod.MotionPlan import MotionPlan
+        from dod.StatusWatcher import TaskAborted
+        from ophyd.utils import StatusTimeoutError
+
+        plan = waypoints if isinstance(waypoints, MotionPlan) else self.plan_motion(waypoints, order = order)
+        if not plan.safe: 
+            for step, region in plan.violations: 
+                print(f'move {step} {plan.steps[step]} passes forbidden region {region}')
+            print('motion not executed')
+            return plan
+
+        for step in plan.steps: 
+            if self.safety_abort: 
+                print('User aborted motion')
+                break
+            r = getattr(self.client, f'move_{step.axis}')(step.value)
+            if r is None or r.RESULTS != 'Accepted': 
+                print(f'move {step} was not accepted')
+                break
+            status = self.status_watcher.wait_idle(timeout = timeout, abort = lambda: self.safety_abort)
+            try:
+                status.wait()
+            except TaskAborted:
+                self.client.stop_task()
+                print('User aborted motion')
+                break
+            except StatusTimeoutError:
+                print(f'move {step} did not end within {timeout} s')
+                break
+
+        r = self.client.get_current_positions()
+        if verbose == True: 
+            return r
+        else: 
+            return r.RESULTS
+
+
+    def timing_model(self): 
+        """
+        timing model of the current X-ray timing and relative delays
         
-        #Test for all regions if the end point is in the forbidden region
-        for tuple_current in test_list_safety: 
-            x_start, x_stop, y_start, y_stop = tuple_current
-            if ((x_start < x_test) and (x_stop > x_test) and (y_start < y_test) and (y_stop > y_test)): 
-                flag_safe_endpoint = flag_safe_endpoint and False
-            else:
-                flag_safe_endpoint = flag_safe_endpoint and True
-            
-        return flag_safe_endpoint
+        Parameters
+               ----------
+        Returns: 
+        model : TimingModel
+        """
+        from dod.TimingModel import TimingModel
+
+        return TimingModel(self.timing_Xray, {1: self.timing_delay_nozzle_1, 2: self.timing_delay_nozzle_2}, 
+                           sci_pulse = self.timing_delay_sciPulse, led = self.timing_delay_LED, 
+                           reaction = self.timing_delay_reaction)
+
+    def timing_scan(self, reaction_delays): 
+        """
+        trigger delays for a list of reaction delays, computed at once. 
+        The steps can be applied with set_trigger_delays
+        
+        Parameters
+        reaction_delays : list of float
+            reaction delays in ns
+        ----------
+        Returns: 
+        steps : list of dict
+            trigger name ('nozzle_1', 'nozzle_2', 'LED') : delay in ns
+        """
+        return self.timing_model().scan(reaction_delays)
+
+    def set_trigger_delays(self, delays, timeout = 5): 
+        """
+        sets the trigger delays in one parallel batch and verifies the readbacks
+        
+        Parameters
+        delays : dict
+            trigger name ('nozzle_1', 'nozzle_2', 'LED') : delay in ns
+        timeout : float
+            sec to wait for the readbacks
+        ----------
+        Returns: 
+        """
+        from dod.TimingModel import apply_trigger_delays
 
+        triggers = {'nozzle_1': self.trigger_nozzle_1, 'nozzle_2': self.trigger_nozzle_2, 'LED': self.trigger_LED}
+        apply_trigger_delays(triggers, delays, timeout = timeout)
+        for name, delay in delays.items(): 
+            setattr(self, f'timing_{name}', float(delay))
 
     def set_timing_update(self): 
         """
@@ -658,21 +902,8 @@ class DoD:
                ----------
         Returns: 
         """
-        # Nozzle 1
-        self.timing_nozzle_1 = self.timing_Xray - self.timing_delay_nozzle_1 - self.timing_delay_sciPulse - self.timing_delay_reaction
-        if self.timing_nozzle_1 < 0: 
-            self.timing_nozzle_1 = self.timing_nozzle_1 + 1/120*1000000000
-        self.trigger_nozzle_1.ns_delay.put(self.timing_nozzle_1)
-
-        # Nozzle 2
-        self.timing_nozzle_2 = self.timing_Xray - self.timing_delay_nozzle_2 - self.timing_delay_sciPulse - self.timing_delay_reaction
-        if self.timing_nozzle_2 < 0: 
-            self.timing_nozzle_2 = self.timing_nozzle_2 + 1/120*1000000000
-        self.trigger_nozzle_2.ns_delay.put(self.timing_nozzle_2)
-        
-        # LED
-        self.timing_LED = self.timing_Xray + self.timing_delay_LED
-        self.trigger_LED.ns_delay.put(self.timing_LED)
+        delays = self.timing_model().trigger_delays()
+        self.set_trigger_delays({name: float(delay) for name, delay in delays.items()})
         
         
     def set_timing_zero_nozzle(self, nozzle, timing_rel): 
@@ -7,6 +7,7 @@ import subprocess
 import numpy as np
 
 from mfx.devices import LaserShutter
+from mfx.laser_delay import LaserDelayManager, DelayChannel
 from mfx.db import daq, elog, sequencer, rayonix
 from ophyd.status import wait as status_wait
 from pcdsdevices.sequencer import EventSequencer
@@ -49,6 +50,14 @@ base_inhibit_delay = 500000
 evo_time_zero = 800000
 min_evr_delay = 9280 #may depend on evr. min_evr_delay = 0 ticks for code 40
 
+# Pacemaker and inhibit follow the laser delay, inhibit on the event code of
+# the bucket it is moved to
+delay_manager = LaserDelayManager([
+    DelayChannel('pacemaker', pacemaker, opo_time_zero, min_delay=min_evr_delay),
+    DelayChannel('inhibit', inhibit, opo_time_zero - base_inhibit_delay, min_delay=min_evr_delay,
+                 event_codes=(210, 211, 212), disable=True),
+])
+
 
 # Fixed Target Scan
 from pcdsdevices.epics_motor import Newport
@@ -259,7 +268,7 @@ class User:
         self.evo_shutter3('OUT') 
 
 
-    def set_delay(self, delay):
+    def set_delay(self, delay, setting=None):
         """
         Set the relative delay between the pacemaker and inhibit triggers
 
@@ -267,54 +276,33 @@ class User:
         ----------
         delay: float
             Requested laser delay in nanoseconds. Must be less that 15.5 ms
+
+        setting: DelaySetting, optional
+            Precomputed trigger settings of the delay, see delays_for_scan
         """
-        # Determine event code of inhibit pulse
+        if delay > 0 and delay < 1:
+            logger.info("WARNING:  Read the doc string -- delay is in ns not sec") 
+        if setting is None:
+            setting = delay_manager.delays_for_scan([delay])[0]
         logger.info("Setting delay %s ns (%s us)", delay, delay/1000.)
-        if delay <= (opo_time_zero - min_evr_delay - base_inhibit_delay): #formerly 0.16e6
-            if delay > 0 and delay < 1:
-                logger.info("WARNING:  Read the doc string -- delay is in ns not sec") 
-            logger.debug("Triggering on simultaneous event code")
-            inhibit_ec = 210
-            ipulse = 0
-        elif delay <= (1.e9/120 + opo_time_zero - min_evr_delay - base_inhibit_delay): #formerly 7.e6:
-            logger.debug("Triggering on one event code prior")
-            inhibit_ec = 211
-            ipulse = 1
-        elif delay <= (2.e9/120 + opo_time_zero - min_evr_delay - base_inhibit_delay):# formerly 15.5e6
-            logger.debug("Triggering two event codes prior")
-            inhibit_ec = 212
-            ipulse = 2
-        else:
-            raise ValueError("Invalid input %s ns, must be < 15.5 ms")
-
-        if delay <= (opo_time_zero - min_evr_delay): 
-            pacemaker_delay = opo_time_zero - delay
-        elif delay <= (1.e9/120 + opo_time_zero - min_evr_delay): 
-            pacemaker_delay = opo_time_zero + 1.e9/120 - delay
-        elif delay <= (2.e9/120 + opo_time_zero - min_evr_delay):
-            pacemaker_delay = opo_time_zero + 2.e9/120 - delay
-        else:
-            raise ValueError("Invalid input %s ns, must be < 15.5 ms")
-
-        # Determine relative delays
-        pulse_delay = ipulse*1.e9/120 - delay # Convert to ns
-        # Conifgure Pacemaker pulse
-        # pacemaker_delay = opo_time_zero + pulse_delay
-        pacemaker.ns_delay.put(pacemaker_delay)
-        logger.info("Setting pacemaker delay %s ns", pacemaker_delay)
-        # Configure Inhibit pulse
-        inhibit_delay = opo_time_zero - base_inhibit_delay + pulse_delay
-        inhibit.disable()
-        time.sleep(0.1)
-        inhibit.ns_delay.put(inhibit_delay)
-        logger.info("Setting inhibit delay %s ns", inhibit_delay)
-        inhibit.eventcode.put(inhibit_ec)
-        logger.info("Setting inhibit ec %s", inhibit_ec)
-        time.sleep(0.1)
-        inhibit.enable()
-        time.sleep(0.2)
+        delay_manager.apply(setting)
+        self.delay = delay
+        logger.debug("Triggering inhibit %s event codes prior", setting.shift['inhibit'])
         logger.info(self._delaystr)
 
+    def delays_for_scan(self, delays):
+        """
+        Trigger settings of all delays of a scan, invalid delays fail before
+        the scan starts. Delays that are None or False are skipped
+
+        Returns
+        -------
+        settings: dict
+            delay : DelaySetting
+        """
+        delays = [delay for delay in delays if delay is not None and delay is not False]
+        return dict(zip(delays, delay_manager.delays_for_scan(delays))) if delays else {}
+
 #    def set_evo_delay(self, delay):
 #        """
 #        Set the evolution laser triggers delay
@@ -473,6 +461,7 @@ class User:
         # Preserve the original state of DAQ
         logger.info("Running delays %r, %s times ...", delays, nruns)
         delays = delays or [False]
+        settings = self.delays_for_scan(delays)
         # Estimated time for completion
         try:
             for irun in range(nruns):
@@ -489,7 +478,7 @@ class User:
                             logger.info("Beginning light events using delay %s", delay)
                             # Open state = 2
                             opo_shutter.move(2)
-                            self.set_delay(delay)
+                            self.set_delay(delay, settings[delay])
 
                         # Perform the light run
                         self.perform_run(light_events, pulse1=pulse1,
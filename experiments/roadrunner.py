@@ -2,6 +2,8 @@ import numpy as np
 
 from pcdsdevices.sequencer import EventSequencer
 
+from mfx.sequencer_io import write_sequence
+
 
 sequencer = EventSequencer('ECS:SYS0:7', name='mfx_sequencer')
 
@@ -59,11 +61,20 @@ class GalilSequence:
         POS = [0, self.pos_row_delta, 0, 0]
         return DAQ, DAQ_NEXT, TRIG_GALIL, TRIG_DELTA, WINDOW, NEG, POS
 
-    def configure_sequencer(self, pores_per_row):
-        # Clean up current sequence
-        EMPTY = [0, 0, 0, 0]
-        self.sequencer.sequence.put_seq([EMPTY for ii in range(2000)])
+    def configure_sequencer(self, pores_per_row, write=False):
+        """
+        Build the pore scan sequence. The sequencer is cleared and the
+        sequence returned, it is only written if asked to
+
+        Parameters
+        ----------
+        pores_per_row: int
 
+        write: bool
+            Write the sequence in one verified put instead of only clearing
+            the sequencer, lines of a longer previous sequence are zeroed in
+            the same put
+        """
         DAQ, DAQ_NEXT, TRIG_GALIL, TRIG_DELTA, WINDOW, NEG, POS = self.define_seq_elements()
 
         # Trigger Galil and wait to reach the first pore
@@ -88,7 +99,8 @@ class GalilSequence:
 
         sequence.append(POS)  # Wait to reach the first pore on the next line
         self.sequence = sequence
-        #self.sequencer.sequence.put_seq(sequence)
+        # Clean up the current sequence, or replace it
+        write_sequence(self.sequencer, sequence if write else [])
         return sequence
 
 
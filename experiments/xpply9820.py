@@ -19,6 +19,7 @@ from xpp.db import daq, seq, elog
 from ophyd.status import wait as status_wait
 from pcdsdevices.sequencer import EventSequencer
 from pcdsdevices.evr import Trigger
+from mfx.laser_delay import LaserDelayManager, DelayChannel
 from xpp.db import cp
 from xpp.db import lp
 from xpp.db import xpp_pulsepicker as pp
@@ -125,6 +126,11 @@ class User:
 
     def __init__(self):
         self.delay = None
+        # Q-switch and diode follow the laser delay with a fixed offset
+        self.delay_manager = LaserDelayManager([
+            DelayChannel('qswitch', fs_qswitch, lambda: self.fs_t0, min_delay=None),
+            DelayChannel('diode', fs_diode, lambda: self.fs_t0 - fs_fix_dl, min_delay=None),
+        ])
   
         with safe_load('knife'):
             self.wire_x = Newport('XPP:USR:MMN:41', name='wire_x')
@@ -238,7 +244,7 @@ class User:
             return 'Laser delay is set to {:8.0f} ns (AFTER X-ray pulse)'.format(delay)
 
 
-    def set_delay(self, delay):
+    def set_delay(self, delay, setting=None):
         """
         Set the trigger delay for the free-space laser.
         The delay between the Q-switch and the diode flash triggers is constant.
@@ -247,20 +253,35 @@ class User:
         ----------
         delay: float
             Requested laser in nanoseconds. Must be less than X ms.
+
+        setting: DelaySetting, optional
+            Precomputed trigger settings of the delay, see delays_for_scan
         """
         logger.info("Setting delay %s ns (%s us)", delay, delay/1000.)
 
+        if setting is None:
+            setting = self.delay_manager.delays_for_scan([delay])[0]
         self.delay = delay
-        fs_qswitch_delay = self.fs_t0 - delay
-        fs_diode_delay = fs_qswitch_delay - fs_fix_dl
 
-        print(f"Q-switch delay: {fs_qswitch_delay}")
-        print(f"Diode delay: {fs_diode_delay}")
+        print(f"Q-switch delay: {setting.ns_delay['qswitch']}")
+        print(f"Diode delay: {setting.ns_delay['diode']}")
 
-        fs_qswitch.ns_delay.put(fs_qswitch_delay)
-        fs_diode.ns_delay.put(fs_diode_delay)
+        self.delay_manager.apply(setting)
         return
 
+    def delays_for_scan(self, delays):
+        """
+        Trigger settings of all delays of a scan. Delays that are None or
+        False are skipped
+
+        Returns
+        -------
+        settings: dict
+            delay : DelaySetting
+        """
+        delays = [delay for delay in delays if delay is not None and delay is not False]
+        return dict(zip(delays, self.delay_manager.delays_for_scan(delays))) if delays else {}
+
 
     def evo_shutter1(self, state):
         if state == 'IN':
@@ -512,6 +533,7 @@ class User:
         # Preserve the original state of DAQ
         logger.info("Running delays %r, %s times ...", delays, nruns)
         delays = delays or [False]
+        settings = self.delays_for_scan(delays)
         try:
             for irun in range(nruns):
                 run = irun+1
@@ -527,7 +549,7 @@ class User:
                             logger.info("Beginning light events using delay %s", delay)
                             # Open state = 2
                             #self.fs_shutter('OUT') OPO DOES NOT EXIST FOR THIS EXPERIMENT
-                            self.set_delay(delay)
+                            self.set_delay(delay, settings[delay])
 
                         # Perform the light run
                         self.perform_run(light_events, pulse1=pulse1,
@@ -596,6 +618,7 @@ class User:
         # Preserve the original state of DAQ
         logger.info("Running delays %r, %s times ...", delays, nruns)
         delays = delays or [False]
+        settings = self.delays_for_scan(delays)
         try:
             for irun in range(nruns):
                 run = irun+1
@@ -610,7 +633,7 @@ class User:
                         logger.info("Beginning light events using delay %s", delay)
                         # Open state = 2
                         #fs_shutter('OUT')
-                        self.set_delay(delay)
+                        self.set_delay(delay, settings[delay])
 
                     # Perform the run
                     self.perform_run_with_escan(energies,
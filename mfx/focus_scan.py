@@ -1,7 +1,12 @@
-def focus_scan(camera, start=1, end=299, step=1):
+def focus_scan(camera, start=1, end=299, step=1, adaptive=False,
+               image_sec=1, width_tolerance=1.0, position_tolerance=1.0):
     """
     Runs through transfocator Z to find the best focus
 
+    With adaptive=True a coarse scan is refined by golden-section search
+    instead of stepping through every position, the transfocator is left
+    at the best focus and the number of moves and frames is reported.
+
     Parameters
     ----------
     camera: str, required
@@ -16,6 +21,19 @@ def focus_scan(camera, start=1, end=299, step=1):
     end: int, optional
 	final transfocator position
 
+    adaptive: bool, optional
+	search for the waist instead of scanning every step
+
+    image_sec: float, optional
+	seconds of frames averaged at every position
+
+    width_tolerance: float, optional
+	beam widths (FWHM in pixels) closer than this are considered equal,
+	adaptive search only
+
+    position_tolerance: float, optional
+	stop the adaptive search once the waist is bracketed this closely
+
     Examples:
     mfx dg1 yag is MFX:DG1:P6740
     mfx dg2 yag is MFX:DG2:P6740
@@ -27,10 +45,15 @@ def focus_scan(camera, start=1, end=299, step=1):
     """
     # cd /reg/g/pcds/pyps/apps/hutch-python/mfx/mfx
     # from mfx.transfocator_scan import *
-    from mfx.transfocator_scan import transfocator_aligner
+    from tfs.transfocator_scan import transfocator_aligner
     import numpy as np
     from mfx.db import tfs
 
     trf_align = transfocator_aligner(camera)
+    if adaptive:
+        return trf_align.search_transfocator(
+            tfs.translation, start, end, image_sec,
+            width_tolerance=width_tolerance,
+            position_tolerance=max(position_tolerance, step))
     trf_pos = np.arange(start, end, step)
-    trf_align.scan_transfocator(tfs.translation,trf_pos,1)
+    trf_align.scan_transfocator(tfs.translation,trf_pos,image_sec)
@@ -0,0 +1,223 @@
+"""
+Laser delay settings of EVR triggers, shared by the hutch and experiment
+classes
+
+A laser delay is the time in ns the laser fires before the X-rays. Every
+trigger channel fires at ``time_zero - delay``, moved by whole 120 Hz buckets
+until it is at least ``min_delay`` and, for channels with event codes,
+triggered by the event code of that many buckets earlier.
+"""
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+bucket_ns = 1e9/120
+
+DelayChannel = namedtuple('DelayChannel', ['name', 'trigger', 'time_zero', 'min_delay',
+                                           'event_codes', 'max_shift', 'disable'])
+DelayChannel.__new__.__defaults__ = (0, None, 2, False)
+DelayChannel.__doc__ = """
+One EVR trigger following the laser delay
+
+name: str
+trigger: pcdsdevices.evr.Trigger
+time_zero: float or callable
+    ns_delay of the trigger at zero laser delay, a callable is asked every
+    time so that time zero can be changed on the fly
+min_delay: float or None
+    Smallest ns_delay the EVR accepts. None never shifts by buckets and does
+    not check the delay
+event_codes: tuple or callable, optional
+    Event code for a shift of 0, 1, 2, ... buckets, a callable is asked
+    every time like time_zero
+max_shift: int
+    Most buckets the trigger may be moved
+disable: bool
+    Disable the trigger while it is changed
+"""
+
+DelaySetting = namedtuple('DelaySetting', ['delay', 'ns_delay', 'eventcode', 'shift'])
+DelaySetting.__doc__ = """
+delay: requested laser delay
+ns_delay, eventcode, shift: channel name : value, eventcode only for
+    channels with event codes
+"""
+
+
+class LaserDelayManager:
+    """
+    Computes and applies the trigger settings of laser delays
+
+    The ns_delay and eventcode of all triggers are cached from their
+    monitors, so reading the current delay and skipping unchanged triggers
+    costs no channel access round trips.
+
+    Parameters
+    ----------
+    channels: list of DelayChannel
+    """
+    def __init__(self, channels):
+        self.channels = {channel.name: channel for channel in channels}
+        self._cache = {}
+        # name : (ns_delay, shift) last written by apply
+        self._applied = {}
+        for channel in self.channels.values():
+            for attr in ('ns_delay', 'eventcode'):
+                if attr == 'eventcode' and channel.event_codes is None:
+                    continue
+                signal = getattr(channel.trigger, attr)
+                signal.subscribe(self._updater(channel.name, attr), run=True)
+
+    def _updater(self, name, attr):
+        def update(value=None, **kwargs):
+            self._cache[(name, attr)] = value
+        return update
+
+    @staticmethod
+    def _time_zero(channel):
+        return channel.time_zero() if callable(channel.time_zero) else channel.time_zero
+
+    @staticmethod
+    def _event_codes(channel):
+        return channel.event_codes() if callable(channel.event_codes) else channel.event_codes
+
+    def compute(self, delays):
+        """
+        Trigger settings of a list of delays, computed for all at once
+
+        Parameters
+        ----------
+        delays: array-like
+            Laser delays in ns
+
+        Returns
+        -------
+        ns_delay, eventcode, shift: dict
+            channel name : array over the delays
+
+        Raises
+        ------
+        ValueError
+            If any delay needs more bucket shifts than a channel allows
+        """
+        delays = np.atleast_1d(np.asarray(delays, dtype=float))
+        if not np.all(np.isfinite(delays)):
+            raise ValueError(f'Laser delays must be finite, got {delays}')
+        ns_delay, eventcode, shift = {}, {}, {}
+        for name, channel in self.channels.items():
+            base = self._time_zero(channel) - delays
+            if channel.min_delay is None:
+                k = np.zeros(len(delays), dtype=int)
+            else:
+                k = np.maximum(0, np.ceil((channel.min_delay - base)/bucket_ns)).astype(int)
+                too_long = k > channel.max_shift
+                if too_long.any():
+                    raise ValueError(f'Invalid input {delays[too_long]} ns for {name}, '
+                                     f'must be at most {channel.max_shift} buckets before time zero')
+            ns_delay[name] = base + k*bucket_ns
+            shift[name] = k
+            if channel.event_codes is not None:
+                codes = np.asarray(self._event_codes(channel))
+                if k.max() >= len(codes):
+                    raise ValueError(f'No event code for a shift of {k.max()} buckets on {name}')
+                eventcode[name] = codes[k]
+        return ns_delay, eventcode, shift
+
+    def delays_for_scan(self, delays):
+        """
+        Settings of every delay of a scan, all delays are checked before the
+        scan starts
+
+        Returns
+        -------
+        list of DelaySetting
+        """
+        ns_delay, eventcode, shift = self.compute(delays)
+        return [DelaySetting(float(delay),
+                             {name: float(values[i]) for name, values in ns_delay.items()},
+                             {name: int(values[i]) for name, values in eventcode.items()},
+                             {name: int(values[i]) for name, values in shift.items()})
+                for i, delay in enumerate(np.atleast_1d(delays))]
+
+    def apply(self, setting, timeout=5.0):
+        """
+        Write a DelaySetting as one concurrent batch and wait for the
+        readbacks, triggers already at their values are not written
+        """
+        from ophyd.status import wait as status_wait
+
+        changes = []
+        for name, value in setting.ns_delay.items():
+            signal = self.channels[name].trigger.ns_delay
+            current = self._cache.get((name, 'ns_delay'))
+            if current is None or abs(current - value) > (signal.tolerance or 0):
+                changes.append((name, signal, value))
+        for name, value in setting.eventcode.items():
+            if self._cache.get((name, 'eventcode')) != value:
+                changes.append((name, self.channels[name].trigger.eventcode, value))
+        if not changes:
+            logger.debug('Triggers already at delay %s ns', setting.delay)
+            return setting
+        disabled = {name for name, signal, value in changes if self.channels[name].disable}
+        for name in disabled:
+            self.channels[name].trigger.disable()
+        try:
+            status = None
+            for name, signal, value in changes:
+                st = signal.set(value, timeout=timeout)
+                status = st if status is None else status & st
+            status_wait(status, timeout=timeout)
+        finally:
+            for name in disabled:
+                self.channels[name].trigger.enable()
+        for name, signal, value in changes:
+            logger.info('Set %s %s to %s', name, signal.attr_name, value)
+        for name, value in setting.ns_delay.items():
+            self._applied[name] = (value, setting.shift[name])
+        return setting
+
+    def set_delay(self, delay, timeout=5.0):
+        """
+        Set all triggers for one laser delay in ns
+        """
+        logger.info("Setting delay %s ns (%s us)", delay, delay/1000.)
+        return self.apply(self.delays_for_scan([delay])[0], timeout=timeout)
+
+    def get_delay(self, name=None):
+        """
+        Laser delay in ns from the cached state of one channel, by default
+        the first one with event codes
+
+        The bucket shift is read from the event code. For a channel without
+        event codes it is only known if the trigger still has the delay
+        this manager set.
+
+        Raises
+        ------
+        ValueError
+            If the bucket shift of the channel cannot be recovered
+        """
+        if name is None:
+            name = next((n for n, c in self.channels.items() if c.event_codes is not None),
+                        next(iter(self.channels)))
+        channel = self.channels[name]
+        ns_delay = self._cache.get((name, 'ns_delay'))
+        if ns_delay is None:
+            ns_delay = channel.trigger.ns_delay.get()
+        shift = 0
+        if channel.event_codes is not None:
+            codes = list(self._event_codes(channel))
+            eventcode = self._cache.get((name, 'eventcode'))
+            if eventcode is None:
+                eventcode = channel.trigger.eventcode.get()
+            if eventcode not in codes:
+                raise ValueError(f'Event code {eventcode} of {name} is none of {codes}')
+            shift = codes.index(eventcode)
+        elif channel.min_delay is not None:
+            applied, shift = self._applied.get(name, (None, None))
+            if applied is None or abs(applied - ns_delay) > (channel.trigger.ns_delay.tolerance or 0):
+                raise ValueError(f'Bucket shift of {name} unknown, it was not set by this manager')
+        return self._time_zero(channel) + shift*bucket_ns - ns_delay
@@ -17,6 +17,8 @@ class MFX_Timing:
         }
         self.sync_markers = {0.5:0, 1:1, 5:2, 10:3, 30:4, 60:5, 120:6, 360:7}
         self.sequence = []
+        # compiled programs by (rep, laser)
+        self._programs = {}
 
 
     def _seq_step(self, evt_code_name=None, delta_beam=0):
@@ -38,9 +40,10 @@ class MFX_Timing:
 
 
     def _seq_put(self, steps):
+        from mfx.sequencer_io import write_sequence
         for step in steps:
             self.sequence.append(self._seq_step(step[0], step[1]))
-        self.seq.sequence.put_seq(self.sequence)
+        write_sequence(self.seq, self.sequence)
 
 
     def _seq_120hz(self):
@@ -103,6 +106,79 @@ class MFX_Timing:
         return steps
 
 
+    def compile_seq(self, rep=None, laser=None):
+        """
+    Build the full event sequencer program for a rate and laser pattern in
+    one pass. Programs are cached by their parameters.
+
+    Parameters
+    ----------
+    rep: int, optional
+        repitition rate, 120, 60, 30 and 20 Hz use the hand written
+        programs, other rates a program found by mfx.sequence_search
+
+    laser: list, optional
+        laser sequence list in format [['laser_on',0],['laser_off',0],...]
+
+    Returns
+    ----------
+    sync_mark, program: int, tuple
+        sync marker rate and the sequence lines
+        """
+        rep = 120 if rep is None else rep
+        laser = tuple((str(step[0]), int(step[1])) for step in laser) if laser else ()
+        key = (rep, laser)
+        if key not in self._programs:
+            if laser:
+                blocks = {120: (120, self._seq_120hz_trucated),
+                          60: (120, self._seq_60hz_trucated),
+                          30: (30, self._seq_30hz),
+                          20: (60, self._seq_20hz)}
+            else:
+                blocks = {120: (120, self._seq_120hz),
+                          60: (60, self._seq_60hz),
+                          30: (30, self._seq_30hz),
+                          20: (20, self._seq_20hz)}
+            if rep in blocks and blocks[rep][0] in self.sync_markers:
+                sync_mark, block = blocks[rep]
+                steps = []
+                if laser:
+                    sequence = block()
+                    for laser_evt in laser:
+                        steps += sequence[:-1] + [list(laser_evt)] + sequence[-1:]
+                else:
+                    steps = block()
+            else:
+                # no hand written program, search for the shortest one
+                from mfx.sequence_search import find_sequence
+                solution = find_sequence(rep, laser)
+                sync_mark, steps = solution.sync_marker, solution.steps
+            program = []
+            for name, delta_beam in steps:
+                if name not in self.evt_code:
+                    raise ValueError(f'Event sequencer step {name} not recognized.')
+                program.append((self.evt_code[name], delta_beam, 0, 0))
+            self._programs[key] = (sync_mark, tuple(program))
+        return self._programs[key]
+
+
+    def _seq_upload(self, sync_mark, program):
+        """
+        Write a compiled program unless the sequencer already holds it,
+        verified by readback instead of a fixed sleep
+
+        Returns
+        ----------
+        uploaded: bool
+            False if the sequencer already held the program
+        """
+        from mfx.sequencer_io import write_sequence
+        result = write_sequence(self.seq, program, sync_marker=self.sync_markers[sync_mark])
+        if not result.verified:
+            print('Warning: event sequencer readback does not match the written sequence.')
+        return not result.skipped
+
+
     def set_seq(self, rep=None, sequencer=None, laser=None):
         """
     Set your event sequencer
@@ -110,7 +186,8 @@ class MFX_Timing:
     Parameters
     ----------
     rep: int, optional
-        Set repitition rate only 120, 60, 30, and 20 Hz are currently available
+        Set repitition rate, 120, 60, 30, and 20 Hz use the hand written
+        programs, other rates are searched for, see compile_seq
 
     sequencer: str, optional
         default is event sequencer 7 and use 'spare' to run sequencer 12
@@ -120,60 +197,18 @@ class MFX_Timing:
 
     Operations
     ----------
-
+    The program is compiled once and written in a single upload, skipped if
+    the sequencer already holds it.
         """
+        sync_mark, program = self.compile_seq(rep, laser)
         self.seq1.stop()
         self.seq2.stop()
         if str(sequencer).lower() == 'spare':
             self.seq = self.seq2
         else:
             self.seq = self.seq1
-        if laser:
-            if rep is None or rep == 120:
-                self._seq_init(sync_mark=120)
-                for laser_evt in laser:
-                    sequence = self._seq_120hz_trucated()
-                    block = sequence[:-1]
-                    block.append(laser_evt)
-                    block.append(sequence[-1])
-                    self._seq_put(block)
-            elif rep == 60:
-                self._seq_init(sync_mark=120)
-                for laser_evt in laser:
-                    sequence = self._seq_60hz_trucated()
-                    block = sequence[:-1]
-                    block.append(laser_evt)
-                    block.append(sequence[-1])
-                    self._seq_put(block)
-            elif rep == 30:
-                self._seq_init(sync_mark=30)
-                for laser_evt in laser:
-                    sequence = self._seq_30hz()
-                    block = sequence[:-1]
-                    block.append(laser_evt)
-                    block.append(sequence[-1])
-                    self._seq_put(block)
-            elif rep == 20:
-                self._seq_init(sync_mark=60)
-                for laser_evt in laser:
-                    sequence = self._seq_20hz()
-                    block = sequence[:-1]
-                    block.append(laser_evt)
-                    block.append(sequence[-1])
-                    self._seq_put(block)
-        else:
-            if rep is None or rep == 120:
-                self._seq_init(sync_mark=120)
-                self._seq_put(self._seq_120hz())
-            elif rep == 60:
-                self._seq_init(sync_mark=60)
-                self._seq_put(self._seq_60hz())
-            elif rep == 30:
-                self._seq_init(sync_mark=30)
-                self._seq_put(self._seq_30hz())
-            elif rep == 20:
-                self._seq_init(sync_mark=20)
-                self._seq_put(self._seq_20hz())
+        self._seq_upload(sync_mark, program)
+        self.sequence = [list(step) for step in program]
 
         self.seq.start()
         return self.sequence
@@ -1,5 +1,7 @@
 import logging
 
+from mfx.sequencer_io import write_sequence
+
 logger = logging.getLogger(__name__)
 
 
@@ -38,10 +40,8 @@ class Rayonix:
             raise RuntimeError('Invalid rate, recieved {} but must be one of '
                                '{}'.format(rate, valid_rates))
 
-        # Use sequence to regulate rate, not sync marker
-        self.sequencer.sync_marker.put('120Hz')
-
         # Construct the sequence and submit
+        # Use sequence to regulate rate, not sync marker
         delta = 120 // rate - 3
         sequence = [[213, delta, 0, 0],
                     [197, 1, 0, 0],
@@ -50,23 +50,9 @@ class Rayonix:
                     [210, 1, 0, 0],
                     [198, 0, 0, 0]]
 
-        # sequence = [[213, 197, 212, 211, 210, 198],
-        #             [delta, 1, 0, 1, 1, 0],
-        #             [0, 0, 0, 0, 0, 0],
-        #             [0, 0, 0, 0, 0, 0]]
-        retries = 5
-        success = False
-        for i in range(retries):
-            self.sequencer.sequence.put_seq(sequence)
-            read_seq = [list(s) for s in self.sequencer.sequence.get_seq()]
-            if read_seq == sequence:
-                success = True
-                break
-
-        if success:
+        result = write_sequence(self.sequencer, sequence, sync_marker='120Hz', retries=5)
+        if result.verified:
             logger.info('Successfully configured sequencer')
-        else:
-            logger.error('Putting to sequencer failed!')
 
         if show_seq:
             self.sequencer.sequence.show()
@@ -0,0 +1,174 @@
+"""
+Search for the shortest event sequencer program of a rate and laser pattern
+
+X-ray shots are spread as evenly as possible over a program of P beam
+buckets, every shot fires the readout events and, below 120 Hz, the pulse
+picker some buckets ahead of it. Shot i fires the i-th laser event of the
+pattern. Detector triggers run free at their own rate. For increasing P,
+the candidates of all pulse picker leads and detector phases are checked
+together with mfx.sequence_sim.analyze, the first P with a valid program
+wins and of its candidates the one with the fewest lines.
+
+Results are cached per request, so recurring configurations are instant.
+"""
+from collections import namedtuple
+from math import gcd
+
+import numpy as np
+
+from mfx.sequence_sim import analyze, default_max_rate, default_min_spacing
+
+# MFX_Timing.evt_code
+evt_code = {
+    'wait': 0,
+    'pp_trig': 197,
+    'daq_readout': 198,
+    'laser_on': 203,
+    'laser_off': 204,
+    'ray_readout': 210,
+    'ray1': 211,
+    'ray2': 212,
+    'ray3': 213,
+}
+
+# sync marker rates of the hutch sequencer and their period in buckets
+sync_marker_periods = {0.5: 240, 1: 120, 5: 24, 10: 12, 30: 4, 60: 2, 120: 1}
+
+rayonix_events = (('ray_readout', 0), ('ray1', 1), ('ray2', 2), ('ray3', 3))
+
+SequenceSolution = namedtuple('SequenceSolution', ['steps', 'sync_marker', 'period', 'shots'])
+SequenceSolution.__doc__ = """
+steps: [[event name, delta_beam], ...] as consumed by MFX_Timing._seq_put
+sync_marker: sync marker rate in Hz the program runs with
+period: program length in buckets
+shots: X-ray shots per program
+"""
+
+_cache = {}
+
+
+def _sync_marker(period):
+    return max((rate for rate, buckets in sync_marker_periods.items() if period % buckets == 0),
+               key=lambda rate: sync_marker_periods[rate])
+
+
+def _build(period, shots, readout, picker, lead, detector, detector_period, phase, laser):
+    # (bucket, order, name) with buckets 1..period
+    events = []
+
+    def add(bucket, order, name):
+        events.append(((bucket - 1) % period + 1, order, name))
+
+    for start in range(phase, period, detector_period):
+        for name, offset in detector:
+            add(start + 1 + offset, 0, name)
+    for i in range(shots):
+        bucket = int(round((i + 1)*period/shots))
+        if picker is not None and shots < period:
+            add(bucket - lead, 1, picker)
+        for name, offset in readout:
+            add(bucket + offset, 2, name)
+        if laser:
+            name, offset = laser[i % len(laser)]
+            add(bucket + offset, 3, name)
+    events.sort()
+    steps = []
+    previous = 0
+    for bucket, order, name in events:
+        steps.append([name, bucket - previous])
+        previous = bucket
+    if previous < period:
+        steps.append(['wait', period - previous])
+    return steps
+
+
+def find_sequence(rate, laser=None, readout=(('daq_readout', 0),), picker='pp_trig',
+                  detector=rayonix_events, detector_rate=30, max_rate=None, min_spacing=None,
+                  max_lead=3, max_period=240):
+    """
+    Shortest valid program for an X-ray rate and laser pattern
+
+    Parameters
+    ----------
+    rate: float
+        X-ray rate in Hz, shots are spread unevenly if 120/rate is not whole
+
+    laser: list, optional
+        Laser events, one per shot, in format [['laser_on',0],['laser_off',0],...],
+        the number is the bucket offset from the shot
+
+    readout: tuple, optional
+        (event name, bucket offset) fired with every shot
+
+    picker: str, optional
+        Pulse picker event fired ahead of every shot below 120 Hz, None to skip
+
+    detector: tuple, optional
+        (event name, bucket offset) fired every 120/detector_rate buckets
+
+    detector_rate: float, optional
+
+    max_rate, min_spacing: dict, optional
+        Event code limits passed on to the analyzer, the defaults of
+        mfx.sequence_sim by default. No event may fire twice in a bucket
+
+    max_lead: int, optional
+        Most buckets the pulse picker may fire ahead of the shot
+
+    max_period: int, optional
+        Longest program in buckets to try
+
+    Returns
+    -------
+    SequenceSolution
+    """
+    laser = tuple((str(name), int(offset)) for name, offset in laser) if laser else ()
+    readout = tuple((str(name), int(offset)) for name, offset in readout)
+    detector = tuple((str(name), int(offset)) for name, offset in detector) if detector else ()
+    max_rate = dict(default_max_rate if max_rate is None else max_rate)
+    min_spacing = dict(default_min_spacing if min_spacing is None else min_spacing)
+    key = (rate, laser, readout, picker, detector, detector_rate,
+           tuple(sorted(max_rate.items())), tuple(sorted(min_spacing.items())), max_lead, max_period)
+    if key in _cache:
+        return _cache[key]
+
+    names = {name for name, offset in laser + readout + detector} | ({picker} if picker else set())
+    unknown = names - set(evt_code)
+    if unknown:
+        raise ValueError(f'Unknown events {sorted(unknown)}')
+    if not 0 < rate <= 120:
+        raise ValueError(f'Rate {rate} Hz outside of 0 - 120 Hz')
+    detector_period = 1
+    if detector:
+        detector_period = 120/detector_rate
+        if not float(detector_period).is_integer():
+            raise ValueError(f'Detector rate {detector_rate} Hz is not 120 Hz divided by a whole number')
+        detector_period = int(detector_period)
+
+    # shortest period holding a whole number of shots, laser pattern and detector cycle
+    numerator, denominator = (rate*2).as_integer_ratio() if isinstance(rate, float) else (rate*2, 1)
+    shots_ratio = gcd(240*denominator, numerator)
+    base = 240*denominator//shots_ratio
+    base_shots = numerator//shots_ratio
+    codes = sorted(evt_code[name] for name in names)
+    spacing = {code: max(1, min_spacing.get(code, 0)) for code in codes}
+    period, shots = base, base_shots
+    best = None
+    while best is None and period <= max_period:
+        if (not laser or shots % len(laser) == 0) and period % detector_period == 0:
+            candidates = [(lead, phase) for lead in range(1, max_lead + 1) for phase in range(detector_period)]
+            programs = [_build(period, shots, readout, picker, lead, detector, detector_period, phase, laser)
+                        for lead, phase in candidates]
+            lines = [[[evt_code[name], delta, 0, 0] for name, delta in steps] for steps in programs]
+            # the trailing wait sets the period, sync marker 120 Hz rounds nothing
+            result = analyze(lines, 120, codes=codes, max_rate=max_rate, min_spacing=spacing)
+            valid = np.nonzero(result.ok & (result.period == period))[0]
+            if len(valid):
+                best = programs[min(valid, key=lambda i: len(programs[i]))]
+                break
+        period, shots = period + base, shots + base_shots
+    if best is None:
+        raise ValueError(f'No valid program of up to {max_period} buckets for {rate} Hz')
+    solution = SequenceSolution(best, _sync_marker(period), period, shots)
+    _cache[key] = solution
+    return solution
@@ -0,0 +1,201 @@
+"""
+Offline simulation of event sequencer programs
+
+A program is a list of lines ``[event_code, delta_beam, delta_fiducial,
+burst_count]``. Line i fires its event code after the sum of the deltas up to
+and including it, counted in 120 Hz beam buckets from the start of the
+program (three fiducials per bucket). Event code 0 only waits. When the last
+line has fired the program restarts on the next sync marker, so it repeats
+with a period of the program length rounded up to a whole number of sync
+marker periods.
+
+Many programs are evaluated at once by padding them into arrays of equal
+length, see analyze.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+beam_rate = 120
+
+# buckets between two sync markers of each sync marker rate
+sync_periods = {0.5: 240, 1: 120, 5: 24, 10: 12, 20: 6, 30: 4, 60: 2, 120: 1, 360: 1/3}
+
+event_names = {197: 'pp_trig', 198: 'daq_readout', 203: 'laser_on', 204: 'laser_off',
+               208: 'galil_trig', 210: 'ray_readout', 211: 'ray1', 212: 'ray2', 213: 'ray3'}
+
+# Rayonix code limits per detector mode. In the full readout cycle of the
+# MFX_Timing programs without laser its codes fire at 30 Hz at most. The
+# truncated programs MFX_Timing uses with a laser pattern at 120 and 60 Hz
+# fire them every bucket and are checked without a limit. The 20 Hz laser
+# program fires ray3 at 60 Hz and fails the 'full' limits.
+detector_max_rate = {
+    'full': {210: 30, 211: 30, 212: 30, 213: 30},
+    'truncated': {},
+}
+default_max_rate = detector_max_rate['full']
+# the pulse picker fires at most every second bucket
+default_min_spacing = {197: 2}
+
+SequenceAnalysis = namedtuple('SequenceAnalysis', ['codes', 'period', 'counts', 'rates',
+                                                   'min_spacing', 'too_fast', 'too_close', 'ok'])
+SequenceAnalysis.__doc__ = """
+Result of analyze, arrays over (sequences,) or (sequences, codes)
+
+codes: event codes of the columns
+period: repetition period in buckets
+counts: events per period
+rates: events per second
+min_spacing: smallest distance in buckets between two events of a code,
+    including the wrap into the next period, inf for fewer than two
+too_fast, too_close: constraint violations per code
+ok: no violation at all
+"""
+
+
+def _sync_rate(sync_marker):
+    if isinstance(sync_marker, str):
+        sync_marker = float(sync_marker.lower().replace('hz', ''))
+    if sync_marker not in sync_periods:
+        raise ValueError(f'Unknown sync marker {sync_marker}, use one of {list(sync_periods)}')
+    return sync_marker
+
+
+def _is_line(item):
+    # a program line of four numbers, not a (possibly empty) program
+    return np.ndim(item) == 1 and len(item) == 4 and all(np.ndim(v) == 0 for v in item)
+
+
+def pack(sequences):
+    """
+    Pad programs into arrays
+
+    Parameters
+    ----------
+    sequences: list
+        Programs, or a single program
+
+    Returns
+    -------
+    codes, times: numpy.ndarray
+        (sequences, lines) event codes, -1 for padding, and firing times in
+        buckets
+    length: numpy.ndarray
+        Time of the last line of each program
+    """
+    if len(sequences) and _is_line(sequences[0]):
+        sequences = [sequences]
+    n = max((len(seq) for seq in sequences), default=0)
+    lines = np.zeros((len(sequences), max(n, 1), 4))
+    codes = np.full((len(sequences), max(n, 1)), -1, dtype=int)
+    for i, seq in enumerate(sequences):
+        if len(seq):
+            lines[i, :len(seq)] = seq
+            codes[i, :len(seq)] = lines[i, :len(seq), 0]
+    steps = lines[:, :, 1] + lines[:, :, 2]/3
+    times = np.cumsum(steps, axis=1)
+    return codes, times, times[:, -1]
+
+
+def periods(length, sync_marker=120):
+    """
+    Repetition period in buckets of programs of the given length
+    """
+    sync = sync_periods[_sync_rate(sync_marker)]
+    return np.maximum(np.ceil(np.asarray(length)/sync - 1e-9), 1)*sync
+
+
+def expand(sequence, n_buckets, sync_marker=120):
+    """
+    Events of one program over the first n_buckets beam buckets
+
+    Returns
+    -------
+    dict
+        event code : array of bucket numbers it fires in
+    """
+    codes, times, length = pack(sequence)
+    period = periods(length, sync_marker)[0]
+    repeats = int(np.ceil(n_buckets/period)) + 1
+    all_times = (times[0][None, :] + period*np.arange(repeats)[:, None]).ravel()
+    all_codes = np.tile(codes[0], repeats)
+    keep = (all_times < n_buckets) & (all_codes > 0)
+    return {int(code): all_times[keep & (all_codes == code)]
+            for code in np.unique(all_codes[keep])}
+
+
+def analyze(sequences, sync_marker=120, codes=None, max_rate=None, min_spacing=None):
+    """
+    Event rates and constraint checks of many programs at once
+
+    Parameters
+    ----------
+    sequences: list
+        Programs, or a single program
+
+    sync_marker: float or str, optional
+        Sync marker rate all programs run with, e.g. 120 or '120Hz'
+
+    codes: list, optional
+        Event codes to report, by default all codes used
+
+    max_rate: dict, optional
+        Event code : highest allowed rate in Hz, default_max_rate by default,
+        see detector_max_rate for the truncated Rayonix programs
+
+    min_spacing: dict, optional
+        Event code : smallest allowed distance in buckets,
+        default_min_spacing by default
+
+    Returns
+    -------
+    SequenceAnalysis
+    """
+    max_rate = default_max_rate if max_rate is None else max_rate
+    min_spacing = default_min_spacing if min_spacing is None else min_spacing
+    ec, times, length = pack(sequences)
+    period = periods(length, sync_marker)
+    if codes is None:
+        codes = np.unique(ec[ec > 0])
+    codes = np.asarray(codes, dtype=int)
+
+    # (sequences, codes, lines)
+    match = ec[:, None, :] == codes[None, :, None]
+    counts = match.sum(axis=2)
+    rates = counts/period[:, None]*beam_rate
+
+    fired = np.sort(np.where(match, times[:, None, :], np.inf), axis=2)
+    with np.errstate(invalid='ignore'):
+        # inf - inf after the last event of a code
+        gaps = np.diff(fired, axis=2)
+        gaps[~np.isfinite(gaps)] = np.inf
+        first = fired[:, :, 0]
+        last = np.take_along_axis(fired, np.maximum(counts - 1, 0)[:, :, None], axis=2)[:, :, 0]
+        wrap = np.where(counts > 1, first + period[:, None] - last, np.inf)
+    spacing = np.minimum(gaps.min(axis=2, initial=np.inf), wrap)
+    # a single event per period is spaced by the period
+    spacing = np.where(counts == 1, period[:, None], spacing)
+
+    limit_rate = np.array([max_rate.get(int(c), np.inf) for c in codes])
+    limit_spacing = np.array([min_spacing.get(int(c), 0) for c in codes])
+    too_fast = rates > limit_rate
+    too_close = spacing < limit_spacing
+    ok = ~(too_fast.any(axis=1) | too_close.any(axis=1))
+    return SequenceAnalysis(codes, period, counts, rates, spacing, too_fast, too_close, ok)
+
+
+def report(sequence, sync_marker=120, **kwargs):
+    """
+    Print the rates and constraint checks of one program
+    """
+    result = analyze([sequence], sync_marker, **kwargs)
+    print(f'period {result.period[0]:g} buckets ({beam_rate/result.period[0]:g} Hz)')
+    for i, code in enumerate(result.codes):
+        flags = []
+        if result.too_fast[0, i]:
+            flags.append('too fast')
+        if result.too_close[0, i]:
+            flags.append('too close')
+        print(f'{code:4d} {event_names.get(code, ""):12s} {result.rates[0, i]:8.2f} Hz  '
+              f'spacing {result.min_spacing[0, i]:g}  {", ".join(flags)}')
+    return result
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+SequencerWrite = namedtuple('SequencerWrite', ['lines', 'skipped', 'verified', 'attempts',
+                                               'write_time', 'verify_time'])
+SequencerWrite.__doc__ = """
+Outcome of write_sequence, times in seconds
+"""
+
+
+def _sync_matches(signal, value):
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return signal.get(as_string=True) == value
+    return signal.get() == value
+
+
+def _columns(program):
+    return [[int(line[i]) for line in program] for i in range(4)]
+
+
+def _arrays(sequencer):
+    seq = sequencer.sequence
+    return (seq.ec_array, seq.bd_array, seq.fd_array, seq.bc_array)
+
+
+def _holds(sequencer, columns):
+    n = len(columns[0])
+    if sequencer.sequence_length.get() != n:
+        return False
+    return all([int(v) for v in signal.get()[:n]] == column
+               for signal, column in zip(_arrays(sequencer), columns))
+
+
+def wait_for_signal(signal, predicate, timeout):
+    """
+    Wait until predicate(value) holds for a signal, driven by its monitor
+    callbacks instead of repeated reads
+
+    Returns
+    -------
+    bool
+        False if the timeout passed first
+    """
+    done = threading.Event()
+
+    def check(value=None, **kwargs):
+        try:
+            if predicate(value):
+                done.set()
+        except Exception:
+            pass
+
+    cid = signal.subscribe(check, run=True)
+    try:
+        return done.wait(timeout)
+    finally:
+        signal.unsubscribe(cid)
+
+
+def write_sequence(sequencer, program, sync_marker=None, previous_length=None,
+                   timeout=2.0, retries=3):
+    """
+    Write a whole event sequencer program and verify it
+
+    Each of the four line arrays is written with a single put. Lines left
+    over from a longer previous program are zeroed in the same put, so the
+    sequencer never needs a separate clear. Nothing is written if the
+    sequencer already holds the program.
+
+    Parameters
+    ----------
+    sequencer: pcdsdevices.sequencer.EventSequencer
+
+    program: list
+        Lines of [event_code, delta_beam, delta_fiducial, burst_count]
+
+    sync_marker: int or str, optional
+        Sync marker to set along with the program
+
+    previous_length: int, optional
+        Length of the program currently loaded, read from the sequencer
+        if not given
+
+    timeout: float, optional
+        Seconds to wait for the readback of each attempt
+
+    retries: int, optional
+        Number of writes before giving up
+
+    Returns
+    -------
+    SequencerWrite
+    """
+    columns = _columns(program)
+    n = len(program)
+    if _sync_matches(sequencer.sync_marker, sync_marker) and _holds(sequencer, columns):
+        logger.debug('Sequencer %s already holds the %s line program', sequencer.name, n)
+        return SequencerWrite(n, True, True, 0, 0.0, 0.0)
+
+    if previous_length is None:
+        previous_length = sequencer.sequence_length.get()
+    pad = max(0, previous_length - n)
+    padded = [column + [0]*pad for column in columns]
+
+    write_time = verify_time = 0.0
+    verified = False
+    attempt = 0
+    for attempt in range(1, retries + 1):
+        start = time.monotonic()
+        if sync_marker is not None:
+            sequencer.sync_marker.put(sync_marker)
+        for signal, column in zip(_arrays(sequencer), padded):
+            signal.put(column)
+        sequencer.sequence_length.put(n)
+        sequencer.sequence.seq_proc.put(1)
+        write_time += time.monotonic() - start
+
+        start = time.monotonic()
+        verified = all(
+            wait_for_signal(signal, lambda value, column=column: value is not None
+                            and [int(v) for v in value[:n]] == column, timeout)
+            for signal, column in zip(_arrays(sequencer), columns))
+        verified = verified and wait_for_signal(sequencer.sequence_length, lambda value: value == n, timeout)
+        verify_time += time.monotonic() - start
+        if verified:
+            break
+        logger.warning('Sequencer %s readback differs after write %s of %s', sequencer.name, attempt, retries)
+
+    result = SequencerWrite(n, False, verified, attempt, write_time, verify_time)
+    if verified:
+        logger.info('Wrote %s lines to %s in %.3f s, verified in %.3f s', n, sequencer.name,
+                    write_time, verify_time)
+    else:
+        logger.error('Putting to sequencer %s failed!', sequencer.name)
+    return result
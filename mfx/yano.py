@@ -27,6 +27,13 @@ class yano:
         self.SAMPLE = 212
         self.rep_rate = 20
 
+        # OPO trigger settings, moved to an earlier event code for long delays.
+        # Time zero and event codes are read on every use, so they can be changed
+        from mfx.laser_delay import LaserDelayManager, DelayChannel
+        self.delay_manager = LaserDelayManager([
+            DelayChannel('opo', self.opo, lambda: self.opo_time_zero,
+                         event_codes=lambda: (self.opo_ec_short, self.opo_ec_long, self.opo_ec_longer))])
+
 
     @property
     def shutter_status(self):
@@ -120,7 +127,7 @@ class yano:
         return adjusted_delay 
 
 
-    def set_delay(self, delay):
+    def set_delay(self, delay, setting=None):
         """
         Set the delay
 
@@ -128,37 +135,47 @@ class yano:
         ----------
         delay: float
             Requested laser delay in nanoseconds.
+
+        setting: DelaySetting, optional
+            Precomputed trigger settings of the delay, see delays_for_scan
         """
         import logging
         logger = logging.getLogger(__name__)
-        # Determine event code of inhibit pulse
+        if setting is None:
+            setting = self.delay_manager.delays_for_scan([delay])[0]
         logger.info("Setting delay %s ns (%s us)", delay, delay/1000.)
         self.delay = delay
-        opo_delay = self.opo_time_zero - delay
-        opo_ec = self.opo_ec_short
-        if delay > self.opo_time_zero + 1e9/120:
-            opo_delay += 2e9/120
-            opo_ec = self.opo_ec_longer
-            logger.info('Laser is 2 buckets before the beam')
-        elif delay > self.opo_time_zero:
-            opo_delay += 1e9/120
-            opo_ec = self.opo_ec_long
-            logger.info('Laser is 1 bucket before the beam')
+        shift = setting.shift['opo']
+        if shift == 0:
+            logger.info('Laser is in the same bucket as the beam')
         else:
-            logger.info('Laser is in the same bucket as the beam')      
-
-
-        self.opo.ns_delay.put(opo_delay)
-        logger.info("Setting OPO delay %s ns", opo_delay)
-        self.opo.eventcode.put(opo_ec)
-        logger.info("Setting OPO ec %s", opo_ec)
+            logger.info('Laser is %s bucket%s before the beam', shift, 's' if shift > 1 else '')
+        self.delay_manager.apply(setting)
         logger.info(self._delaystr(delay))
         return
 
 
+    def delays_for_scan(self, delays):
+        """
+        Trigger settings of all delays of a scan, computed at once so that
+        invalid delays fail before the scan starts
+
+        Parameters
+        ----------
+        delays: list
+            Requested laser delays in nanoseconds.
+
+        Returns
+        ----------
+        settings: dict
+            delay : DelaySetting, pass them on to set_delay
+        """
+        return dict(zip(delays, self.delay_manager.delays_for_scan(delays))) if len(delays) else {}
+
+
     def get_delay(self):
         """
-        Reads the current delay in ns
+        Reads the current delay in ns from the monitored OPO trigger
 
         Parameters
         ----------
@@ -167,11 +184,7 @@ class yano:
         """
         import logging
         logger = logging.getLogger(__name__)
-        if self.opo.eventcode.get() == self.opo_ec_long:
-            opo_delay = self.opo.ns_delay.get() - 1e9/120
-        else:
-            opo_delay = self.opo.ns_delay.get()
-        delay = self.opo_time_zero - opo_delay 
+        delay = self.delay_manager.get_delay('opo')
         logger.info(self._delaystr(delay))
         return delay
 
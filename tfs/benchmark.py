@@ -0,0 +1,376 @@
+"""
+Benchmarks of the transfocator focusing calculations with simulated lenses
+
+Times LensConnect.image, TFS_Calculator.combinations,
+TFS_Calculator.find_solution and Transfocator.find_best_combo for a range
+of lens counts, energies and targets, appends the results to a JSON history
+file and flags regressions against a stored baseline. By default the focal
+length cache of :mod:`tfs.utils` is cleared before every repetition, so the
+pcdscalc path is timed; ``--cache warm`` times cache hits after an untimed
+warm-up instead::
+
+    python -m tfs.benchmark --save-baseline
+    python -m tfs.benchmark --baseline tfs_benchmark_baseline.json
+
+With ``--widths`` the beam width estimators of :mod:`tfs.width_estimators`
+are also timed on simulated noisy profiles and compared in accuracy with
+the ``curve_fit`` fit previously used by the transfocator aligner.
+"""
+############
+# Standard #
+############
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os.path
+import platform
+import statistics
+import sys
+import time
+import warnings
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+from tfs import utils
+from tfs.lens import LensCalcMixin, LensConnect
+from tfs.offline_calculator import TFS_Calculator
+from tfs.width_estimators import estimators, fwhm_per_sigma
+
+logger = logging.getLogger(__name__)
+
+
+default_history = 'tfs_benchmark_history.json'
+default_baseline = 'tfs_benchmark_baseline.json'
+
+
+class SimLens(LensCalcMixin):
+    """
+    Stand-in for an MFXLens with fixed radius, z and insertion state
+    """
+    def __init__(self, prefix, radius, z, inserted=False):
+        self.prefix = prefix
+        self.radius = radius
+        self.z = z
+        self.inserted = inserted
+
+    def __repr__(self):
+        return 'SimLens({!r}, radius={}, z={})'.format(self.prefix,
+                                                      self.radius, self.z)
+
+
+def sim_lenses(ntfs, seed=0):
+    """
+    A reproducible set of simulated TFS and pre-focus lenses
+
+    The pre-focus lenses match the radii of MFX_prefocus_energy_range, the
+    TFS radii are drawn from the standard Be lens radii.
+
+    Returns
+    -------
+    tuple
+        (TFS lenses, pre-focus lenses)
+    """
+    rng = np.random.default_rng(seed)
+    radii = rng.choice([50., 62.5, 100., 125., 200., 250., 300., 500.],
+                       size=ntfs)
+    tfs = [SimLens('SIM:TFS:{:02}'.format(i + 2), radius, 397.0 + 0.1*i)
+           for i, radius in enumerate(radii)]
+    xrt = [SimLens('SIM:DIA:{:02}'.format(3 - i), radius, 300.0 + 0.1*i)
+           for i, radius in enumerate((333., 428., 750.))]
+    return tfs, xrt
+
+
+def sim_transfocator(energy=9500.):
+    """
+    Fake MFX Transfocator whose lenses have simulated radius and z
+
+    Returns
+    -------
+    Transfocator
+    """
+    from ophyd.sim import make_fake_device
+    from tfs.transfocator import Transfocator
+
+    tfs = make_fake_device(Transfocator)('SIM:LENS', name='sim_tfs')
+    sim_tfs, sim_xrt = sim_lenses(len(tfs.tfs_lenses))
+    for lens, sim in zip(tfs.tfs_lenses + tfs.xrt_lenses, sim_tfs + sim_xrt):
+        lens._sig_radius.sim_put(sim.radius)
+        lens._sig_z.sim_put(sim.z)
+        lens._inserted.sim_put(0)
+        lens._removed.sim_put(1)
+    tfs.beam_energy.sim_put(energy)
+    return tfs
+
+
+def timeit(func, repeat=5, cache='cold'):
+    """
+    Run ``func`` ``repeat`` times, discarding its output
+
+    Parameters
+    ----------
+    cache : str, optional
+        'cold' clears the :mod:`tfs.utils` caches before every run, 'warm'
+        runs ``func`` once untimed first, None for code that does not use
+        the caches
+
+    Returns
+    -------
+    dict
+        Median, minimum and mean time in seconds and the cache mode
+    """
+    if cache not in ('cold', 'warm', None):
+        raise ValueError("cache must be 'cold', 'warm' or None, not {!r}".format(cache))
+    times = []
+    if cache == 'warm':
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    for _ in range(repeat):
+        if cache == 'cold':
+            utils.clear_cache()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    timing = {'median': statistics.median(times), 'min': min(times),
+              'mean': statistics.fmean(times), 'repeat': repeat}
+    if cache is not None:
+        timing['cache'] = cache
+    return timing
+
+
+def run(sizes=range(5, 17), energies=(6000., 9500., 11000., 14000.),
+        targets=(399.0, 399.88103, 401.0), repeat=5, cache='cold'):
+    """
+    Time the focusing paths
+
+    ``find_solution`` is timed over every energy and target, the other
+    paths at the first of them. ``find_best_combo`` is timed on the fake
+    Transfocator, which always has the MFX lens count. ``cache`` is passed
+    on to :func:`.timeit`.
+
+    Returns
+    -------
+    dict
+        Case name to timing, see :func:`.timeit`
+    """
+    results = dict()
+    energy = energies[0]
+    for n in sizes:
+        tfs, xrt = sim_lenses(n)
+        combo = LensConnect(*tfs)
+        results['LensConnect.image[{}]'.format(n)] = timeit(
+            lambda: combo.image(0.0, energy), repeat, cache)
+        calc = TFS_Calculator(tfs, prefocus_lenses=xrt)
+        results['TFS_Calculator.combinations[{}]'.format(n)] = timeit(
+            calc.combinations, repeat, cache)
+
+        def sweep():
+            for e in energies:
+                for target in targets:
+                    calc.find_solution(target, e)
+        results['TFS_Calculator.find_solution[{}]'.format(n)] = timeit(
+            sweep, repeat, cache)
+        logger.info("Benchmarked %s lenses", n)
+    tfs = sim_transfocator(energy)
+    # the first call also pays for setting up the device, always cold
+    results['Transfocator.find_best_combo[first]'] = timeit(
+        lambda: tfs.find_best_combo(target=targets[0]), 1)
+    results['Transfocator.find_best_combo'] = timeit(
+        lambda: tfs.find_best_combo(target=targets[0]), repeat, cache)
+    return results
+
+
+def sim_profiles(nprofiles=100, size=400, noise=0.02, hot_pixels=1, seed=0):
+    """
+    Noisy Gaussian beam profiles on a constant background
+
+    Parameters
+    ----------
+    nprofiles : int, optional
+        Number of profiles
+
+    size : int, optional
+        Samples per profile
+
+    noise : float, optional
+        Standard deviation of the noise relative to the peak
+
+    hot_pixels : int, optional
+        Number of single samples per profile with a large spike
+
+    Returns
+    -------
+    tuple
+        (profiles of shape (nprofiles, size), true FWHM of every profile)
+    """
+    rng = np.random.default_rng(seed)
+    x = np.arange(size, dtype=float)
+    center = rng.uniform(0.35, 0.65, nprofiles)*size
+    sigma = rng.uniform(0.01, 0.1, nprofiles)*size
+    profiles = np.exp(-(x - center[:, np.newaxis])**2
+                      / (2*sigma[:, np.newaxis]**2))
+    profiles += 0.05 + rng.normal(0, noise, profiles.shape)
+    for _ in range(hot_pixels):
+        profiles[np.arange(nprofiles),
+                 rng.integers(0, size, nprofiles)] += 3.0
+    return profiles, fwhm_per_sigma*sigma
+
+
+def curve_fit_widths(profiles):
+    """
+    FWHM of each profile from the curve_fit fit the aligner used to run
+    """
+    from scipy.optimize import curve_fit
+
+    def gaussian(x, amplitude, mean, stddev):
+        return amplitude * np.exp(-((x - mean) / 4 / stddev)**2)
+
+    x = np.arange(profiles.shape[-1], dtype=float)
+    widths = np.full(len(profiles), np.nan)
+    for i, y in enumerate(profiles):
+        y = y - y.min()
+        maxi = np.percentile(y, 95)
+        guess = [maxi, x[np.argmin(y - maxi/2)], np.std(x)]
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                popt, _ = curve_fit(gaussian, x, y, guess, maxfev=999999)
+        except RuntimeError:
+            continue
+        # stddev of gaussian is a quarter of sqrt(2) sigma
+        widths[i] = fwhm_per_sigma*2*np.sqrt(2)*abs(popt[2])
+    return widths
+
+
+def run_widths(nprofiles=100, size=400, repeat=5, reference=True):
+    """
+    Time the width estimators on simulated profiles
+
+    Returns
+    -------
+    dict
+        Case name to timing, see :func:`.timeit`, with the median relative
+        FWHM error as ``error`` and the number of failed estimates as
+        ``failed``
+    """
+    profiles, fwhm = sim_profiles(nprofiles, size)
+    methods = {name: (lambda f=func: f(profiles).fwhm)
+               for name, func in estimators.items()}
+    if reference:
+        methods['curve_fit'] = lambda: curve_fit_widths(profiles)
+    results = dict()
+    for name, method in methods.items():
+        # the estimators do not use the focal length cache
+        timing = timeit(method, 1 if name == 'curve_fit' else repeat, None)
+        error = np.abs(method() - fwhm)/fwhm
+        timing['error'] = float(np.nanmedian(error))
+        timing['failed'] = int(np.count_nonzero(~np.isfinite(error)))
+        results['width.{}[{}x{}]'.format(name, nprofiles, size)] = timing
+    return results
+
+
+def record(results, path=default_history):
+    """
+    Append a timestamped entry with ``results`` to the JSON history file
+    """
+    history = load(path) or []
+    history.append({'time': time.time(), 'host': platform.node(),
+                    'python': platform.python_version(),
+                    'results': results})
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+    return history
+
+
+def load(path):
+    """
+    Contents of a JSON results file, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.5):
+    """
+    Cases whose median time exceeds the baseline by more than ``tolerance``
+
+    Cases measured with a different cache mode than the baseline are
+    skipped.
+
+    Returns
+    -------
+    dict
+        Case name to the ratio of the new median to the baseline median
+    """
+    regressions = dict()
+    for name, timing in results.items():
+        if name not in baseline:
+            continue
+        if timing.get('cache') != baseline[name].get('cache'):
+            continue
+        ratio = timing['median'] / baseline[name]['median']
+        if ratio > 1 + tolerance:
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tfs.benchmark',
+        description='Benchmark the transfocator focusing calculations')
+    parser.add_argument('--min-lenses', type=int, default=5)
+    parser.add_argument('--max-lenses', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--history', default=default_history,
+                        help='JSON file the results are appended to')
+    parser.add_argument('--baseline', default=default_baseline,
+                        help='JSON file with the baseline results')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed relative slow down before flagging')
+    parser.add_argument('--cache', choices=('cold', 'warm'), default='cold',
+                        help='Clear the focal length cache before every run '
+                             'or time cache hits after a warm-up')
+    parser.add_argument('--widths', action='store_true',
+                        help='Also benchmark the beam width estimators')
+    args = parser.parse_args(argv)
+
+    results = run(sizes=range(args.min_lenses, args.max_lenses + 1),
+                  repeat=args.repeat, cache=args.cache)
+    if args.widths:
+        results.update(run_widths(repeat=args.repeat))
+    for name, timing in results.items():
+        line = '{:45s} {:10.3f} ms {:4s}'.format(name, timing['median']*1e3,
+                                                timing.get('cache', ''))
+        if 'error' in timing:
+            line += '  error {:6.2%}  failed {}'.format(timing['error'],
+                                                      timing['failed'])
+        print(line)
+    record(results, args.history)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        return 0
+    baseline = load(args.baseline)
+    if baseline is None:
+        print('No baseline at {}'.format(args.baseline))
+        return 0
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    for name, ratio in regressions.items():
+        print('REGRESSION {}: {:.2f}x baseline'.format(name, ratio))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Vectorized evaluation of every transfocator lens combination
+"""
+############
+# Standard #
+############
+import functools
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+import tfs.utils as ut
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def subset_masks(nlens):
+    """
+    Bitmask table of all 2^N subsets of ``nlens`` lenses
+
+    Row ``m`` of the table selects lens ``i`` if bit ``i`` of ``m`` is set,
+    so row 0 is the empty combination. The table is cached per lens count
+    and must not be modified in place.
+
+    Parameters
+    ----------
+    nlens : int
+        Number of lenses
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array of shape (2^nlens, nlens)
+    """
+    rows = np.arange(2**nlens, dtype=np.int64)[:, np.newaxis]
+    masks = ((rows >> np.arange(nlens)) & 1).astype(bool)
+    masks.setflags(write=False)
+    return masks
+
+
+def pareto_front(objectives):
+    """
+    Rows of ``objectives`` that no other row dominates
+
+    A row dominates another if it is lower or equal in every column and
+    strictly lower in at least one. Rows are visited in lexicographic order,
+    so a row can only be dominated by one visited before it, and each row is
+    only compared to the front found so far.
+
+    Parameters
+    ----------
+    objectives : np.ndarray
+        Array of shape (candidates, objectives), all to be minimized
+
+    Returns
+    -------
+    np.ndarray
+        Indices of the non-dominated rows, in lexicographic order
+    """
+    objectives = np.asarray(objectives, dtype=float)
+    order = np.lexsort(objectives.T[::-1])
+    front = []
+    for i in order:
+        row = objectives[i]
+        # Identical rows do not dominate each other and are all kept
+        if front:
+            other = objectives[front]
+            if np.any(np.all(other <= row, axis=1)
+                      & np.any(other < row, axis=1)):
+                continue
+        front.append(i)
+    return np.array(front, dtype=int)
+
+
+class ComboEngine:
+    """
+    Batched thin-lens solver over all subsets of the transfocator lenses
+
+    The radius and z position of each lens are read once on construction.
+    Image positions of every subset of TFS lenses, combined with every
+    pre-focus choice (none or one of the XRT lenses), are then computed in a
+    single pass over the lenses instead of creating a ``LensConnect`` object
+    per combination.
+
+    Parameters
+    ----------
+    tfs_lenses : list
+        Transfocator lenses. Any object with ``radius`` and ``z``
+
+    prefocus_lenses : list, optional
+        Pre-focusing XRT lenses, at most one of which is inserted at a time
+    """
+    def __init__(self, tfs_lenses, prefocus_lenses=None):
+        self.tfs_lenses = list(tfs_lenses)
+        self.prefocus_lenses = list(prefocus_lenses or [])
+        self.tfs_radius = np.array([float(lens.radius)
+                                    for lens in self.tfs_lenses])
+        self.tfs_z = np.array([float(lens.z) for lens in self.tfs_lenses])
+        self.prefocus_radius = np.array([float(lens.radius)
+                                         for lens in self.prefocus_lenses])
+        self.prefocus_z = np.array([float(lens.z)
+                                    for lens in self.prefocus_lenses])
+        self.masks = subset_masks(len(self.tfs_lenses))
+        self.nlens = self.masks.sum(axis=1)
+        # Selection of every lens for every (prefocus choice, subset) pair,
+        # walked in beam order so that upstream lenses image first
+        z = np.concatenate([self.prefocus_z, self.tfs_z])
+        self._order = np.argsort(z, kind='stable')
+        self._z = z[self._order]
+        nchoice = len(self.prefocus_lenses) + 1
+        prefocus_sel = np.zeros((nchoice, len(self.prefocus_lenses)),
+                                dtype=bool)
+        prefocus_sel[np.arange(1, nchoice),
+                     np.arange(len(self.prefocus_lenses))] = True
+        select = np.concatenate(
+            [np.broadcast_to(prefocus_sel[:, np.newaxis, :],
+                             (nchoice, len(self.masks),
+                              len(self.prefocus_lenses))),
+             np.broadcast_to(self.masks[np.newaxis, :, :],
+                             (nchoice,) + self.masks.shape)],
+            axis=2)
+        self._select = np.ascontiguousarray(select[:, :, self._order])
+        logger.debug("Prepared %s combinations of %s Transfocator lenses",
+                     len(self.masks), len(self.tfs_lenses))
+
+    def focal_lengths(self, energy):
+        """
+        Focal length of every prefocus and TFS lens at ``energy``
+
+        Returns
+        -------
+        tuple
+            (prefocus focal lengths, TFS focal lengths) in meters
+        """
+        focus = ut.focal_length(np.concatenate([self.prefocus_radius,
+                                                self.tfs_radius]), energy)
+        return (focus[:len(self.prefocus_radius)],
+                focus[len(self.prefocus_radius):])
+
+    def transmissions(self, energy):
+        """
+        Transmission of every combination
+
+        Returns
+        -------
+        np.ndarray
+            Array in the same layout as :meth:`.images`
+        """
+        trans = ut.lens_transmission(np.concatenate([self.prefocus_radius,
+                                                     self.tfs_radius]), energy)
+        prefocus = np.concatenate([[1.0], trans[:len(self.prefocus_radius)]])
+        tfs = np.exp(self.masks @ np.log(trans[len(self.prefocus_radius):]))
+        return prefocus[:, np.newaxis] * tfs[np.newaxis, :]
+
+    def moves(self, tfs_inserted, prefocus_inserted=None):
+        """
+        Number of lenses to insert or remove to reach every combination
+
+        Parameters
+        ----------
+        tfs_inserted : array-like of bool
+            Current insertion state of each TFS lens
+
+        prefocus_inserted : array-like of bool, optional
+            Current insertion state of each prefocus lens, all removed if not
+            given
+
+        Returns
+        -------
+        np.ndarray
+            Array in the same layout as :meth:`.images`
+        """
+        tfs_inserted = np.asarray(tfs_inserted, dtype=bool)
+        if prefocus_inserted is None:
+            prefocus_inserted = np.zeros(len(self.prefocus_lenses), dtype=bool)
+        prefocus_inserted = np.asarray(prefocus_inserted, dtype=bool)
+        tfs = np.count_nonzero(self.masks != tfs_inserted, axis=1)
+        choice = np.zeros((len(self.prefocus_lenses) + 1,
+                           len(self.prefocus_lenses)), dtype=bool)
+        choice[np.arange(1, len(choice)),
+               np.arange(len(self.prefocus_lenses))] = True
+        prefocus = np.count_nonzero(choice != prefocus_inserted, axis=1)
+        return prefocus[:, np.newaxis] + tfs[np.newaxis, :]
+
+    def images(self, energy, z_obj=0.0, focal_lengths=None):
+        """
+        Image position of every combination
+
+        Parameters
+        ----------
+        energy : float
+            Photon energy in eV
+
+        z_obj : float, optional
+            The source point of the beam
+
+        focal_lengths : tuple, optional
+            Precomputed output of :meth:`.focal_lengths`
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (1 + number of prefocus lenses, 2^N). Row 0 is
+            without a prefocus lens, row ``p`` with ``prefocus_lenses[p-1]``.
+            Column ``m`` is the TFS subset ``masks[m]``. Subsets without any
+            lens image at ``z_obj``
+        """
+        if focal_lengths is None:
+            focal_lengths = self.focal_lengths(energy)
+        focus = np.concatenate(focal_lengths)[self._order]
+        return self._propagate(focus[np.newaxis, :], z_obj)[0]
+
+    def images_many(self, energies, z_obj=0.0):
+        """
+        Image position of every combination at several energies at once
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (energies,) + the shape of :meth:`.images`
+        """
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        radius = np.concatenate([self.prefocus_radius, self.tfs_radius])
+        focus = ut.focal_length(radius[np.newaxis, :], energies[:, np.newaxis])
+        return self._propagate(focus[:, self._order], z_obj)
+
+    def _propagate(self, focus, z_obj):
+        """
+        Thin-lens pass over all lenses in beam order for rows of focal lengths
+        """
+        image = np.full((len(focus),) + self._select.shape[:2], float(z_obj))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, z in enumerate(self._z):
+                sel = self._select[np.newaxis, :, :, i]
+                f = focus[:, i, np.newaxis, np.newaxis]
+                obj = z - image
+                # An object at the focal length images at infinity
+                plane = np.where(obj == f, np.inf,
+                                 1/(1/f - 1/obj) + z)
+                image = np.where(sel, plane, image)
+        return image
+
+    def prefocus_index(self, lens):
+        """
+        Row of :meth:`.images` matching a given prefocus lens (or None)
+        """
+        if lens is None:
+            return 0
+        for i, prefocus in enumerate(self.prefocus_lenses):
+            if prefocus is lens:
+                return i + 1
+        raise ValueError("{} is not a prefocus lens of this engine"
+                         "".format(lens))
+
+    def best(self, target, energy, prefocus=0, n=None, k=1, z_obj=0.0,
+             images=None):
+        """
+        Best TFS combinations to image at ``target``
+
+        Parameters
+        ----------
+        target : float
+            The desired position of the focal plane
+
+        energy : float
+            Photon energy in eV
+
+        prefocus : int, optional
+            Row of :meth:`.images` to consider, see :meth:`.prefocus_index`
+
+        n : int, optional
+            Maximum number of TFS lenses in a valid combination
+
+        k : int, optional
+            Number of solutions to return
+
+        z_obj : float, optional
+            The source point of the beam
+
+        images : np.ndarray, optional
+            Precomputed output of :meth:`.images`
+
+        Returns
+        -------
+        list
+            Up to ``k`` tuples of (subset index, |image - target|, image)
+            sorted by increasing error
+        """
+        if images is None:
+            images = self.images(energy, z_obj=z_obj)
+        image = images[prefocus]
+        diff = np.abs(image - target)
+        # The empty combination is never a solution
+        valid = self.nlens > 0
+        if n is not None:
+            valid &= self.nlens <= n
+        diff = np.where(valid & np.isfinite(diff), diff, np.inf)
+        k = min(k, int(np.count_nonzero(np.isfinite(diff))))
+        if k <= 0:
+            return []
+        idx = np.argpartition(diff, k - 1)[:k]
+        idx = idx[np.argsort(diff[idx], kind='stable')]
+        return [(int(i), float(diff[i]), float(image[i])) for i in idx]
+
+    def lenses(self, index, prefocus=0):
+        """
+        Lens objects of a combination, prefocus lens first
+        """
+        selected = [lens for lens, used in zip(self.tfs_lenses,
+                                               self.masks[index]) if used]
+        if prefocus:
+            selected.insert(0, self.prefocus_lenses[prefocus - 1])
+        return selected
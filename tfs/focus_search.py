@@ -0,0 +1,145 @@
+"""
+Adaptive search for the transfocator position with the smallest beam
+"""
+############
+# Standard #
+############
+import logging
+from collections import namedtuple
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# 1/phi, the fraction of the bracket kept at every golden-section step
+inv_phi = (np.sqrt(5) - 1)/2
+
+
+class FocusSearchResult(namedtuple('FocusSearchResult',
+                                   ['position', 'width', 'positions',
+                                    'widths', 'moves', 'frames'])):
+    """
+    Outcome of :func:`.golden_section_focus`
+
+    ``positions`` and ``widths`` hold every measurement in the order taken,
+    ``moves`` is the number of motor moves and ``frames`` the number of
+    camera frames used.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return ('FocusSearchResult(position={:.3f}, width={:.2f}, moves={}, '
+                'frames={})'.format(self.position, self.width, self.moves,
+                                    self.frames))
+
+
+class _Measurements:
+    """
+    Memoized measurement function, counting motor moves and frames
+    """
+    def __init__(self, measure, resolution):
+        self.measure = measure
+        self.resolution = resolution
+        self.positions = []
+        self.widths = []
+        self.frames = 0
+        self._cache = dict()
+
+    def __call__(self, position):
+        key = round(position/self.resolution)
+        if key not in self._cache:
+            width, frames = self.measure(key*self.resolution)
+            # A failed width estimate never wins the search
+            width = float(width) if np.isfinite(width) else np.inf
+            self._cache[key] = width
+            self.positions.append(key*self.resolution)
+            self.widths.append(width)
+            self.frames += frames
+            logger.debug("Width %.2f at %.3f", width, key*self.resolution)
+        return self._cache[key]
+
+
+def golden_section_focus(measure, low, high, coarse=7, width_tolerance=1.0,
+                         position_tolerance=1.0, resolution=0.1,
+                         max_moves=40):
+    """
+    Find the position of the smallest beam width
+
+    The range is first sampled on a coarse grid. The bracket around the
+    narrowest grid point is then narrowed by golden-section search, which
+    assumes a single waist inside it. The search stops once the bracket is
+    smaller than ``position_tolerance``, the widths at the inner points
+    differ by less than ``width_tolerance`` from each other and from the best
+    one, or ``max_moves`` measurements were taken.
+
+    Parameters
+    ----------
+    measure : callable
+        ``measure(position)`` moves to ``position`` and returns
+        (beam width, number of frames used)
+
+    low : float
+        Lower end of the search range
+
+    high : float
+        Upper end of the search range
+
+    coarse : int, optional
+        Number of points of the initial grid, at least 3
+
+    width_tolerance : float, optional
+        Width difference, in the units of ``measure``, considered equal
+
+    position_tolerance : float, optional
+        Size of the bracket at which to stop
+
+    resolution : float, optional
+        Positions are rounded to this step, and never measured twice
+
+    max_moves : int, optional
+        Maximum number of measurements, including the coarse grid
+
+    Returns
+    -------
+    FocusSearchResult
+    """
+    if coarse < 3:
+        raise ValueError("The coarse grid needs at least 3 points")
+    measurements = _Measurements(measure, resolution)
+    grid = np.linspace(low, high, coarse)
+    widths = [measurements(pos) for pos in grid]
+    best = int(np.argmin(widths))
+    if not np.isfinite(widths[best]):
+        raise RuntimeError("No valid beam width between {} and {}"
+                           "".format(low, high))
+    a = grid[max(best - 1, 0)]
+    b = grid[min(best + 1, len(grid) - 1)]
+    c = b - inv_phi*(b - a)
+    d = a + inv_phi*(b - a)
+    while (b - a > position_tolerance
+           and len(measurements.positions) < max_moves):
+        fc, fd = measurements(c), measurements(d)
+        if (abs(fc - fd) < width_tolerance
+                and min(fc, fd) - min(measurements.widths) < width_tolerance):
+            break
+        if fc < fd:
+            b, d = d, c
+            c = b - inv_phi*(b - a)
+        else:
+            a, c = c, d
+            d = a + inv_phi*(b - a)
+    best = int(np.argmin(measurements.widths))
+    result = FocusSearchResult(measurements.positions[best],
+                               measurements.widths[best],
+                               np.array(measurements.positions),
+                               np.array(measurements.widths),
+                               len(measurements.positions),
+                               measurements.frames)
+    logger.info("Found the smallest width %.2f at %.3f after %s moves and %s "
+                "frames", result.width, result.position, result.moves,
+                result.frames)
+    return result
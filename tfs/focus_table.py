@@ -0,0 +1,176 @@
+"""
+Energy-indexed lookup table of transfocator focal lengths and image planes
+"""
+############
+# Standard #
+############
+import logging
+import os.path
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+import tfs.utils as ut
+
+logger = logging.getLogger(__name__)
+
+
+# Default photon energy grid [eV]
+default_energies = np.arange(5000., 25000. + 1, 25.)
+
+
+class FocusTable:
+    """
+    Precomputed focal lengths and images of every lens combination
+
+    The focal length of a Beryllium lens is proportional to its radius, so
+    the table stores the focal length of a 1 um radius lens at every grid
+    energy and scales it by the radius of each lens. Between grid points the
+    focal length divided by the square of the energy, which is nearly
+    constant, is interpolated linearly. The images of every subset of lenses
+    from :meth:`.ComboEngine.images` are stored for every grid energy.
+
+    The table is only valid for the radii and z positions of the lenses it
+    was built from, see :meth:`.matches`.
+
+    Parameters
+    ----------
+    engine : ComboEngine
+        Lens combinations to tabulate
+
+    energies : array-like, optional
+        Photon energy grid in eV
+
+    z_obj : float, optional
+        The source point of the beam
+    """
+    def __init__(self, engine, energies=None, z_obj=0.0):
+        self.engine = engine
+        self.energies = np.asarray(default_energies if energies is None
+                                   else energies, dtype=float)
+        if self.energies.ndim != 1 or np.any(np.diff(self.energies) <= 0):
+            raise ValueError("Energy grid must be one dimensional and "
+                             "strictly increasing")
+        self.z_obj = float(z_obj)
+        self.signature = self.lens_signature(engine)
+        # Focal length of a 1 um lens, scaled by 1/E^2 for interpolation
+        self._unit_focus = (np.asarray(ut.focal_length(1.0, self.energies))
+                            / self.energies**2)
+        self.images = np.stack([
+            engine.images(energy, z_obj=self.z_obj,
+                          focal_lengths=self._grid_focal_lengths(i))
+            for i, energy in enumerate(self.energies)])
+        logger.debug("Built focus table for %s energies between %s and %s eV",
+                     len(self.energies), self.energies[0], self.energies[-1])
+
+    @staticmethod
+    def lens_signature(engine):
+        """
+        Radii and z positions of all lenses of an engine, prefocus first
+        """
+        return np.concatenate([engine.prefocus_radius, engine.tfs_radius,
+                               engine.prefocus_z, engine.tfs_z])
+
+    def matches(self, engine):
+        """
+        Whether the table was built for the lenses of ``engine``
+        """
+        signature = self.lens_signature(engine)
+        return (signature.shape == self.signature.shape
+                and np.array_equal(signature, self.signature))
+
+    def covers(self, energy):
+        """
+        Whether ``energy`` lies within the energy grid
+        """
+        return self.energies[0] <= energy <= self.energies[-1]
+
+    @property
+    def focal_length_per_radius(self):
+        """
+        Focal length of every unique lens radius at every grid energy
+
+        Returns
+        -------
+        tuple
+            (radii, focal lengths of shape (energies, radii))
+        """
+        radii = np.unique(np.concatenate([self.engine.prefocus_radius,
+                                          self.engine.tfs_radius]))
+        unit = self._unit_focus * self.energies**2
+        return radii, np.outer(unit, radii)
+
+    def _unit_focal_length(self, energy):
+        return np.interp(energy, self.energies, self._unit_focus) * energy**2
+
+    def _grid_focal_lengths(self, index):
+        unit = self._unit_focus[index] * self.energies[index]**2
+        return (unit * self.engine.prefocus_radius,
+                unit * self.engine.tfs_radius)
+
+    def focal_lengths(self, energy):
+        """
+        Interpolated focal lengths, in the format of
+        :meth:`.ComboEngine.focal_lengths`
+        """
+        if not self.covers(energy):
+            raise ValueError("{} eV is outside of the focus table"
+                             "".format(energy))
+        unit = self._unit_focal_length(energy)
+        return (unit * self.engine.prefocus_radius,
+                unit * self.engine.tfs_radius)
+
+    def lookup(self, energy, z_obj=None):
+        """
+        Image of every combination, in the format of
+        :meth:`.ComboEngine.images`
+
+        Grid energies are read straight from the table, any other energy is
+        evaluated with interpolated focal lengths.
+        """
+        z_obj = self.z_obj if z_obj is None else float(z_obj)
+        idx = np.searchsorted(self.energies, energy)
+        if (z_obj == self.z_obj and idx < len(self.energies)
+                and self.energies[idx] == energy):
+            return self.images[idx]
+        return self.engine.images(energy, z_obj=z_obj,
+                                  focal_lengths=self.focal_lengths(energy))
+
+    def save(self, path):
+        """
+        Persist the table to a ``.npz`` file
+        """
+        np.savez_compressed(path, energies=self.energies, z_obj=self.z_obj,
+                            signature=self.signature,
+                            unit_focus=self._unit_focus, images=self.images)
+        logger.info("Saved focus table to %s", path)
+
+    @classmethod
+    def load(cls, path, engine):
+        """
+        Load a table saved by :meth:`.save`
+
+        Returns
+        -------
+        FocusTable or None
+            None if the file does not exist or was built for different lenses
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            table = cls.__new__(cls)
+            table.engine = engine
+            table.energies = data['energies']
+            table.z_obj = float(data['z_obj'])
+            table.signature = data['signature']
+            table._unit_focus = data['unit_focus']
+            table.images = data['images']
+        if not table.matches(engine):
+            logger.info("Lenses changed since %s was saved, ignoring it", path)
+            return None
+        return table
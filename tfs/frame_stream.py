@@ -0,0 +1,168 @@
+"""
+Monitor-driven camera frame stream with a ring buffer and ROI averaging
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from epics import PV, caget
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStream:
+    """
+    Stream of camera frames pushed by a channel access monitor
+
+    The array geometry and color mode are read once on construction. The
+    region of interest of each monitor update (converted to grey for color
+    cameras) is copied into the next slot of a ring buffer, in the native
+    dtype of the camera, and a background thread adds every new frame to a
+    running sum. Only the ROI is kept, so the buffer stays small even for
+    large cameras.
+
+    Parameters
+    ----------
+    camera_pv : str
+        Camera prefix, e.g. MFX:GIGE:LBL:01
+
+    roi : tuple of slice, optional
+        (y slice, x slice) to average, the full frame by default
+
+    depth : int, optional
+        Number of frames kept in the ring buffer
+
+    plugin : str, optional
+        Image plugin of the camera
+    """
+    def __init__(self, camera_pv, roi=None, depth=32, plugin='IMAGE1'):
+        self.camera_pv = camera_pv
+        self.plugin = plugin
+        self.color = caget(camera_pv + ':ColorMode_RBV') != 0
+        if self.color:
+            sizes = (plugin + ':ArraySize1_RBV', plugin + ':ArraySize2_RBV')
+        else:
+            sizes = (plugin + ':ArraySize0_RBV', plugin + ':ArraySize1_RBV')
+        size_x, size_y = (int(caget(camera_pv + ':' + pv)) for pv in sizes)
+        self.shape = (size_y, size_x)
+        self.roi = roi or (slice(None), slice(None))
+        self.depth = depth
+        # Allocated on the first frame, once its dtype is known
+        self._buffer = None
+        roi_shape = np.empty(self.shape, dtype=bool)[self.roi].shape
+        self._sum = np.zeros(roi_shape)
+        self._count = 0
+        self._written = 0
+        self._consumed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._running = True
+        self._worker = threading.Thread(target=self._accumulate, daemon=True,
+                                        name='FrameStream ' + camera_pv)
+        self._worker.start()
+        self._pv = PV(camera_pv + ':' + plugin + ':ArrayData',
+                      auto_monitor=True, form='native',
+                      callback=self._on_frame)
+
+    def _on_frame(self, value=None, **kwargs):
+        if value is None or np.size(value) == 0:
+            return
+        size = self.shape[0]*self.shape[1]
+        if self.color:
+            rgb = np.reshape(value[:size*3], self.shape + (3,))[self.roi]
+            frame = np.dot(rgb, (0.299, 0.587, 0.114)).astype(np.float32)
+        else:
+            frame = np.reshape(value[:size], self.shape)[self.roi]
+        # The slot is written under the lock, so the reader never sees a
+        # frame being overwritten
+        with self._new_frame:
+            if self._buffer is None:
+                self._buffer = np.empty((self.depth,) + frame.shape, dtype=frame.dtype)
+            self._buffer[self._written % self.depth] = frame
+            self._written += 1
+            self._new_frame.notify_all()
+
+    def _accumulate(self):
+        while True:
+            with self._new_frame:
+                while self._running and self._consumed >= self._written:
+                    self._new_frame.wait()
+                if not self._running:
+                    return
+                # Frames overwritten before they could be added are lost
+                lost = self._written - self._consumed - self.depth
+                if lost > 0:
+                    self.dropped += lost
+                    self._consumed += lost
+                self._sum += self._buffer[self._consumed % self.depth]
+                self._count += 1
+                self._consumed += 1
+                self._new_frame.notify_all()
+
+    @property
+    def frames(self):
+        """
+        Total number of frames received
+        """
+        return self._written
+
+    def latest(self):
+        """
+        Copy of the ROI of the most recent frame
+        """
+        with self._new_frame:
+            if not self._written:
+                return None
+            return self._buffer[(self._written - 1) % self.depth].copy()
+
+    def latest_roi(self):
+        return self.latest()
+
+    def reset(self):
+        """
+        Restart the ROI average from the next frame
+        """
+        with self._new_frame:
+            self._consumed = self._written
+            self._sum[...] = 0
+            self._count = 0
+
+    def average(self, duration=0.0, min_frames=1, timeout=None):
+        """
+        ROI average since the last :meth:`.reset`
+
+        Waits until at least ``duration`` seconds have passed and
+        ``min_frames`` frames were averaged.
+
+        Returns
+        -------
+        tuple
+            (average image, number of frames)
+        """
+        deadline = time.monotonic() + duration
+        limit = None if timeout is None else time.monotonic() + timeout
+        with self._new_frame:
+            while (self._count < min_frames
+                   or time.monotonic() < deadline):
+                if limit is not None and time.monotonic() > limit:
+                    raise TimeoutError("Only {} frames from {} in {} s"
+                                       "".format(self._count, self.camera_pv,
+                                                 timeout))
+                wait = max(deadline - time.monotonic(), 0.0) or 0.1
+                self._new_frame.wait(wait)
+            if not self._count:
+                return None, 0
+            return self._sum / self._count, self._count
+
+    def close(self):
+        """
+        Stop monitoring the camera
+        """
+        self._pv.clear_callbacks()
+        self._pv.disconnect()
+        with self._new_frame:
+            self._running = False
+            self._new_frame.notify_all()
+        self._worker.join()
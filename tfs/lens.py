@@ -168,7 +168,8 @@ class LensConnect:
     Parameters
     ----------
     args : Lens
-        Lens objects
+        Lens objects, or LensState from a TransfocatorSnapshot to avoid
+        reading PVs for every calculation
     """
     def __init__(self, *args):
         """
@@ -1,22 +1,55 @@
 import itertools
 import logging
+from collections import namedtuple
 # from unittest import skip
 
 import numpy as np
 
+from tfs.combo_engine import ComboEngine, pareto_front
 from tfs.lens import LensConnect
+from tfs.schedule import solve_schedule
 from tfs.utils import MFX_prefocus_energy_range
 
 logger = logging.getLogger(__name__)
 
 
+class FocusSolution(namedtuple('FocusSolution', ['combo', 'error', 'nlens',
+                                                 'transmission', 'moves'])):
+    """
+    A lens combination with the objectives of the focus planner
+
+    ``combo`` is the LensConnect, ``error`` the distance of its image to the
+    target, ``nlens`` its number of lenses, ``transmission`` its total
+    transmission and ``moves`` the number of lenses to insert or remove to
+    reach it.
+    """
+    __slots__ = ()
+
+
 class TFS_Calculator(object):
     def __init__(self, tfs_lenses, prefocus_lenses=None):
         self.tfs_lenses = tfs_lenses
         self.prefocus_lenses = prefocus_lenses
-        self.combos = self.combinations()
+        self.engine = ComboEngine(tfs_lenses, prefocus_lenses)
+        self._combos = None
         return
 
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Calculator for the lens states of a :class:`.TransfocatorSnapshot`
+        """
+        return cls(snapshot.tfs_lenses, prefocus_lenses=snapshot.prefocus_lenses)
+
+    @property
+    def combos(self):
+        """
+        LensConnect objects for every combination, built on first access
+        """
+        if self._combos is None:
+            self._combos = self.combinations()
+        return self._combos
+
     def combinations(self):
         """
         All possible combinations of the given lenses
@@ -40,13 +73,21 @@ class TFS_Calculator(object):
         return tfs_combos
 
     def _update_combos(self):
-        self.combos = self.combinations()
+        self.engine = ComboEngine(self.tfs_lenses, self.prefocus_lenses)
+        self._combos = None
 
-    def get_pre_focus_lens(self, energy):
+    @staticmethod
+    def get_pre_focus_lens_idx(energy):
+        """
+        Index of the pre-focussing lens for ``energy``, None if there is none
+        """
         for e_range, lens in MFX_prefocus_energy_range.items():
             if energy >= e_range[0] and energy < e_range[1]:
-                pre_focus_lens_idx = lens[0]
-                break
+                return lens[0]
+        return None
+
+    def get_pre_focus_lens(self, energy):
+        pre_focus_lens_idx = self.get_pre_focus_lens_idx(energy)
         if pre_focus_lens_idx is None:
             pre_focus_lens = None
             print(f"No pre-focussing lens at {energy} eV")
@@ -60,7 +101,52 @@ class TFS_Calculator(object):
     def get_combo_image(combo, z_obj=0.0):
         return combo.image(z_obj)
 
-    def find_solution(self, target, energy, n=4, z_obj=0.0):
+    def find_solutions(self, target, energy, n=4, z_obj=0.0, k=1,
+                       table=None):
+        """
+        Find the ``k`` combinations closest to a specific focus
+
+        All TFS combinations are evaluated at once by the
+        :class:`.ComboEngine`, only the returned solutions are turned into
+        LensConnect objects.
+
+        Parameters
+        ----------
+        target: float
+            The desired position of the focal plane in accelerator coordinates
+
+        energy: float
+            Photon energy in eV
+
+        n : int, optional
+            The maximum number of TFS lenses in a valid combination
+
+        z_obj : float, optional
+            The source point of the beam
+
+        k : int, optional
+            Number of solutions to return
+
+        table : FocusTable, optional
+            Precomputed images used instead of calculating focal lengths,
+            if it covers ``energy``
+
+        Returns
+        -------
+        solutions: list
+            List of (LensConnect, difference to target) sorted by difference
+        """
+        pre_focus_lens = self.get_pre_focus_lens(energy)
+        prefocus = self.engine.prefocus_index(pre_focus_lens)
+        images = None
+        if table is not None and table.covers(energy):
+            images = table.lookup(energy, z_obj=z_obj)
+        best = self.engine.best(target, energy, prefocus=prefocus, n=n, k=k,
+                                z_obj=z_obj, images=images)
+        return [(LensConnect(*self.engine.lenses(index, prefocus)), diff)
+                for index, diff, image in best]
+
+    def find_solution(self, target, energy, n=4, z_obj=0.0, table=None):
         """
         Find a combination to reach a specific focus
 
@@ -77,6 +163,9 @@ class TFS_Calculator(object):
         z_obj : float, optional
             The source point of the beam
 
+        table : FocusTable, optional
+            Precomputed images, see :meth:`.find_solutions`
+
         Returns
         -------
         array: LensConnect
@@ -85,32 +174,131 @@ class TFS_Calculator(object):
 
         Steps:
         1) find the right pre-focussing lens. These are pre-defined based on
-        the photon energy (see prefocus_energy_range) and add it to the combos.
+        the photon energy (see prefocus_energy_range).
         2) Calculate the focus and the difference to the target for each TFS
-        lens combination.
+        lens combination, with the pre-focussing lens in front.
         3) Pick the combo with the smallest difference
         """
+        solutions = self.find_solutions(target, energy, n=n, z_obj=z_obj,
+                                        table=table)
+        if not solutions:
+            return None, np.nan
+        return solutions[0]
 
-        # Step 1
-        pre_focus_lens = self.get_pre_focus_lens(energy)
-        if pre_focus_lens is None:
-            combos = self.combos
+    def pareto_solutions(self, target, energy, n=None, max_error=None,
+                         z_obj=0.0, table=None):
+        """
+        Find the combinations that are the best trade-off between focus
+        error, number of lenses, transmission loss and lens motion
+
+        A combination is returned unless another one is at least as good in
+        all four and better in one of them. The number of moves is counted
+        from the ``inserted`` state of the calculator lenses, so they should
+        be current, e.g. from a :class:`.TransfocatorSnapshot`.
+
+        Parameters
+        ----------
+        target: float
+            The desired position of the focal plane in accelerator coordinates
+
+        energy: float
+            Photon energy in eV
+
+        n : int, optional
+            The maximum number of TFS lenses in a valid combination
+
+        max_error : float, optional
+            Ignore combinations further than this from the target
+
+        z_obj : float, optional
+            The source point of the beam
+
+        table : FocusTable, optional
+            Precomputed images, see :meth:`.find_solutions`
+
+        Returns
+        -------
+        solutions: list
+            List of FocusSolution sorted by focus error
+        """
+        engine = self.engine
+        prefocus = engine.prefocus_index(self.get_pre_focus_lens(energy))
+        if table is not None and table.covers(energy):
+            images = table.lookup(energy, z_obj=z_obj)
         else:
-            pre_focus_lens = self.get_pre_focus_lens(energy)
-            combos = []
-            for combo in self.combos:
-                c = LensConnect(pre_focus_lens)
-                lens_combo = LensConnect.connect(c, combo)
-                combos.append(lens_combo)
-
-        # Step 2
-        diff = []
-        for ii, combo in enumerate(self.combos):
-            if combo.nlens > n:
-                continue
-            image = combo.image(z_obj, energy)
-            diff.append(np.abs(image - target))
-
-        # Step 3
-        solution = combos[np.argmin(diff)]
-        return solution, np.min(diff)
+            images = engine.images(energy, z_obj=z_obj)
+        error = np.abs(images[prefocus] - target)
+        transmission = engine.transmissions(energy)[prefocus]
+        moves = engine.moves([lens.inserted for lens in engine.tfs_lenses],
+                             [lens.inserted for lens in engine.prefocus_lenses]
+                             )[prefocus]
+        nlens = engine.nlens + (1 if prefocus else 0)
+        valid = (engine.nlens > 0) & np.isfinite(error)
+        if n is not None:
+            valid &= engine.nlens <= n
+        if max_error is not None:
+            valid &= error <= max_error
+        candidates = np.flatnonzero(valid)
+        objectives = np.stack([error[candidates], nlens[candidates],
+                               1 - transmission[candidates],
+                               moves[candidates]], axis=1)
+        front = candidates[pareto_front(objectives)]
+        front = front[np.argsort(error[front], kind='stable')]
+        logger.debug("%s of %s combinations on the Pareto front",
+                     len(front), len(candidates))
+        return [FocusSolution(LensConnect(*engine.lenses(index, prefocus)),
+                              float(error[index]), int(nlens[index]),
+                              float(transmission[index]), int(moves[index]))
+                for index in front]
+
+    def focus_schedule(self, energies, target, n=4, z_obj=0.0, tolerance=1e-3,
+                       k=8):
+        """
+        Plan the lens combinations of an energy scan
+
+        All energies are solved in one vectorized pass. Among combinations
+        within ``tolerance`` of the best focus at each energy, the sequence
+        with the fewest lens insertions and removals over the scan is chosen,
+        starting from the ``inserted`` state of the calculator lenses.
+
+        Parameters
+        ----------
+        energies: array-like
+            Photon energies in eV, in scan order
+
+        target: float
+            The desired position of the focal plane in accelerator coordinates
+
+        n : int, optional
+            The maximum number of TFS lenses in a valid combination
+
+        z_obj : float, optional
+            The source point of the beam
+
+        tolerance : float, optional
+            Allowed focus error beyond the best combination [m]
+
+        k : int, optional
+            Maximum number of combinations considered per energy
+
+        Returns
+        -------
+        FocusSchedule
+        """
+        engine = self.engine
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        prefocus = []
+        for energy in energies:
+            idx = self.get_pre_focus_lens_idx(energy)
+            prefocus.append(0 if idx is None else idx + 1)
+        inserted = np.array([bool(lens.inserted)
+                             for lens in engine.tfs_lenses])
+        start_subset = int(np.sum(inserted << np.arange(len(inserted))))
+        start_prefocus = 0
+        for i, lens in enumerate(engine.prefocus_lenses):
+            if lens.inserted:
+                start_prefocus = i + 1
+                break
+        return solve_schedule(engine, energies, prefocus, target, n=n,
+                              z_obj=z_obj, tolerance=tolerance, k=k,
+                              start=(start_subset, start_prefocus))
@@ -0,0 +1,282 @@
+"""
+Lens configurations for a whole energy scan
+"""
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+import prettytable
+
+##########
+# Module #
+##########
+from tfs.lens import LensConnect
+
+logger = logging.getLogger(__name__)
+
+
+def _prefocus_moves(a, b):
+    """
+    Number of XRT lenses to move between two prefocus choices
+    """
+    return (a != b) * ((a > 0).astype(int) + (b > 0).astype(int))
+
+
+def solve_schedule(engine, energies, prefocus, target, n=4, z_obj=0.0,
+                   tolerance=1e-3, k=8, start=None):
+    """
+    Choose a lens combination for every energy, minimizing lens changes
+
+    For every energy the ``k`` combinations closest to ``target`` are
+    candidates, as long as they are within ``tolerance`` of the best one.
+    The sequence of candidates with the fewest lens moves over the whole
+    scan is then found by dynamic programming, ties going to the smallest
+    summed focus error.
+
+    Parameters
+    ----------
+    engine : ComboEngine
+
+    energies : array-like
+        Photon energies in eV, in scan order
+
+    prefocus : array-like
+        Row of :meth:`.ComboEngine.images` to use at every energy
+
+    target : float
+        The desired position of the focal plane
+
+    n : int, optional
+        Maximum number of TFS lenses in a combination
+
+    z_obj : float, optional
+        The source point of the beam
+
+    tolerance : float, optional
+        Allowed focus error beyond the best combination [m]
+
+    k : int, optional
+        Maximum number of candidates per energy
+
+    start : tuple, optional
+        (TFS subset index, prefocus row) currently inserted, counted as the
+        state before the first energy
+
+    Returns
+    -------
+    FocusSchedule
+    """
+    energies = np.atleast_1d(np.asarray(energies, dtype=float))
+    prefocus = np.broadcast_to(np.asarray(prefocus, dtype=int),
+                               energies.shape)
+    images = engine.images_many(energies, z_obj=z_obj)
+    image = images[np.arange(len(energies)), prefocus]
+    error = np.abs(image - target)
+    valid = engine.nlens > 0
+    if n is not None:
+        valid = valid & (engine.nlens <= n)
+    error = np.where(valid & np.isfinite(error), error, np.inf)
+    # Candidates per energy
+    k = min(k, error.shape[1])
+    cand = np.argpartition(error, k - 1, axis=1)[:, :k]
+    cand_err = np.take_along_axis(error, cand, axis=1)
+    best = cand_err.min(axis=1, keepdims=True)
+    if not np.all(np.isfinite(best)):
+        raise ValueError("No valid lens combination for energies {}"
+                         "".format(energies[~np.isfinite(best[:, 0])]))
+    allowed = cand_err <= best + tolerance
+    # Lexicographic cost: lens moves first, then summed error
+    weight = 1.0 + np.sum(np.where(allowed, cand_err, 0))
+    cost = np.where(allowed, cand_err, np.inf)
+    if start is not None:
+        moves = (np.count_nonzero(engine.masks[cand[0]]
+                                  != engine.masks[start[0]], axis=1)
+                 + _prefocus_moves(prefocus[0], np.asarray(start[1])))
+        cost[0] = cost[0] + np.where(allowed[0], moves * weight, 0)
+    total = cost[0]
+    back = np.zeros(cand.shape, dtype=int)
+    for i in range(1, len(energies)):
+        moves = np.count_nonzero(engine.masks[cand[i - 1]][:, np.newaxis, :]
+                                 != engine.masks[cand[i]][np.newaxis, :, :],
+                                 axis=2)
+        moves += _prefocus_moves(prefocus[i - 1], prefocus[i])
+        step = total[:, np.newaxis] + moves * weight
+        back[i] = np.argmin(step, axis=0)
+        total = step[back[i], np.arange(k)] + cost[i]
+    # Walk back the cheapest path
+    choice = np.empty(len(energies), dtype=int)
+    choice[-1] = np.argmin(total)
+    for i in range(len(energies) - 1, 0, -1):
+        choice[i - 1] = back[i, choice[i]]
+    rows = np.arange(len(energies))
+    subsets = cand[rows, choice]
+    return FocusSchedule(engine, energies, target, subsets, prefocus,
+                         error[rows, subsets], image[rows, subsets])
+
+
+class FocusSchedule:
+    """
+    Lens combination for every energy of a scan
+
+    Parameters
+    ----------
+    engine : ComboEngine
+        Engine the combinations refer to
+
+    energies : np.ndarray
+        Photon energies in eV
+
+    target : float
+        The desired position of the focal plane
+
+    subsets : np.ndarray
+        TFS subset index for every energy
+
+    prefocus : np.ndarray
+        Prefocus row for every energy
+
+    errors : np.ndarray
+        Distance of the image to the target for every energy
+
+    images : np.ndarray
+        Image position for every energy
+    """
+    def __init__(self, engine, energies, target, subsets, prefocus, errors,
+                 images):
+        self.engine = engine
+        self.energies = energies
+        self.target = target
+        self.subsets = subsets
+        self.prefocus = prefocus
+        self.errors = errors
+        self.images = images
+
+    def __len__(self):
+        return len(self.energies)
+
+    def lenses(self, index):
+        """
+        Lenses to insert at the energy with the given index
+        """
+        return self.engine.lenses(self.subsets[index], self.prefocus[index])
+
+    def combo(self, index):
+        """
+        LensConnect for the energy with the given index
+        """
+        return LensConnect(*self.lenses(index))
+
+    @property
+    def segments(self):
+        """
+        Runs of consecutive energies sharing the same lenses
+
+        Returns
+        -------
+        list
+            List of (first index, last index) pairs
+        """
+        change = np.flatnonzero((np.diff(self.subsets) != 0)
+                                | (np.diff(self.prefocus) != 0)) + 1
+        starts = np.concatenate([[0], change])
+        stops = np.concatenate([change - 1, [len(self) - 1]])
+        return [(int(a), int(b)) for a, b in zip(starts, stops)]
+
+    @property
+    def moves(self):
+        """
+        Number of lenses that change before each energy, the first entry is
+        always 0
+        """
+        masks = self.engine.masks[self.subsets]
+        tfs = np.count_nonzero(masks[1:] != masks[:-1], axis=1)
+        xrt = _prefocus_moves(self.prefocus[:-1], self.prefocus[1:])
+        return np.concatenate([[0], tfs + xrt])
+
+    def index(self, energy):
+        """
+        Index of the scheduled energy closest to ``energy``
+        """
+        return int(np.argmin(np.abs(self.energies - energy)))
+
+    def show(self):
+        """
+        Print one row per segment of the schedule
+        """
+        pt = prettytable.PrettyTable(['Energies [eV]', 'Lenses',
+                                      'Max error [mm]', 'Moves'])
+        pt.align = 'l'
+        moves = self.moves
+        for first, last in self.segments:
+            pt.add_row(['{:.1f} - {:.1f}'.format(self.energies[first],
+                                                 self.energies[last]),
+                        ' '.join(lens.prefix for lens in self.lenses(first)),
+                        round(np.max(self.errors[first:last+1])*1000, 2),
+                        moves[first]])
+        print(pt)
+
+    def per_step(self, transfocator, energy_motor=None, group='tfs_schedule'):
+        """
+        Bluesky ``per_step`` hook moving the lenses before every point
+
+        Only lenses whose state differs from the previous point are moved,
+        the first point sets all of them.
+
+        Parameters
+        ----------
+        transfocator : MFXTransfocator
+            Transfocator with the lenses of this schedule
+
+        energy_motor : Positioner, optional
+            Motor of the step holding the energy, the first motor if not
+            given
+
+        Returns
+        -------
+        callable
+            ``per_step(detectors, step, pos_cache)`` plan
+        """
+        devices = {lens.prefix: lens for lens in transfocator.lenses}
+        previous = None
+
+        def per_step(detectors, step, pos_cache):
+            from bluesky.plan_stubs import abs_set, one_nd_step, wait
+            nonlocal previous
+            if energy_motor is None:
+                energy = next(iter(step.values()))
+            else:
+                energy = step[energy_motor]
+            index = self.index(energy)
+            wanted = {lens.prefix for lens in self.lenses(index)}
+            moved = False
+            for lens in transfocator.tfs_lenses:
+                state = lens.prefix in wanted
+                if previous is None or state != (lens.prefix in previous):
+                    yield from abs_set(devices[lens.prefix],
+                                       'IN' if state else 'OUT', group=group)
+                    moved = True
+            xrt = [lens for lens in transfocator.xrt_lenses
+                   if lens.prefix in wanted]
+            old_xrt = [] if previous is None else [
+                lens for lens in transfocator.xrt_lenses
+                if lens.prefix in previous]
+            if previous is None or xrt != old_xrt:
+                # Only tell one XRT lens to move, as focus_at does
+                if xrt:
+                    yield from abs_set(xrt[0], 'IN', group=group)
+                else:
+                    yield from abs_set(old_xrt[0] if old_xrt
+                                       else transfocator.xrt_lenses[0],
+                                       'OUT', group=group)
+                moved = True
+            if moved:
+                yield from wait(group)
+            previous = wanted
+            yield from one_nd_step(detectors, step, pos_cache)
+
+        return per_step
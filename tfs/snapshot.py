@@ -0,0 +1,137 @@
+"""
+Immutable snapshot of the optical state of all transfocator lenses
+"""
+############
+# Standard #
+############
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+##########
+# Module #
+##########
+from tfs.lens import LensCalcMixin
+
+logger = logging.getLogger(__name__)
+
+
+class LensState(LensCalcMixin,
+                namedtuple('LensState',
+                           ['prefix', 'radius', 'z', 'inserted', 'device'])):
+    """
+    Radius, z position and insertion state of a lens at a point in time
+
+    Has the same ``prefix``, ``radius``, ``z`` and ``inserted`` attributes as
+    :class:`.MFXLens`, as plain values, so it can be used wherever lens
+    calculations are done without reading any PV. ``device`` is the lens the
+    state was read from.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return ('LensState(prefix={!r}, radius={!r}, z={!r}, inserted={!r})'
+                ''.format(self.prefix, self.radius, self.z, self.inserted))
+
+    @classmethod
+    def read(cls, lens):
+        """
+        Read the state of a lens
+        """
+        return cls(lens.prefix, float(lens.radius), float(lens.z),
+                   bool(lens.inserted), lens)
+
+
+class TransfocatorSnapshot:
+    """
+    State of the TFS and pre-focus lenses, read in one batch
+
+    Parameters
+    ----------
+    tfs_lenses : tuple of LensState
+
+    prefocus_lenses : tuple of LensState
+
+    timestamp : float, optional
+        Time of the reading, now by default
+    """
+    # Maximum number of lenses read at the same time
+    max_workers = 16
+
+    def __init__(self, tfs_lenses, prefocus_lenses, timestamp=None):
+        self._tfs_lenses = tuple(tfs_lenses)
+        self._prefocus_lenses = tuple(prefocus_lenses)
+        self._timestamp = time.time() if timestamp is None else timestamp
+
+    @classmethod
+    def read(cls, tfs_lenses, prefocus_lenses):
+        """
+        Read radius, z and insertion state of all lenses in parallel
+
+        Parameters
+        ----------
+        tfs_lenses : list of MFXLens
+
+        prefocus_lenses : list of MFXLens
+
+        Returns
+        -------
+        TransfocatorSnapshot
+        """
+        lenses = list(tfs_lenses) + list(prefocus_lenses)
+        timestamp = time.time()
+        with ThreadPoolExecutor(max_workers=min(cls.max_workers,
+                                                max(len(lenses), 1))) as pool:
+            states = list(pool.map(LensState.read, lenses))
+        logger.debug("Read the state of %s lenses in %.3f s",
+                     len(states), time.time() - timestamp)
+        ntfs = len(tfs_lenses)
+        return cls(states[:ntfs], states[ntfs:], timestamp=timestamp)
+
+    def refresh(self):
+        """
+        A new snapshot of the same lenses
+        """
+        return self.read([lens.device for lens in self._tfs_lenses],
+                         [lens.device for lens in self._prefocus_lenses])
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def age(self):
+        """
+        Seconds since the snapshot was read
+        """
+        return time.time() - self._timestamp
+
+    def is_stale(self, max_age):
+        """
+        Whether the snapshot is older than ``max_age`` seconds. A ``max_age``
+        of None never expires
+        """
+        return max_age is not None and self.age > max_age
+
+    @property
+    def tfs_lenses(self):
+        return self._tfs_lenses
+
+    @property
+    def prefocus_lenses(self):
+        return self._prefocus_lenses
+
+    @property
+    def lenses(self):
+        """
+        Pre-focus and TFS lens states
+        """
+        return self._prefocus_lenses + self._tfs_lenses
+
+    @property
+    def inserted(self):
+        """
+        States of the inserted lenses
+        """
+        return tuple(lens for lens in self.lenses if lens.inserted)
@@ -0,0 +1,52 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from tfs.benchmark import SimLens
+from tfs.combo_engine import ComboEngine
+from tfs.schedule import _prefocus_moves, solve_schedule
+
+
+def brute_force(engine, energies, prefocus, target, tolerance, start):
+    """
+    (lens moves, summed error) of the best path over all allowed subsets
+    """
+    error = np.abs(engine.images_many(energies)[np.arange(len(energies)), prefocus] - target)
+    error = np.where(engine.nlens > 0, error, np.inf)
+    allowed = [np.nonzero(row <= row.min() + tolerance)[0] for row in error]
+    best = None
+    for path in itertools.product(*allowed):
+        moves = np.count_nonzero(engine.masks[path[0]] != engine.masks[start[0]])
+        moves += _prefocus_moves(prefocus[0], np.asarray(start[1]))
+        for i in range(1, len(path)):
+            moves += np.count_nonzero(engine.masks[path[i - 1]] != engine.masks[path[i]])
+            moves += _prefocus_moves(prefocus[i - 1], prefocus[i])
+        cost = (int(moves), round(float(sum(error[i, j] for i, j in enumerate(path))), 12))
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_solve_schedule_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    tfs = [SimLens('SIM:TFS:{:02}'.format(i), radius, 397.0 + 0.1*i)
+           for i, radius in enumerate(rng.choice([50., 100., 200., 500.], size=4))]
+    xrt = [SimLens('SIM:DIA:01', 750., 300.0)]
+    engine = ComboEngine(tfs, prefocus_lenses=xrt)
+    energies = rng.uniform(8000., 12000., 4)
+    prefocus = rng.integers(0, 2, 4)
+    start = (int(rng.integers(0, len(engine.masks))), int(rng.integers(0, 2)))
+    target = float(rng.uniform(398., 402.))
+    tolerance = float(rng.uniform(0.05, 1.0))
+    schedule = solve_schedule(engine, energies, prefocus, target, n=None,
+                              tolerance=tolerance, k=len(engine.masks), start=start)
+    subsets = schedule.subsets
+    moves = np.count_nonzero(engine.masks[subsets[0]] != engine.masks[start[0]])
+    moves += _prefocus_moves(prefocus[0], np.asarray(start[1]))
+    for i in range(1, len(subsets)):
+        moves += np.count_nonzero(engine.masks[subsets[i - 1]] != engine.masks[subsets[i]])
+        moves += _prefocus_moves(prefocus[i - 1], prefocus[i])
+    expected = brute_force(engine, energies, prefocus, target, tolerance, start)
+    assert int(moves) == expected[0]
+    assert float(np.sum(schedule.errors)) == pytest.approx(expected[1], abs=1e-9)
@@ -1,14 +1,17 @@
 import math
 import logging
 
+import prettytable
 from pcdsdevices.device_types import IMS
 from ophyd import (Device, EpicsSignalRO, Component as Cpt,
     FormattedComponent, EpicsSignal)
 from ophyd.status import wait as status_wait
 
+from tfs.focus_table import FocusTable
 from tfs.lens import LensConnect, LensTripLimits
 from tfs.lens import MFXLens as Lens
 from tfs.offline_calculator import TFS_Calculator
+from tfs.snapshot import TransfocatorSnapshot
 from functools import wraps
 from tfs.utils import estimate_beam_fwhm, focal_length
 
@@ -127,8 +130,13 @@ class MFXTransfocator(TransfocatorBase):
     # Translation
     translation = FormattedComponent(IMS, "MFX:TFS:MMS:21")
 
-    def __init__(self, prefix, *, nominal_sample=399.88103, **kwargs):
+    def __init__(self, prefix, *, nominal_sample=399.88103,
+                 focus_table_path=None, snapshot_max_age=1.0, **kwargs):
         self.nominal_sample = nominal_sample
+        self.focus_table_path = focus_table_path
+        self.snapshot_max_age = snapshot_max_age
+        self._focus_table = None
+        self._snapshot = None
         super().__init__(prefix, **kwargs)
 
     @property
@@ -153,6 +161,30 @@ class MFXTransfocator(TransfocatorBase):
         """
         return [lens for lens in self.lenses if 'TFS' in lens.prefix]
 
+    def snapshot(self, refresh=False):
+        """
+        Radius, z and insertion state of all lenses
+
+        The lenses are read in one parallel batch. The snapshot is reused
+        until it is older than ``snapshot_max_age`` seconds (never expires
+        if None), until lenses are moved with :meth:`.focus_at` or
+        :meth:`.remove_all`, or until ``refresh`` is requested.
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            Read the lenses even if the last snapshot is still valid
+
+        Returns
+        -------
+        TransfocatorSnapshot
+        """
+        if (refresh or self._snapshot is None
+                or self._snapshot.is_stale(self.snapshot_max_age)):
+            self._snapshot = TransfocatorSnapshot.read(self.tfs_lenses,
+                                                       self.xrt_lenses)
+        return self._snapshot
+
     @property
     def current_focus(self):
         """
@@ -163,17 +195,20 @@ class MFXTransfocator(TransfocatorBase):
         If no lenses are inserted this will retun NaN
         """
         # Find inserted lenses
-        inserted = [lens for lens in self.lenses if lens.inserted]
+        inserted = self.snapshot().inserted
         # Check that we have any inserted lenses at all
         if not inserted:
             logger.warning("No lenses are currently inserted")
             return math.nan
         # Calculate the image from this set of lenses
-        return LensConnect(*inserted).image(0.0) - self.nominal_sample
+        energy = self.beam_energy.get()
+        return LensConnect(*inserted).image(0.0, energy) - self.nominal_sample
+
     def remove_all(self):
         """
         Removes all tfs lenses.
         """
+        self._snapshot = None
         self.tfs_02.remove()
         self.tfs_03.remove()
         self.tfs_04.remove()
@@ -184,6 +219,40 @@ class MFXTransfocator(TransfocatorBase):
         self.tfs_09.remove()
         self.tfs_10.remove()
 
+    def focus_table(self, engine):
+        """
+        Energy lookup table for the current lenses
+
+        The table is loaded from ``focus_table_path`` if possible, otherwise
+        built and saved there. It is rebuilt whenever the radius or z
+        position of any lens differs from the ones it was built with.
+
+        Parameters
+        ----------
+        engine : ComboEngine
+            Engine holding the current lens radii and z positions
+
+        Returns
+        -------
+        FocusTable
+        """
+        if self._focus_table is not None and self._focus_table.matches(engine):
+            return self._focus_table
+        table = None
+        if self.focus_table_path:
+            table = FocusTable.load(self.focus_table_path, engine)
+        if table is None:
+            logger.info("Building focus lookup table")
+            table = FocusTable(engine)
+            if self.focus_table_path:
+                try:
+                    table.save(self.focus_table_path)
+                except OSError:
+                    logger.exception("Unable to save focus table to %s",
+                                     self.focus_table_path)
+        self._focus_table = table
+        return table
+
     def find_best_combo(self, target=None, energy=None, show=True, **kwargs):
         """
         Calculate the best lens array to hit the nominal sample point
@@ -202,7 +271,8 @@ class MFXTransfocator(TransfocatorBase):
         """
         energy = energy or self.beam_energy.get()
         target = target or self.nominal_sample
-        calc = TFS_Calculator(tfs_lenses=self.tfs_lenses, prefocus_lenses=self.xrt_lenses)
+        calc = TFS_Calculator.from_snapshot(self.snapshot())
+        kwargs.setdefault('table', self.focus_table(calc.engine))
         combo, diff = calc.find_solution(target, energy, **kwargs)
         if combo:
             combo.show_info()
@@ -218,6 +288,94 @@ class MFXTransfocator(TransfocatorBase):
             logger.error("Unable to find a valid solution for target")
         return combo
 
+    def plan_focus(self, target=None, energy=None, max_error=None, show=True,
+                   **kwargs):
+        """
+        Trade-offs between focus error, lens count, transmission and motion
+
+        Returns every lens combination for which no other combination is
+        better in focus error, number of lenses, transmission and number of
+        lenses to move from the current state all at once. Pick one and pass
+        it to :meth:`.focus_at` as ``combo``.
+
+        Parameters
+        ----------
+        target : float, optional
+            The target image of the lens array. By default this is
+            `nominal_sample`
+
+        energy : float, optional
+            Photon energy in eV, the current beam energy by default
+
+        max_error : float, optional
+            Ignore combinations further than this from the target [m]
+
+        show : bool, optional
+            Print a table of the solutions
+
+        kwargs:
+            Passed to :meth:`.TFS_Calculator.pareto_solutions`
+
+        Returns
+        -------
+        solutions : list
+            List of FocusSolution sorted by focus error
+        """
+        energy = energy or self.beam_energy.get()
+        target = target or self.nominal_sample
+        calc = TFS_Calculator.from_snapshot(self.snapshot())
+        kwargs.setdefault('table', self.focus_table(calc.engine))
+        solutions = calc.pareto_solutions(target, energy, max_error=max_error,
+                                          **kwargs)
+        if show:
+            pt = prettytable.PrettyTable(['#', 'Lenses', 'Error [mm]',
+                                          'N lenses', 'Transmission', 'Moves'])
+            pt.align = 'l'
+            for i, sol in enumerate(solutions):
+                pt.add_row([i, ' '.join(lens.prefix for lens in sol.combo.lenses),
+                            round(sol.error*1000, 2), sol.nlens,
+                            round(sol.transmission, 3), sol.moves])
+            print(pt)
+        return solutions
+
+    def plan_focus_schedule(self, energies, target=None, show=True, **kwargs):
+        """
+        Lens combinations for every energy of a scan
+
+        All energies are solved at once and lens changes over the scan are
+        minimized, see :meth:`.TFS_Calculator.focus_schedule`. The result
+        can drive the lenses during a bluesky scan::
+
+            schedule = tfs.plan_focus_schedule(energies)
+            RE(scan([det], energy, energies[0], energies[-1], len(energies),
+                    per_step=schedule.per_step(tfs, energy)))
+
+        Parameters
+        ----------
+        energies : array-like
+            Photon energies in eV, in scan order
+
+        target : float, optional
+            The target image of the lens array. By default this is
+            `nominal_sample`
+
+        show : bool, optional
+            Print the schedule, one row per run of identical lenses
+
+        kwargs:
+            Passed to :meth:`.TFS_Calculator.focus_schedule`
+
+        Returns
+        -------
+        FocusSchedule
+        """
+        target = target or self.nominal_sample
+        calc = TFS_Calculator.from_snapshot(self.snapshot())
+        schedule = calc.focus_schedule(energies, target, **kwargs)
+        if show:
+            schedule.show()
+        return schedule
+
     def set(self, value, **kwargs):
         """
         Set the Transfocator focus
@@ -226,7 +384,8 @@ class MFXTransfocator(TransfocatorBase):
         """
         return self.focus_at(value=value, **kwargs)
 
-    def focus_at(self, value=None, wait=False, timeout=None, **kwargs):
+    def focus_at(self, value=None, wait=False, timeout=None, combo=None,
+                 **kwargs):
         """
         Calculate a combination and insert the lenses
 
@@ -241,6 +400,10 @@ class MFXTransfocator(TransfocatorBase):
         timeout: float, optional
             Timeout for motion
 
+        combo: LensConnect or FocusSolution, optional
+            Insert this combination instead of calculating one, e.g. a
+            solution from :meth:`.plan_focus`
+
         kwargs:
             All passed to :meth:`.find_best_combo`
 
@@ -250,14 +413,20 @@ class MFXTransfocator(TransfocatorBase):
             Status that represents whether the move is complete
         """
         # Find the best combination of lenses to match the target image
-        plane = value or self.nominal_sample
-        best_combo = self.find_best_combo(target=plane, **kwargs)
+        if combo is None:
+            plane = value or self.nominal_sample
+            best_combo = self.find_best_combo(target=plane, **kwargs)
+        else:
+            best_combo = getattr(combo, 'combo', combo)
+        chosen = [lens.prefix for lens in best_combo.lenses]
+        # The insertion states are about to change
+        self._snapshot = None
         # Collect status to combine
         statuses = list()
         # Only tell one XRT lens to insert
         prefocused = False
         for lens in self.xrt_lenses:
-            if lens in best_combo.lenses:
+            if lens.prefix in chosen:
                 statuses.append(lens.insert(timeout=timeout))
                 prefocused = True
                 break
@@ -266,7 +435,7 @@ class MFXTransfocator(TransfocatorBase):
             statuses.append(self.xrt_lenses[0].remove(timeout=timeout))
         # Ensure all Transfocator lenses are correct
         for lens in self.tfs_lenses:
-            if lens in best_combo.lenses:
+            if lens.prefix in chosen:
                 statuses.append(lens.insert(timeout=timeout))
             else:
                 statuses.append(lens.remove(timeout=timeout))
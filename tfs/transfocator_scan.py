@@ -2,8 +2,10 @@ from epics import caget, caput, camonitor, camonitor_clear
 import numpy as np
 import matplotlib.pyplot as plt
 import time
-from scipy.optimize import curve_fit
 from IPython import display
+from tfs.focus_search import golden_section_focus
+from tfs.frame_stream import FrameStream
+from tfs.width_estimators import fwhm_per_sigma, gauss_newton, image_widths
 #mfx dg1 yag is MFX:DG1:P6740
 #mfx dg2 yag is MFX:DG2:P6740
 #mfx dg3 yag is MFX:GIGE:02:IMAGE1
@@ -14,6 +16,7 @@ from IPython import display
 class gigE_camera_accessor:
     def __init__(self,camera_pv):
         self.camera_pv=camera_pv
+        self.stream=None
         self.get_markers()
         self.check_color_mode()
         pass
@@ -70,6 +73,22 @@ class gigE_camera_accessor:
         self.marker4X = caget(self.camera_pv + ':Cross4X')
         self.marker4Y = caget(self.camera_pv + ':Cross4Y')
         return self.marker1X, self.marker1Y, self.marker2X, self.marker2Y
+    def roi(self):
+        y_slice = slice(min(self.marker1Y, self.marker2Y), max(self.marker1Y, self.marker2Y))
+        x_slice = slice(min(self.marker1X, self.marker2X), max(self.marker1X, self.marker2X))
+        return y_slice, x_slice
+    def get_stream(self):
+        """
+        Monitor-driven stream of the marker ROI, created on first use
+        """
+        if self.stream is None or self.stream.roi != self.roi():
+            self.close_stream()
+            self.stream = FrameStream(self.camera_pv, roi=self.roi())
+        return self.stream
+    def close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
     def get_projections(self):
         self.x_projection = np.sum(self.active_image, axis=0)
         self.y_projection = np.sum(self.active_image, axis=1)
@@ -77,7 +96,11 @@ class gigE_camera_accessor:
         self.y_projection -= self.y_projection.min()
         return self.x_projection, self.y_projection
 class transfocator_aligner(gigE_camera_accessor):
-    def scan_transfocator(self, transfocator_motor,positions, image_sec):
+    def scan_transfocator(self, transfocator_motor,positions, image_sec, width_method='gauss'):
+        """
+        width_method is a name in tfs.width_estimators.estimators ('gauss',
+        'fwhm' or 'moment'), the widths plotted are FWHM in pixels
+        """
         wid_x=[]
         wid_y=[]
         fig, ax=plt.subplots(2,1,sharex=True)
@@ -88,43 +111,31 @@ class transfocator_aligner(gigE_camera_accessor):
         ax[1].set_ylabel('FWHM_y')
         ax[1].set_xlabel('Transfocator Z-position')
         plt.ion()
-        for idx,pos in enumerate(positions):
-            transfocator_motor.umv(pos)
-            #transfocator_motor.mv(pos, wait = True)
-            timeout = time.time()+image_sec
-            img_count=0
-            collect=True
-            while collect==True:
-                img=self.get_image_roi()
-                #if np.sum(img-np.min(img))<np.shape(img)[0]*np.shape(img)[1]:
-                #    print('bad shot!')
-                #    continue
-                #print('shot okay!')
-                if img_count==0:
-                    images=img
-                    img_count+=1
-                else:
-                    images+=img
-                    img_count+=1
-                if time.time()>timeout and img_count>=10:
-                    collect=False
-            images=images/img_count
-            self.active_image=images-np.min(images)
-            x,y=self.get_projections()
-            opt_x=self.fit_scan(np.arange(0,len(x),1),x)
-            opt_y=self.fit_scan(np.arange(0,len(y),1),y)
-            wid_x.append(np.abs(opt_x[2]))
-            wid_y.append(np.abs(opt_y[2]))
-            if idx%5==0:
-                line1.set_data(positions[:idx+1], wid_x)
-                line2.set_data(positions[:idx+1], wid_y)
-                ax[0].relim()  # Recalculate the data limits
-                ax[1].relim()
-                ax[0].autoscale_view()  
-                ax[1].autoscale_view()
-                fig.canvas.draw()  
-                fig.canvas.flush_events()  
-                plt.pause(0.1)  
+        stream=self.get_stream()
+        try:
+            for idx,pos in enumerate(positions):
+                transfocator_motor.umv(pos)
+                #transfocator_motor.mv(pos, wait = True)
+                # Average the frames streamed in the background while we wait
+                stream.reset()
+                images,img_count=stream.average(duration=image_sec,min_frames=10)
+                self.active_image=images-np.min(images)
+                width_x,width_y=image_widths(self.active_image,method=width_method)
+                wid_x.append(width_x.fwhm)
+                wid_y.append(width_y.fwhm)
+                if idx%5==0:
+                    line1.set_data(positions[:idx+1], wid_x)
+                    line2.set_data(positions[:idx+1], wid_y)
+                    ax[0].relim()  # Recalculate the data limits
+                    ax[1].relim()
+                    ax[0].autoscale_view()  
+                    ax[1].autoscale_view()
+                    fig.canvas.draw()  
+                    fig.canvas.flush_events()  
+                    plt.pause(0.1)  
+        finally:
+            # Stop the full-rate camera monitor between scans
+            self.close_stream()
         line1.set_data(positions,wid_x)
         line2.set_data(positions,wid_y)
         ax[0].relim()
@@ -136,18 +147,52 @@ class transfocator_aligner(gigE_camera_accessor):
         plt.show()
         plt.ioff()
         #plt.xlabel('Transfocator Z-Position')
-    def fit_scan(self,x,y):
-        maxi = np.percentile(y,95)
-        mean_ind = np.argmin(y-maxi/2)
-        guess = [maxi, x[mean_ind], np.std(x)]
+    def search_transfocator(self, transfocator_motor, low, high, image_sec, width_method='gauss', min_frames=10, **kwargs):
+        """
+        Adaptive search for the transfocator position of the smallest beam
+
+        A coarse grid between low and high is refined by golden-section
+        search on the mean of the x and y FWHM, see
+        tfs.focus_search.golden_section_focus for the stopping criteria in
+        kwargs (coarse, width_tolerance in pixels, position_tolerance,
+        max_moves). The motor is left at the best position.
+        """
+        stream=self.get_stream()
+        def measure(pos):
+            transfocator_motor.umv(pos)
+            stream.reset()
+            images,img_count=stream.average(duration=image_sec,min_frames=min_frames)
+            self.active_image=images-np.min(images)
+            width_x,width_y=image_widths(self.active_image,method=width_method)
+            return (width_x.fwhm+width_y.fwhm)/2, img_count
         try:
-            popt, pcov = curve_fit(gaussian, x, y,np.array(guess),maxfev=999999)
-        except RuntimeError:
-            guess_width_high=np.percentile(y,75)
-            guess_width_low=np.percentile(y,25)
+            result=golden_section_focus(measure,low,high,**kwargs)
+            transfocator_motor.umv(result.position)
+        finally:
+            self.close_stream()
+        order=np.argsort(result.positions)
+        fig, ax=plt.subplots()
+        fig.suptitle('Transfocator Focus Search')
+        ax.plot(result.positions[order],result.widths[order],'ro-')
+        ax.axvline(result.position)
+        ax.set_ylabel('Mean FWHM')
+        ax.set_xlabel('Transfocator Z-position')
+        plt.show()
+        print('Best focus at {:.3f} (mean FWHM {:.2f}) after {} moves and {} frames'.format(
+            result.position, result.width, result.moves, result.frames))
+        return result
+    def fit_scan(self,x,y):
+        """
+        Gaussian fit of a projection, as [amplitude, mean, stddev] of gaussian
+        below, [0,0,0,0] if it fails
+        """
+        fit = gauss_newton(y)
+        if not np.isfinite(fit.fwhm):
             print('bad fit')
             return [0,0,0,0]
-        return popt 
+        step = x[1]-x[0] if len(x)>1 else 1
+        sigma = fit.fwhm/fwhm_per_sigma*step
+        return [fit.amplitude, x[0]+fit.center*step, sigma/(2*np.sqrt(2))]
 def gaussian(x, amplitude, mean, stddev):
 	return amplitude * np.exp(-((x - mean) / 4 / stddev)**2)
 
@@ -1,7 +1,10 @@
 import numpy as np
 import periodictable as pt
 import logging
+from collections import OrderedDict
 import pcdscalc as calc
+# the submodule is not loaded by the package itself
+import pcdscalc.be_lens_calcs
 
 logger = logging.getLogger(__name__)
 # Constants
@@ -20,15 +23,174 @@ MFX_prefocus_energy_range = {
 }
 
 
+class LRUCache:
+    """
+    Bounded least-recently-used cache with hit and miss counters
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries, the least recently used entry is evicted
+        beyond that
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._evict()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data),
+                'maxsize': self.maxsize}
+
+
+# Caches of lens calculations keyed on (radius [um], quantized energy [eV])
+_caches = {'focal_length': LRUCache(), 'transmission': LRUCache()}
+# Energy quantization [eV] of the cache keys, 0 disables quantization
+_energy_resolution = 0.01
+
+
+def configure_cache(maxsize=None, energy_resolution=None):
+    """
+    Configure the focal length and transmission caches
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of cached (radius, energy) pairs per cache
+
+    energy_resolution : float, optional
+        Energies are rounded to a multiple of this value [eV] before any
+        calculation. 0 disables rounding. Changing it clears the caches
+    """
+    global _energy_resolution
+    for cache in _caches.values():
+        if maxsize is not None:
+            cache.resize(maxsize)
+        if energy_resolution is not None and energy_resolution != _energy_resolution:
+            cache.clear()
+    if energy_resolution is not None:
+        _energy_resolution = energy_resolution
+
+
+def cache_info():
+    """
+    Hits, misses, evictions and size of each cache
+    """
+    return {name: cache.info() for name, cache in _caches.items()}
+
+
+def clear_cache():
+    for cache in _caches.values():
+        cache.clear()
+
+
+def quantize_energy(energy):
+    """
+    Round energies to the cache energy resolution
+    """
+    if not _energy_resolution:
+        return energy
+    return np.round(np.asarray(energy) / _energy_resolution) * _energy_resolution
+
+
+def _cached(name, func, radius, energy):
+    """
+    Evaluate ``func(radius, energy)`` through the cache ``name``
+
+    Array inputs are broadcast and every pair missing from the cache is
+    passed to ``func`` in a single call.
+    """
+    cache = _caches[name]
+    if not (np.ndim(radius) or np.ndim(energy)):
+        key = (float(radius), float(quantize_energy(energy)))
+        value = cache.get(key)
+        if value is None:
+            value = func(*key)
+            cache.put(key, value)
+        return value
+    radius, energy = np.broadcast_arrays(np.asarray(radius, dtype=float),
+                                         np.asarray(energy, dtype=float))
+    keys = np.stack([radius.ravel(), quantize_energy(energy.ravel())], axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    values = np.empty(len(unique))
+    missing = []
+    for i, (r, e) in enumerate(unique):
+        value = cache.get((r, e))
+        if value is None:
+            missing.append(i)
+        else:
+            values[i] = value
+    if missing:
+        r, e = unique[missing].T
+        values[missing] = func(r, e)
+        for key, value in zip(unique[missing], values[missing]):
+            cache.put(tuple(key), value)
+    return values[inverse.ravel()].reshape(radius.shape)
+
+
+def _focal_length(radius, energy):
+    return calc.be_lens_calcs.calc_focal_length_for_single_lens(energy*1E-3,radius*1E-6)
+
+
 def focal_length(radius, energy,N=1):
     """
     Calculate focal length using the pcds version of the focal length calculator
+
+    Results are cached per (radius, energy). ``radius`` and ``energy`` can
+    also be arrays, in which case all focal lengths missing from the cache
+    are calculated in a single call and an array is returned.
     """
     if N!=1:
         logger.error('N does not equal 1!')
-    focal_length = calc.be_lens_calcs.calc_focal_length_for_single_lens(energy*1E-3,radius*1E-6)
-    
-    return focal_length
+    return _cached('focal_length', _focal_length, radius, energy)
+
+
+def _lens_transmission(radius, energy, fwhm_unfocused=300E-6):
+    return calc.be_lens_calcs.calc_trans_for_single_lens(
+        energy*1E-3, radius*1E-6, fwhm_unfocused=fwhm_unfocused)
+
+
+def lens_transmission(radius, energy):
+    """
+    Transmission of a single lens using the pcds transmission calculator
+
+    Cached and array-capable like :func:`focal_length`.
+    """
+    return _cached('transmission', _lens_transmission, radius, energy)
 
 
 def focal_length_old(radius, energy, N=1):
@@ -53,6 +215,12 @@ def focal_length_old(radius, energy, N=1):
 
 
 def estimate_beam_fwhm(radius, energy, fwhm_unfocused = 300E-6, distance = 4.474):
+    """
+    Estimate the beam size at ``distance`` from a lens of ``radius``
+
+    ``radius`` and ``energy`` can be arrays, in which case the sizes are
+    returned as an array and nothing is logged.
+    """
     focal_len = focal_length(radius,energy)
     lam = calc.be_lens_calcs.photon_to_wavelength(energy) * 1E-9
     w_unfocused = calc.be_lens_calcs.gaussian_fwhm_to_sigma(fwhm_unfocused)*2
@@ -60,10 +228,10 @@ def estimate_beam_fwhm(radius, energy, fwhm_unfocused = 300E-6, distance = 4.474
     rayleigh_range = np.pi *waist ** 2 /lam
     size = waist *np.sqrt(1.0 +(distance - focal_len) ** 2.0 / rayleigh_range **2)
     size_fwhm = calc.be_lens_calcs.gaussian_sigma_to_fwhm(size) /2.0
-    waist_rd = '{:0.3e}'.format(waist)
-    rayleigh_rang_rd = '{:0.3e}'.format(rayleigh_range)
-    logger.info(f'waist: {waist_rd}')
-    logger.info(f'rayleigh_range: {rayleigh_rang_rd}')
-    logger.info(f'size_fwhm: {round(size_fwhm*1e6, 2)} um\n')
+    if np.ndim(size_fwhm):
+        return size_fwhm
+    logger.info('waist: %0.3e', waist)
+    logger.info('rayleigh_range: %0.3e', rayleigh_range)
+    logger.info('size_fwhm: %s um\n', round(size_fwhm*1e6, 2))
 
-    return size_fwhm
\ No newline at end of file
+    return size_fwhm
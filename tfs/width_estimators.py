@@ -0,0 +1,290 @@
+"""
+Beam width estimators for stacks of beam profiles
+
+Every estimator takes an array of profiles of shape (..., N), e.g. the x or
+y projections of a whole image stack, and returns a :class:`BeamWidth` with
+arrays of shape (...,). Widths are full widths at half maximum in pixels so
+that the estimators can be swapped freely.
+"""
+############
+# Standard #
+############
+import logging
+from collections import namedtuple
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# Ratio of the FWHM to the standard deviation of a Gaussian
+fwhm_per_sigma = 2*np.sqrt(2*np.log(2))
+
+
+class BeamWidth(namedtuple('BeamWidth', ['center', 'fwhm', 'amplitude'])):
+    """
+    Center, full width at half maximum and peak height of profiles, NaN
+    where the estimate failed
+    """
+    __slots__ = ()
+
+
+def _despike(profiles):
+    """
+    Running median over three samples, removing single hot pixels
+    """
+    padded = np.concatenate([profiles[..., :1], profiles,
+                             profiles[..., -1:]], axis=-1)
+    a, b, c = padded[..., :-2], padded[..., 1:-1], padded[..., 2:]
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+
+def _prepare(profiles, background=True, despike=False):
+    profiles = np.asarray(profiles, dtype=float)
+    if despike:
+        profiles = _despike(profiles)
+    if background:
+        profiles = profiles - profiles.min(axis=-1, keepdims=True)
+    return profiles, np.arange(profiles.shape[-1], dtype=float)
+
+
+def second_moment(profiles, background=True, threshold=0.1, despike=True):
+    """
+    Width from the first and second moments of the profiles
+
+    Fastest of the estimators. Samples below ``threshold`` times the peak are
+    ignored, as background far from the beam dominates the second moment.
+
+    Parameters
+    ----------
+    profiles : array-like
+        Array of shape (..., N)
+
+    background : bool, optional
+        Subtract the minimum of every profile first
+
+    threshold : float, optional
+        Fraction of the peak below which samples are ignored
+
+    despike : bool, optional
+        Remove single hot pixels with a three sample median first
+
+    Returns
+    -------
+    BeamWidth
+    """
+    profiles, x = _prepare(profiles, background, despike)
+    amplitude = profiles.max(axis=-1)
+    if threshold:
+        profiles = np.where(profiles >= threshold*amplitude[..., np.newaxis],
+                            profiles, 0.0)
+    total = profiles.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        center = profiles @ x / total
+        var = profiles @ x**2 / total - center**2
+    fwhm = fwhm_per_sigma*np.sqrt(np.where(var > 0, var, np.nan))
+    bad = ~(total > 0)
+    center[bad] = np.nan
+    fwhm[bad] = np.nan
+    return BeamWidth(center, fwhm, amplitude)
+
+
+def fwhm_interp(profiles, background=True, despike=True):
+    """
+    Width between the half maximum crossings around the peak
+
+    The crossings are found walking outwards from the maximum of every
+    profile and placed by linear interpolation between the neighbouring
+    samples. Profiles that do not fall below half maximum on both sides
+    give NaN.
+
+    Parameters
+    ----------
+    profiles : array-like
+        Array of shape (..., N)
+
+    background : bool, optional
+        Subtract the minimum of every profile first
+
+    despike : bool, optional
+        Remove single hot pixels with a three sample median first
+
+    Returns
+    -------
+    BeamWidth
+    """
+    profiles, x = _prepare(profiles, background, despike)
+    shape = profiles.shape[:-1]
+    flat = profiles.reshape(-1, profiles.shape[-1])
+    rows = np.arange(len(flat))
+    peak = np.argmax(flat, axis=-1)
+    amplitude = flat[rows, peak]
+    above = flat >= amplitude[:, np.newaxis]/2
+    # The last sample below half maximum left of the peak and the first one
+    # right of it
+    left_of_peak = x[np.newaxis, :] < peak[:, np.newaxis]
+    right_of_peak = x[np.newaxis, :] > peak[:, np.newaxis]
+    below_left = ~above & left_of_peak
+    below_right = ~above & right_of_peak
+    has_left = below_left.any(axis=-1)
+    has_right = below_right.any(axis=-1)
+    lo = len(x) - 1 - np.argmax(below_left[:, ::-1], axis=-1)
+    hi = np.argmax(below_right, axis=-1)
+    half = amplitude/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y0, y1 = flat[rows, lo], flat[rows, np.minimum(lo + 1, len(x) - 1)]
+        left = lo + (half - y0)/(y1 - y0)
+        y0, y1 = flat[rows, np.maximum(hi - 1, 0)], flat[rows, hi]
+        right = hi - 1 + (half - y0)/(y1 - y0)
+    ok = has_left & has_right & (amplitude > 0)
+    fwhm = np.where(ok, right - left, np.nan)
+    center = np.where(ok, (right + left)/2, np.nan)
+    return BeamWidth(center.reshape(shape), fwhm.reshape(shape),
+                     amplitude.reshape(shape))
+
+
+def gauss_newton(profiles, iterations=12, robust=True, background=True,
+                 huber=2.0):
+    """
+    Least-squares fit of a Gaussian on a constant background
+
+    All profiles are fit at once by a fixed number of damped Gauss-Newton
+    steps with the analytic Jacobian of ``a*exp(-(x-mu)^2/(2*s^2)) + b``,
+    starting from the :func:`.second_moment` estimate. With ``robust``,
+    samples are reweighted with Huber weights every step, so isolated hot
+    pixels do not pull the fit. Unlike ``curve_fit`` the run time does not
+    depend on the data, fits that do not converge give NaN.
+
+    Parameters
+    ----------
+    profiles : array-like
+        Array of shape (..., N)
+
+    iterations : int, optional
+        Number of Gauss-Newton steps
+
+    robust : bool, optional
+        Use Huber weights instead of plain least squares
+
+    background : bool, optional
+        Subtract the minimum of every profile first
+
+    huber : float, optional
+        Residual, in units of the estimated noise, beyond which the weight
+        of a sample is reduced
+
+    Returns
+    -------
+    BeamWidth
+    """
+    profiles, x = _prepare(profiles, background)
+    shape = profiles.shape[:-1]
+    flat = profiles.reshape(-1, profiles.shape[-1])
+    # Start from the despiked profiles, so a hot pixel is not taken as peak
+    start = second_moment(flat, background=False, threshold=0.5)
+    a = start.amplitude
+    mu = np.where(np.isfinite(start.center), start.center, len(x)/2)
+    s = np.where(np.isfinite(start.fwhm), start.fwhm/fwhm_per_sigma,
+                 len(x)/8)
+    s = np.maximum(s, 1.0)
+    b = np.zeros(len(flat))
+    weights = np.ones_like(flat)
+    damping = 1e-3
+    for _ in range(iterations):
+        u = (x[np.newaxis, :] - mu[:, np.newaxis])/s[:, np.newaxis]
+        g = np.exp(-u**2/2)
+        residual = flat - (a[:, np.newaxis]*g + b[:, np.newaxis])
+        if robust:
+            # Noise from the median absolute residual
+            scale = 1.4826*np.median(np.abs(residual), axis=-1, keepdims=True)
+            scale = np.maximum(scale, 1e-12)
+            r = np.abs(residual)/(huber*scale)
+            weights = np.where(r > 1, 1/np.maximum(r, 1), 1.0)
+        ag = a[:, np.newaxis]*g
+        jac = np.stack([g,
+                        ag*u/s[:, np.newaxis],
+                        ag*u**2/s[:, np.newaxis],
+                        np.ones_like(g)], axis=-1)
+        # Weighted normal equations, one 4x4 system per profile
+        jw = np.swapaxes(jac*weights[..., np.newaxis], 1, 2)
+        lhs = jw @ jac
+        rhs = jw @ residual[..., np.newaxis]
+        diag = lhs[:, np.arange(4), np.arange(4)]
+        lhs[:, np.arange(4), np.arange(4)] += damping*diag + 1e-12
+        step = np.linalg.solve(lhs, rhs)[..., 0]
+        a = a + step[:, 0]
+        mu = mu + step[:, 1]
+        # Keep the width positive, at most halving it per step
+        s = np.maximum(s + step[:, 2], s/2)
+        b = b + step[:, 3]
+    ok = (np.isfinite(s) & np.isfinite(mu) & (a > 0)
+          & (mu > -len(x)) & (mu < 2*len(x)))
+    return BeamWidth(np.where(ok, mu, np.nan).reshape(shape),
+                     np.where(ok, fwhm_per_sigma*s, np.nan).reshape(shape),
+                     np.where(ok, a, np.nan).reshape(shape))
+
+
+estimators = {'moment': second_moment,
+              'fwhm': fwhm_interp,
+              'gauss': gauss_newton}
+
+
+def get_estimator(method):
+    """
+    Estimator function from its name in ``estimators``, callables are
+    returned unchanged
+    """
+    if callable(method):
+        return method
+    try:
+        return estimators[method]
+    except KeyError:
+        raise ValueError("Unknown width estimator {!r}, choose from {}"
+                         "".format(method, ', '.join(estimators))) from None
+
+
+def projections(images):
+    """
+    X and Y projections of an image or a stack of images
+
+    Parameters
+    ----------
+    images : array-like
+        Array of shape (..., height, width)
+
+    Returns
+    -------
+    tuple
+        (x projections of shape (..., width),
+         y projections of shape (..., height))
+    """
+    images = np.asarray(images, dtype=float)
+    return images.sum(axis=-2), images.sum(axis=-1)
+
+
+def image_widths(images, method='gauss', **kwargs):
+    """
+    Beam widths along x and y for an image or a stack of images
+
+    Parameters
+    ----------
+    images : array-like
+        Array of shape (..., height, width)
+
+    method : str or callable, optional
+        Name in ``estimators`` or a function with the same signature
+
+    kwargs
+        Passed to the estimator
+
+    Returns
+    -------
+    tuple
+        (x BeamWidth, y BeamWidth)
+    """
+    estimator = get_estimator(method)
+    x, y = projections(images)
+    return estimator(x, **kwargs), estimator(y, **kwargs)